@@ -1,16 +1,26 @@
 import streamlit as st
 from data import Dataset
-from engine import process_user_query
+from engine import stream_user_query
+from tracing import tracer
+from logs import LogSink, DEBUG
+from collections import deque
 from datetime import datetime
-from app.const import DATE_TIME_PATTERN
+from app.const import (
+    DATE_TIME_PATTERN,
+    LOG_BUFFER_SIZE,
+    LOG_LEVEL,
+    DEFAULT_PLAN_MODE,
+)
+import json
 
 # Page config
 st.set_page_config(page_title="Data Analyst Agent", layout="centered")
 st.title("🤖 Data Analyst Agent")
 
 
-# Cache dataset loading
-@st.cache_data(show_spinner="Loading dataset, please wait...")
+# Load the dataset once per process and share it across sessions, without copying.
+# Its base DataFrame is never modified; each session keeps its own view of it.
+@st.cache_resource(show_spinner="Loading dataset, please wait...")
 def load_bitext_dataset():
     ds = Dataset()
     return ds
@@ -22,14 +32,48 @@ if "response" not in st.session_state:
 if "submitted" not in st.session_state:
     st.session_state.submitted = False
 
+# Keep only the most recent log messages, so long sessions don't grow without bound
 if "logs" not in st.session_state:
-    st.session_state.logs = []
+    st.session_state.logs = deque(maxlen=LOG_BUFFER_SIZE)
+
+if "trace_id" not in st.session_state:
+    st.session_state.trace_id = None
 
 # Developer mode checkbox
 st.sidebar.checkbox("Developer Mode", value=False, key="developer_mode")
 
+# Plan mode: plan all tool calls in one LLM request instead of one step at a time
+st.sidebar.checkbox("Plan Mode", value=DEFAULT_PLAN_MODE, key="plan_mode")
+
 if st.session_state.developer_mode:
     st.sidebar.button("Clear Logs", on_click=lambda: st.session_state.logs.clear())
+
+    # Spans of the last query, from the tracer's ring buffer
+    spans = (
+        tracer.recent(st.session_state.trace_id) if st.session_state.trace_id else []
+    )
+    if spans:
+        with st.sidebar.expander("Trace of the last query", expanded=False):
+            st.dataframe(
+                [
+                    {
+                        "span": span.name,
+                        "ms": round(span.duration * 1000, 1),
+                        "prompt tokens": span.attributes.get("prompt_tokens"),
+                        "completion tokens": span.attributes.get("completion_tokens"),
+                        "status": span.status,
+                    }
+                    for span in spans
+                ],
+                hide_index=True,
+            )
+            st.download_button(
+                "Download trace (OTLP JSON)",
+                json.dumps(tracer.to_otlp(spans)),
+                file_name=f"trace-{st.session_state.trace_id}.json",
+                mime="application/json",
+            )
+
     for message in st.session_state.logs:
         st.sidebar.text(message)
 
@@ -45,12 +89,13 @@ def log(message, print_to_sidebar=True):
 
 # Initialize session state for data and messages
 if "data" not in st.session_state:
-    st.session_state.data = load_bitext_dataset()
-    log("Dataset loaded and cached.")
+    st.session_state.data = load_bitext_dataset().reset()
+    log("Dataset view created over the shared dataset.")
 
 
 def on_reset_click():
-    st.session_state.data = load_bitext_dataset()
+    # Filters are copy-on-write views, so resetting only swaps back to the full view
+    st.session_state.data = st.session_state.data.reset()
     st.session_state.user_query = ""
     st.session_state.response = ""
     st.session_state.submitted = False
@@ -80,21 +125,52 @@ with st.form("user_form", clear_on_submit=False, border=False):
     )
 
 
-if st.session_state.submitted:
-    if not st.session_state.response:
-        with st.spinner("Processing your question..."):
-            output = process_user_query(
-                st.session_state.user_query,
-                st.session_state.data,
-                log,
-            )
-
-            st.session_state.data = output["dataset"]
-            st.session_state.response = output["response"]
+def stream_answer(status):
+    """
+    Run the agent on the user query, reporting its steps in the status container
+    and yielding the final answer as it is generated.
+    """
+    # The full LLM messages and responses are only serialized in developer mode
+    log_function = LogSink(
+        log, level=DEBUG if st.session_state.developer_mode else LOG_LEVEL
+    )
+    for event in stream_user_query(
+        st.session_state.user_query,
+        st.session_state.data,
+        log_function,
+        plan_mode=st.session_state.plan_mode,
+    ):
+        if event["type"] == "tool_started":
+            status.write(f"Running `{event['name']}`...")
+        elif event["type"] == "tool_finished" and event["error"]:
+            status.write(f"`{event['name']}` failed.")
+        elif event["type"] == "plan_discarded":
+            status.write("The plan failed, answering step by step instead...")
+        elif event["type"] == "token":
+            yield event["text"]
+        elif event["type"] == "final":
+            st.session_state.data = event["dataset"]
+            st.session_state.response = event["response"]
+            st.session_state.trace_id = event["trace_id"]
             log(f"Generated response: '{st.session_state.response}'")
 
-    st.markdown("### 💬 Agent Response")
-    st.write(f"""{st.session_state.response}""")
+
+if st.session_state.submitted:
+    if not st.session_state.response:
+        status = st.status("Processing your question...")
+        st.markdown("### 💬 Agent Response")
+        answer = st.empty()
+        with answer.container():
+            streamed = st.write_stream(stream_answer(status))
+        status.update(label="Done", state="complete", expanded=False)
+
+        # Show the final response in place of the streamed text when they differ, e.g.
+        # when nothing was streamed or a streamed step was rejected and requested again
+        if streamed != st.session_state.response:
+            answer.write(f"""{st.session_state.response}""")
+    else:
+        st.markdown("### 💬 Agent Response")
+        st.write(f"""{st.session_state.response}""")
 
     st.button("Ask a new question", on_click=on_reset_click)
 
@@ -4,27 +4,150 @@ DATE_TIME_PATTERN = "%H:%M:%S"
 
 DATASET_NAME = "bitext/Bitext-customer-support-llm-chatbot-training-dataset"
 SPLIT = "train"
+CATEGORICAL_COLUMNS = ["category", "intent", "flags"]
+
+# Local columnar snapshot of the dataset (Arrow IPC), memory-mapped on later loads
+DATASET_SNAPSHOT_DIR = os.path.join(".cache", "datasets")
+DATASET_SNAPSHOT_FORMAT_VERSION = 2
+# Hub revision (branch, tag or commit) of the dataset; None uses any existing snapshot
+# without contacting the Hub. When pinned, the snapshot is rebuilt if the revision
+# resolves to another commit.
+DATASET_REVISION = os.getenv("DATASET_REVISION")
+DATASET_REVISION_TIMEOUT = 5.0  # Seconds to resolve it before using the snapshot as is
+
+# Full-text search over the instruction and response columns (BM25)
+SEARCH_FIELD_WEIGHTS = {
+    "instruction": 2.0,
+    "response": 1.0,
+}  # Weight of a term per column
+SEARCH_BM25_K1 = 1.2
+SEARCH_BM25_B = 0.75
+SEARCH_DEFAULT_TOP_K = 200  # Rows kept by a search
+SEARCH_INDEX_FORMAT_VERSION = 1
+
+# Examples returned by the show_examples tool
+SHOW_EXAMPLES_COLUMNS = ["instruction", "category", "intent", "response"]  # Default
+SHOW_EXAMPLES_SEED = 0  # Seed of the shuffle the examples are paged through
+SHOW_EXAMPLES_MAX_FIELD_CHARS = 500  # Longer text fields are truncated
+SHOW_EXAMPLES_MAX_CHARS = 8000  # Cap on the serialized examples of one call
 
 MODEL_NAME = "gpt-4o-mini"  # "meta-llama/Meta-Llama-3.1-70B-Instruct"  # "Qwen/Qwen2.5-72B-Instruct"  # "Qwen/Qwen2.5-32B-Instruct"
-BASE_URL = None  # "https://api.studio.nebius.com/v1/"
+BASE_URL = os.getenv("LLM_BASE_URL")  # "https://api.studio.nebius.com/v1/"
 API_KEY_ENV_VAR = "OPENAI_API_KEY"  # "NEBIUS_STUDIO_API_KEY"
 TEMPERATURE = 0.0
 TOP_P = 1.0
 DEFAULT_TOOL_CHOICE = "auto"
 DEFAULT_PARALLEL_TOOL_CALLS = False
 
+# Model and endpoint of each role of LLM calls. A role can be sent to a smaller model
+# or a local OpenAI-compatible server with e.g. LLM_REACT_STEP_MODEL and
+# LLM_REACT_STEP_BASE_URL; roles default to MODEL_NAME at BASE_URL.
+LLM_ROLES = ["react_step", "plan", "summarize_map", "summarize_reduce"]
+LLM_ROLE_MODELS = {
+    role: (
+        os.getenv(f"LLM_{role.upper()}_MODEL", MODEL_NAME),
+        os.getenv(f"LLM_{role.upper()}_BASE_URL", BASE_URL),
+    )
+    for role in LLM_ROLES
+}
+# Stronger model a call is sent to again when the output of its role's model fails
+# validation or looks unreliable (truncated, refused or empty). Unset disables it.
+LLM_ESCALATION_MODEL = os.getenv("LLM_ESCALATION_MODEL")
+LLM_ESCALATION_BASE_URL = os.getenv("LLM_ESCALATION_BASE_URL", BASE_URL)
+
+# Limits of the HTTP connection pool of each LLM client (one per endpoint)
+LLM_MAX_CONNECTIONS = 20
+LLM_MAX_KEEPALIVE_CONNECTIONS = 10
+LLM_KEEPALIVE_EXPIRY = 30.0  # Seconds an idle connection is kept open
+LLM_CONNECT_TIMEOUT = 5.0
+LLM_REQUEST_TIMEOUT = 120.0
+
+# Process-wide throttling and retries of LLM requests (0 disables a rate limit)
+LLM_REQUESTS_PER_MINUTE = int(os.getenv("LLM_REQUESTS_PER_MINUTE", "500"))
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", "200000"))
+LLM_MAX_RETRIES = 5  # Retries of rate limited (429), timed out and 5xx requests
+LLM_RETRY_BASE_DELAY = 0.5  # Seconds before the first retry, doubled on each retry
+LLM_RETRY_MAX_DELAY = 30.0
+LLM_CALL_DEADLINE = 300.0  # Seconds a call may take, including throttling and retries
+
+# On-disk cache of LLM responses (only deterministic, temperature 0 requests are cached)
+LLM_CACHE_ENABLED = True
+LLM_CACHE_FILE_PATH = os.path.join(".cache", "llm_responses.sqlite")
+LLM_CACHE_TTL = 7 * 24 * 60 * 60  # Seconds before a cached response expires
+LLM_CACHE_MAX_ENTRIES = 10000  # Least recently used entries are evicted beyond this
+
 MAX_CALL_DEPTH = 150
 
+# Answer known structured questions (e.g. "What categories exist?") directly from the
+# dataset, without LLM requests
+ROUTER_ENABLED = True
+
+# In-memory cache of deterministic tool results, keyed on the dataset view
+TOOL_CACHE_ENABLED = True
+TOOL_CACHE_MAX_ENTRIES = 1024
+
+# Headless batch mode (batch.py)
+BATCH_DEFAULT_WORKERS = 4  # Questions answered concurrently
+BATCH_DEFAULT_QUESTIONS_PER_MINUTE = 60  # Questions started per minute
+
+# Tracing of LLM requests, tool executions and summarize batches
+TRACE_BUFFER_SIZE = 2000  # Most recent spans kept in memory
+TRACE_JSONL_FILE_PATH = os.getenv("TRACE_JSONL_FILE_PATH")  # Also append spans here
+TRACE_SERVICE_NAME = "data-analyst-agent"
+LOG_BUFFER_SIZE = 500  # Most recent log messages kept in the session
+
+# Logging of the agent steps
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")  # DEBUG also logs LLM messages and responses
+LOG_DEBUG_SAMPLE_RATE = 1.0  # Fraction of the DEBUG records that are logged
+
+# Context compaction for the ReAct loop
+CONTEXT_TOKEN_BUDGET = 24000  # Maximum prompt tokens sent per LLM request
+CONTEXT_KEEP_LAST_OBSERVATIONS = 4  # Most recent tool outputs that are sent in full
+CONTEXT_MAX_OBSERVATION_TOKENS = 2000  # Larger tool outputs are always elided
+CONTEXT_PREVIEW_CHARS = 200  # Length of the preview kept for an elided tool output
+
 SYSTEM_PROMPT_FILE_NAME = "gpt_4o_mini_react_agent_system_prompt.txt"
 STSTEM_PROMPT_FILE_PATH = os.path.join("prompts", SYSTEM_PROMPT_FILE_NAME)
 
+# Appended to the system prompt when parallel tool calls are enabled
+PARALLEL_TOOL_CALLS_PROMPT_FILE_NAME = "parallel_tool_calls_prompt.txt"
+PARALLEL_TOOL_CALLS_PROMPT_FILE_PATH = os.path.join(
+    "prompts", PARALLEL_TOOL_CALLS_PROMPT_FILE_NAME
+)
+PARALLEL_TOOL_CALLS_MAX_WORKERS = 8
+
+# Plan mode: the LLM writes all tool calls as one plan, which is executed locally
+# (independent steps concurrently) before a single request phrases the answer
+DEFAULT_PLAN_MODE = False
+PLAN_MODE_PROMPT_FILE_NAME = "plan_mode_prompt.txt"
+PLAN_MODE_PROMPT_FILE_PATH = os.path.join("prompts", PLAN_MODE_PROMPT_FILE_NAME)
+
 SUMMARIZE_BATCH_PROMPT_FILE_NAME = "summarize_batch_prompt.txt"
 SUMMARIZE_BATCH_PROMPT_FILE_PATH = os.path.join(
     "prompts", SUMMARIZE_BATCH_PROMPT_FILE_NAME
 )
 
-SUMMARIZE_DEFAULT_N_BATCHES = 5
-SUMMARIZE_DEFAULT_BATCH_SIZE = 20
+# Tree summarization: batches of rows are summarized, then combined level by level
+# Rows sampled for a summary: about 5 batches and one reduce on Bitext rows. Raise it
+# (e.g. to 500) to cover whole categories, at the cost of more batch and reduce requests
+SUMMARIZE_MAX_ROWS = int(os.getenv("SUMMARIZE_MAX_ROWS", "100"))
+SUMMARIZE_BATCH_TOKEN_BUDGET = 4000  # Maximum tokens of rows per batch
+SUMMARIZE_REDUCE_FAN_IN = 5  # Summaries combined into one per reduce request
+SUMMARIZE_NOVELTY_THRESHOLD = 0.3  # Stop once a wave adds a smaller share of new words
+SUMMARIZE_MAX_CONCURRENCY = 5  # Maximum number of batch requests in flight at once
+SUMMARIZE_BATCH_TIMEOUT = 60.0  # Seconds before a single batch request is abandoned
+
+SUMMARIZE_SAMPLING_SEED = 0  # Seed of the rows sampled for summarization
+
+# Representative sampling of rows for summarization
+# Columns the sample is stratified on, coarsest first; a column only refines the strata
+# while the sample is large enough to cover them all
+SAMPLING_STRATIFY_COLUMNS = ["category", "intent", "flags"]
+SAMPLING_TEXT_COLUMN = "instruction"  # Near-duplicates are detected on this column
+SAMPLING_NUM_PERM = 32  # MinHash signature length
+SAMPLING_BANDS = 4  # LSH bands; rows agreeing on a whole band are near-duplicates
+SAMPLING_SHINGLE_SIZE = 2  # Words per shingle
+SAMPLING_MEDOID_CANDIDATES = 64  # Cluster members compared to pick a representative
 
 SUMMARIZE_ALL_BATCHES_PROMPT_FILE_NAME = "summarize_all_batches_prompt.txt"
 SUMMARIZE_ALL_BATCHES_PROMPT_FILE_PATH = os.path.join(
@@ -0,0 +1,278 @@
+"""
+Headless batch mode: answers the questions of a JSONL file with the agent.
+
+Each input line is a JSON object with a "question" (and optionally an "id"; the line
+number is used otherwise). A line that is not valid JSON or has no question is recorded
+as a failed entry. The questions run concurrently on a pool of workers, each on its own
+view of one shared dataset, and start no faster than the given rate. The LLM requests
+themselves are still throttled by the process-wide llm.limiter.
+Every answer is appended to the output JSONL as soon as it is ready, with its step
+count, LLM requests, tokens and timings. Rerunning with the same output file skips the
+questions that were already answered, so an interrupted run can be resumed.
+
+Run from the repository root:
+    python batch.py questions.jsonl answers.jsonl --workers 8 --rate 120
+"""
+
+from app.const import (
+    BATCH_DEFAULT_WORKERS,
+    BATCH_DEFAULT_QUESTIONS_PER_MINUTE,
+    DEFAULT_PARALLEL_TOOL_CALLS,
+    DEFAULT_PLAN_MODE,
+)
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+from data import Dataset
+from logs import LogSink
+from tracing import Span, tracer
+import engine
+import argparse
+import json
+import os
+import threading
+import time
+
+
+class QuestionPacer:
+    """
+    Spaces out the starts of questions evenly to at most a given number per minute,
+    across threads. LLM requests and tokens are limited separately by llm.limiter.
+    """
+
+    def __init__(self, per_minute: float):
+        self.interval = 60.0 / per_minute if per_minute > 0 else 0.0
+        self._next_time = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Wait until the next question may start.
+        """
+        with self._lock:
+            now = time.monotonic()
+            start_time = max(now, self._next_time)
+            self._next_time = start_time + self.interval
+        if start_time > now:
+            time.sleep(start_time - now)
+
+
+class TraceSpans:
+    """
+    Tracer exporter that keeps every finished span of the traces being watched, so the
+    statistics of a question do not depend on the size of the tracer's ring buffer.
+    """
+
+    def __init__(self):
+        self._spans: Dict[str, List[Span]] = {}
+        self._lock = threading.Lock()
+
+    def watch(self, trace_id: str):
+        """
+        Start keeping the spans of a trace.
+        """
+        with self._lock:
+            self._spans[trace_id] = []
+
+    def pop(self, trace_id: str) -> List[Span]:
+        """
+        Stop watching a trace.
+        Args:
+            trace_id (str): The trace.
+        Returns:
+            List[Span]: The spans of the trace finished since it was watched.
+        """
+        with self._lock:
+            return self._spans.pop(trace_id, [])
+
+    def __call__(self, span: Span):
+        with self._lock:
+            spans = self._spans.get(span.trace_id)
+            if spans is not None:
+                spans.append(span)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("input", help="JSONL file of questions.")
+    parser.add_argument("output", help="JSONL file the answers are appended to.")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=BATCH_DEFAULT_WORKERS,
+        help="Questions answered concurrently.",
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=BATCH_DEFAULT_QUESTIONS_PER_MINUTE,
+        help="Maximum questions started per minute (0 for no limit).",
+    )
+    parser.add_argument(
+        "--parallel-tool-calls",
+        action="store_true",
+        default=DEFAULT_PARALLEL_TOOL_CALLS,
+        help="Enable parallel tool calls.",
+    )
+    parser.add_argument(
+        "--plan-mode",
+        action="store_true",
+        default=DEFAULT_PLAN_MODE,
+        help="Answer with a single plan.",
+    )
+    parser.add_argument(
+        "--no-router",
+        action="store_true",
+        help="Send structured questions through the LLM too.",
+    )
+    parser.add_argument(
+        "--log-level", default="WARNING", help="Level of the agent logs printed."
+    )
+    return parser.parse_args()
+
+
+def read_questions(path: str) -> Iterator[Tuple[str, Optional[str], Optional[str]]]:
+    """
+    Read the questions of a JSONL file lazily.
+    Args:
+        path (str): The file.
+    Yields:
+        Tuple[str, Optional[str], Optional[str]]: The id, the question, and the error
+            if the line is not a valid question (the question is then None).
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError as e:
+                yield str(line_number), None, f"Invalid JSON on line {line_number}: {e}"
+                continue
+            if not isinstance(entry, dict):
+                yield str(line_number), None, f"Line {line_number} is not an object."
+                continue
+            question_id = str(entry.get("id", line_number))
+            if not isinstance(entry.get("question"), str):
+                yield question_id, None, f"Line {line_number} has no question."
+                continue
+            yield question_id, entry["question"], None
+
+
+def answered_ids(path: str) -> Set[str]:
+    """
+    Get the ids of the questions already answered in an output file. Questions whose
+    run failed are not included, so that they run again.
+    Args:
+        path (str): The output file.
+    Returns:
+        Set[str]: The ids.
+    """
+    ids = set()
+    if not os.path.exists(path):
+        return ids
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                continue  # A line cut short by an interruption
+            if result.get("error") is None:
+                ids.add(result["id"])
+    return ids
+
+
+def main():
+    args = parse_args()
+
+    done = answered_ids(args.output)
+    if done:
+        print(f"Resuming: {len(done)} questions already answered.")
+
+    # All questions share one dataset; each one starts from its own unfiltered view
+    ds = Dataset()
+    pacer = QuestionPacer(args.rate)
+    log_function = LogSink(print, level=args.log_level.upper())
+    output_lock = threading.Lock()
+    trace_spans = TraceSpans()
+    tracer.exporters.append(trace_spans)
+
+    def write_result(result: dict):
+        with output_lock:
+            with open(args.output, "a", encoding="utf-8") as f:
+                f.write(json.dumps(result) + "\n")
+
+    def answer(question_id: str, question: str) -> dict:
+        pacer.acquire()
+        start_time = time.perf_counter()
+        result = {"id": question_id, "question": question}
+        try:
+            # The question's own span makes its trace id known before the agent runs
+            with tracer.span("batch.question", question_id=question_id) as span:
+                trace_spans.watch(span.trace_id)
+                try:
+                    output = engine.process_user_query(
+                        question,
+                        ds.reset(),
+                        log_function,
+                        llm_parallel_tool_calls=args.parallel_tool_calls,
+                        use_router=not args.no_router,
+                        plan_mode=args.plan_mode,
+                    )
+                finally:
+                    spans = trace_spans.pop(span.trace_id)
+            llm_spans = [span for span in spans if span.name.startswith("llm.")]
+            result.update(
+                response=output["response"],
+                steps=len(output["steps"]),
+                tools=[step["name"] for step in output["steps"]],
+                failed_steps=sum(
+                    1 for step in output["steps"] if step["error"] is not None
+                ),
+                llm_requests=len(llm_spans),
+                prompt_tokens=sum(
+                    span.attributes.get("prompt_tokens", 0) for span in llm_spans
+                ),
+                completion_tokens=sum(
+                    span.attributes.get("completion_tokens", 0) for span in llm_spans
+                ),
+                rows=output["dataset"].count_rows(),
+                trace_id=output["trace_id"],
+                error=None,
+            )
+        except Exception as e:
+            result.update(response=None, error=f"{type(e).__name__}: {e}")
+        result["duration_s"] = round(time.perf_counter() - start_time, 3)
+
+        write_result(result)
+        status = "failed" if result["error"] else f"{result['steps']} steps"
+        print(f"{question_id}: {status} in {result['duration_s']:.2f}s")
+        return result
+
+    # Keep a bounded number of questions in flight, so the input is read lazily
+    answered, failed = 0, 0
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        pending = set()
+        for question_id, question, error in read_questions(args.input):
+            if question_id in done:
+                continue
+            if error is not None:
+                write_result({"id": question_id, "question": None, "error": error})
+                print(f"{question_id}: failed, {error}")
+                answered += 1
+                failed += 1
+                continue
+            if len(pending) >= 2 * args.workers:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    failed += future.result()["error"] is not None
+                    answered += 1
+            pending.add(executor.submit(answer, question_id, question))
+        for future in pending:
+            failed += future.result()["error"] is not None
+            answered += 1
+
+    print(f"Answered {answered} questions ({failed} failed) into {args.output}.")
+
+
+if __name__ == "__main__":
+    main()
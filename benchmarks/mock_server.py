@@ -0,0 +1,282 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from prompt import count_tokens
+from typing import Dict, List
+import json
+import threading
+import time
+
+
+class MockLLMServer:
+    """
+    A local OpenAI-compatible chat completions server that replays scripted trajectories.
+    ReAct requests are matched to a trajectory by the user question; the assistant turn
+    to replay is given by the number of assistant turns already in the conversation.
+    Structured outputs requests (summarize) get a fixed summary, and plan mode requests
+    a plan made of all the scripted tool calls before finish.
+    Supports streaming, reports token usage and simulates a configurable latency.
+    """
+
+    def __init__(
+        self,
+        trajectories: Dict[str, List[dict]],
+        latency: float = 0.0,
+        latency_per_token: float = 0.0,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ):
+        self.trajectories = trajectories
+        self.latency = latency
+        self.latency_per_token = latency_per_token
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                payload = json.loads(
+                    self.rfile.read(int(self.headers["Content-Length"]))
+                )
+                if not self.path.endswith("/chat/completions"):
+                    self.send_error(404)
+                    return
+                server._handle(self, payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer((host, port), Handler)
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "MockLLMServer":
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def reset_stats(self) -> dict:
+        """
+        Reset the request and token counters.
+        Returns:
+            dict: The counters before the reset.
+        """
+        with self._lock:
+            stats = getattr(self, "stats", {})
+            self.stats = {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0}
+        return stats
+
+    def _next_message(self, payload: dict) -> dict:
+        """
+        Pick the scripted assistant message answering a request.
+        Args:
+            payload (dict): The chat completions request.
+        Returns:
+            dict: The assistant message.
+        """
+        messages = payload["messages"]
+        question = next(m["content"] for m in messages if m["role"] == "user")
+        trajectory = self.trajectories.get(question, [])
+
+        response_format = payload.get("response_format")
+        if response_format and response_format["json_schema"]["name"] == "QueryPlan":
+            return {"role": "assistant", "content": json.dumps(self._plan(trajectory))}
+        if response_format:
+            summary = {
+                "reasoning": "Scripted reasoning of the benchmark server.",
+                "summary": "Agents acknowledge the request, explain the next steps and offer further help.",
+            }
+            return {"role": "assistant", "content": json.dumps(summary)}
+
+        step = sum(1 for m in messages if m["role"] == "assistant")
+        tool_choice = payload.get("tool_choice")
+        if isinstance(tool_choice, dict):
+            forced = tool_choice["function"]["name"]
+            # Replay the last scripted turn calling the forced tool
+            step = max(
+                (
+                    i
+                    for i, turn in enumerate(trajectory)
+                    if any(
+                        call["function_type"] == forced
+                        for call in turn.get("tool_calls", [])
+                    )
+                ),
+                default=len(trajectory),
+            )
+        if step < len(trajectory):
+            turn = trajectory[step]
+        else:
+            turn = {
+                "tool_calls": [
+                    {
+                        "function_type": "finish",
+                        "reasoning": "The scripted trajectory is over.",
+                        "final_answer": "Scripted answer of the benchmark server.",
+                    }
+                ]
+            }
+
+        if "content" in turn:
+            return {"role": "assistant", "content": turn["content"]}
+        return {
+            "role": "assistant",
+            "content": None,
+            "tool_calls": [
+                {
+                    "id": f"call_{step}_{index}",
+                    "type": "function",
+                    "function": {
+                        "name": arguments["function_type"],
+                        "arguments": json.dumps(
+                            {"reasoning": "Scripted step.", **arguments}
+                        ),
+                    },
+                }
+                for index, arguments in enumerate(turn["tool_calls"])
+            ],
+        }
+
+    @staticmethod
+    def _plan(trajectory: List[dict]) -> dict:
+        """
+        Turn the scripted tool calls of a trajectory into a plan: each step runs on
+        the dataset of the latest filtering step before it.
+        Args:
+            trajectory (List[dict]): The scripted assistant turns.
+        Returns:
+            dict: The plan.
+        """
+        steps, dataset_from = [], None
+        for turn in trajectory:
+            for arguments in turn.get("tool_calls", []):
+                if arguments["function_type"] == "finish":
+                    continue
+                step_id = f"s{len(steps) + 1}"
+                steps.append(
+                    {
+                        "id": step_id,
+                        "dataset_from": dataset_from,
+                        "references": [],
+                        "function_call": {"reasoning": "Scripted step.", **arguments},
+                    }
+                )
+                if arguments["function_type"].startswith(("select_", "search_")):
+                    dataset_from = step_id
+        return {"reasoning": "Scripted plan of the benchmark server.", "steps": steps}
+
+    def _handle(self, handler: BaseHTTPRequestHandler, payload: dict):
+        message = self._next_message(payload)
+        prompt_tokens = count_tokens(json.dumps(payload["messages"]))
+        completion_tokens = count_tokens(json.dumps(message))
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+        with self._lock:
+            self.stats["requests"] += 1
+            self.stats["prompt_tokens"] += prompt_tokens
+            self.stats["completion_tokens"] += completion_tokens
+
+        base = {
+            "id": "chatcmpl-benchmark",
+            "created": int(time.time()),
+            "model": payload["model"],
+        }
+        finish_reason = "tool_calls" if message.get("tool_calls") else "stop"
+        time.sleep(self.latency)
+
+        if not payload.get("stream"):
+            time.sleep(self.latency_per_token * completion_tokens)
+            body = {
+                **base,
+                "object": "chat.completion",
+                "choices": [
+                    {"index": 0, "message": message, "finish_reason": finish_reason}
+                ],
+                "usage": usage,
+            }
+            data = json.dumps(body).encode("utf-8")
+            handler.send_response(200)
+            handler.send_header("Content-Type", "application/json")
+            handler.send_header("Content-Length", str(len(data)))
+            handler.end_headers()
+            handler.wfile.write(data)
+            return
+
+        handler.send_response(200)
+        handler.send_header("Content-Type", "text/event-stream")
+        handler.send_header("Connection", "close")
+        handler.end_headers()
+
+        def send(delta=None, finish=None, chunk_usage=None):
+            chunk = {
+                **base,
+                "object": "chat.completion.chunk",
+                "choices": (
+                    [{"index": 0, "delta": delta, "finish_reason": finish}]
+                    if delta is not None
+                    else []
+                ),
+                "usage": chunk_usage,
+            }
+            handler.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            handler.wfile.flush()
+
+        # Stream the content or the tool call arguments in pieces of a few characters
+        piece = 16
+        if message.get("tool_calls"):
+            for index, tool_call in enumerate(message["tool_calls"]):
+                arguments = tool_call["function"]["arguments"]
+                send(
+                    {
+                        "role": "assistant",
+                        "tool_calls": [
+                            {
+                                "index": index,
+                                "id": tool_call["id"],
+                                "type": "function",
+                                "function": {
+                                    "name": tool_call["function"]["name"],
+                                    "arguments": "",
+                                },
+                            }
+                        ],
+                    }
+                )
+                for i in range(0, len(arguments), piece):
+                    time.sleep(
+                        self.latency_per_token * count_tokens(arguments[i : i + piece])
+                    )
+                    send(
+                        {
+                            "tool_calls": [
+                                {
+                                    "index": index,
+                                    "function": {"arguments": arguments[i : i + piece]},
+                                }
+                            ]
+                        }
+                    )
+        else:
+            content = message["content"] or ""
+            send({"role": "assistant", "content": ""})
+            for i in range(0, len(content), piece):
+                time.sleep(
+                    self.latency_per_token * count_tokens(content[i : i + piece])
+                )
+                send({"content": content[i : i + piece]})
+        send({}, finish=finish_reason)
+        send(chunk_usage=usage)
+        handler.wfile.write(b"data: [DONE]\n\n")
+        handler.wfile.flush()
+        handler.close_connection = True
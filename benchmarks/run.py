@@ -0,0 +1,269 @@
+"""
+Offline benchmark of the agent against a local mock LLM server.
+
+Drives engine.process_user_query (or engine.stream_user_query with --stream) and
+tools.summarize over the question corpus in benchmarks/corpus.jsonl, and reports per
+query the wall time, LLM round-trips, prompt/completion tokens, tool execution time and
+peak memory. With --baseline, exits with an error when a query needs more round-trips
+or is slower than in a previous run saved with --output.
+
+Run from the repository root:
+    python -m benchmarks.run --latency 0.05 --output results.json
+"""
+
+from benchmarks.mock_server import MockLLMServer
+import argparse
+import contextlib
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+import warnings
+
+CORPUS_FILE_PATH = os.path.join("benchmarks", "corpus.jsonl")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--corpus", default=CORPUS_FILE_PATH)
+    parser.add_argument(
+        "--latency", type=float, default=0.05, help="Seconds per LLM request."
+    )
+    parser.add_argument(
+        "--latency-per-token",
+        type=float,
+        default=0.0,
+        help="Additional seconds per completion token.",
+    )
+    parser.add_argument("--rows", type=int, default=26872, help="Synthetic rows.")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per query.")
+    parser.add_argument("--stream", action="store_true", help="Benchmark streaming.")
+    parser.add_argument(
+        "--parallel-tool-calls", action="store_true", help="Enable parallel tool calls."
+    )
+    parser.add_argument(
+        "--plan-mode", action="store_true", help="Answer with a single plan."
+    )
+    parser.add_argument(
+        "--no-router",
+        action="store_true",
+        help="Send structured questions through the ReAct loop too.",
+    )
+    parser.add_argument(
+        "--use-cache",
+        action="store_true",
+        help="Keep the LLM response and tool result caches across runs.",
+    )
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    parser.add_argument("--baseline", help="Compare against results in this JSON file.")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="Allowed relative wall time regression against the baseline.",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    # Serializing parsed structured outputs for the logs warns on every summarize batch
+    warnings.filterwarnings("ignore", category=UserWarning, module="pydantic")
+
+    with open(args.corpus, "r", encoding="utf-8") as f:
+        corpus = [json.loads(line) for line in f if line.strip()]
+
+    server = MockLLMServer(
+        {entry["question"]: entry.get("trajectory", []) for entry in corpus},
+        latency=args.latency,
+        latency_per_token=args.latency_per_token,
+    ).start()
+
+    # Point the LLM layer at the mock server. BASE_URL is read when app.const is
+    # imported, so the agent modules are imported only after this.
+    os.environ["LLM_BASE_URL"] = server.base_url
+    from app.const import API_KEY_ENV_VAR
+
+    os.environ.setdefault(API_KEY_ENV_VAR, "benchmark")
+
+    from benchmarks.synthetic import SyntheticDataset
+    import engine
+    import llm
+    import tools
+
+    llm.cache.enabled = args.use_cache
+
+    # Accumulate the time spent executing tools
+    tool_time = {"seconds": 0.0}
+    tool_time_lock = threading.Lock()
+    execute_function = tools.execute_function
+
+    def timed_execute_function(function_call, ds):
+        start_time = time.perf_counter()
+        try:
+            return execute_function(function_call, ds)
+        finally:
+            with tool_time_lock:
+                tool_time["seconds"] += time.perf_counter() - start_time
+
+    tools.execute_function = timed_execute_function
+
+    def no_log(message):
+        pass
+
+    ds = SyntheticDataset(n_rows=args.rows)
+
+    def run_query(entry) -> dict:
+        # The summarize tool prints its progress; keep it out of the report
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            return _run_query(entry)
+
+    def _run_query(entry) -> dict:
+        # Runs are independent unless caches are kept
+        if not args.use_cache:
+            tools.tool_cache.clear()
+
+        if entry["type"] == "summarize":
+            view = ds.reset()
+            for column, values in entry.get("filter", {}).items():
+                if column == "category":
+                    view = view.select_semantic_category(values)
+                else:
+                    view = view.select_semantic_intent(values)
+            tools.summarize(entry["question"], view, log_function=no_log)
+            return {"first_token": None}
+
+        if not args.stream:
+            engine.process_user_query(
+                entry["question"],
+                ds.reset(),
+                no_log,
+                llm_parallel_tool_calls=args.parallel_tool_calls,
+                use_router=not args.no_router,
+                plan_mode=args.plan_mode,
+            )
+            return {"first_token": None}
+
+        start_time = time.perf_counter()
+        first_token = None
+        for event in engine.stream_user_query(
+            entry["question"],
+            ds.reset(),
+            no_log,
+            llm_parallel_tool_calls=args.parallel_tool_calls,
+            use_router=not args.no_router,
+            plan_mode=args.plan_mode,
+        ):
+            if event["type"] == "token" and first_token is None:
+                first_token = time.perf_counter() - start_time
+        return {"first_token": first_token}
+
+    results = []
+    for entry in corpus:
+        wall_times, first_tokens, tool_times = [], [], []
+        for _ in range(args.repeat):
+            server.reset_stats()
+            tool_time["seconds"] = 0.0
+            start_time = time.perf_counter()
+            run = run_query(entry)
+            wall_times.append(time.perf_counter() - start_time)
+            tool_times.append(tool_time["seconds"])
+            if run["first_token"] is not None:
+                first_tokens.append(run["first_token"])
+        stats = server.reset_stats()
+
+        # Measure memory in a separate run, since tracing slows everything down
+        tracemalloc.start()
+        run_query(entry)
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        server.reset_stats()
+
+        results.append(
+            {
+                "id": entry["id"],
+                "type": entry["type"],
+                "wall_time": statistics.median(wall_times),
+                "first_token_time": (
+                    statistics.median(first_tokens) if first_tokens else None
+                ),
+                "llm_round_trips": stats["requests"],
+                "prompt_tokens": stats["prompt_tokens"],
+                "completion_tokens": stats["completion_tokens"],
+                "tool_time": statistics.median(tool_times),
+                "peak_memory_mb": peak_memory / 2**20,
+            }
+        )
+
+    server.stop()
+
+    # Report the results
+    header = f"{'query':<28} {'type':<13} {'wall ms':>8} {'ttft ms':>8} {'calls':>5} {'prompt':>7} {'compl':>6} {'tool ms':>8} {'peak MB':>8}"
+    print(header)
+    print("-" * len(header))
+    for result in results:
+        first_token_time = (
+            f"{result['first_token_time'] * 1000:8.1f}"
+            if result["first_token_time"] is not None
+            else f"{'-':>8}"
+        )
+        print(
+            f"{result['id']:<28} {result['type']:<13} {result['wall_time'] * 1000:8.1f} "
+            f"{first_token_time} {result['llm_round_trips']:5d} {result['prompt_tokens']:7d} "
+            f"{result['completion_tokens']:6d} {result['tool_time'] * 1000:8.1f} "
+            f"{result['peak_memory_mb']:8.2f}"
+        )
+    print("-" * len(header))
+    print(
+        f"{'total':<42} {sum(r['wall_time'] for r in results) * 1000:8.1f} {'':>8} "
+        f"{sum(r['llm_round_trips'] for r in results):5d} "
+        f"{sum(r['prompt_tokens'] for r in results):7d} "
+        f"{sum(r['completion_tokens'] for r in results):6d}"
+    )
+
+    # Requests, tokens and latency per role of LLM call, over all runs
+    print("\nLLM requests per role:")
+    for role, role_stats in llm.models.stats().items():
+        for model, model_stats in role_stats["models"].items():
+            print(
+                f"  {role:<18} {model:<20} {model_stats['requests']:5d} requests "
+                f"{model_stats['prompt_tokens']:8d} prompt {model_stats['completion_tokens']:7d} compl "
+                f"{model_stats['latency_s'] * 1000 / model_stats['requests']:8.1f} ms avg"
+            )
+        if role_stats["escalations"]:
+            print(f"  {role:<18} {role_stats['escalations']} escalated")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = {result["id"]: result for result in json.load(f)}
+        regressions = []
+        for result in results:
+            previous = baseline.get(result["id"])
+            if previous is None:
+                continue
+            if result["llm_round_trips"] > previous["llm_round_trips"]:
+                regressions.append(
+                    f"{result['id']}: {previous['llm_round_trips']} -> {result['llm_round_trips']} LLM round-trips"
+                )
+            if result["wall_time"] > previous["wall_time"] * (1 + args.tolerance):
+                regressions.append(
+                    f"{result['id']}: wall time {previous['wall_time'] * 1000:.1f} -> {result['wall_time'] * 1000:.1f} ms"
+                )
+        if regressions:
+            print("\nRegressions against the baseline:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("\nNo regressions against the baseline.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+from data import Dataset
+from app.const import CATEGORICAL_COLUMNS
+import numpy as np
+import pandas as pd
+
+# Categories and intents shaped like the Bitext dataset
+CATEGORIES = {
+    "ACCOUNT": ["create_account", "delete_account", "edit_account", "recover_password"],
+    "ORDER": ["cancel_order", "change_order", "place_order", "track_order"],
+    "REFUND": ["check_refund_policy", "get_refund", "track_refund"],
+    "SHIPPING": ["change_shipping_address", "set_up_shipping_address"],
+    "PAYMENT": ["check_payment_methods", "payment_issue"],
+    "DELIVERY": ["delivery_options", "delivery_period"],
+}
+FLAGS = ["B", "BL", "BQZ", "BCELQZ", "BIL", "BKL"]
+
+
+class SyntheticDataset(Dataset):
+    """
+    A deterministic, Bitext-like dataset generated locally, so benchmarks run offline.
+    """
+
+    def __init__(self, n_rows: int = 26872, seed: int = 0):
+        self.n_rows = n_rows
+        self.seed = seed
+        super().__init__(dataset_name="synthetic", split="benchmark", snapshot_dir=None)
+
+    def load_dataset(self):
+        rng = np.random.default_rng(self.seed)
+        pairs = [
+            (category, intent)
+            for category, intents in CATEGORIES.items()
+            for intent in intents
+        ]
+        chosen = rng.integers(0, len(pairs), self.n_rows)
+        categories = np.array([category for category, _ in pairs])[chosen]
+        intents = np.array([intent for _, intent in pairs])[chosen]
+        topics = pd.Series(intents).str.replace("_", " ")
+        numbers = pd.Series(rng.integers(0, 1000, self.n_rows)).astype(str)
+        repeats = rng.integers(1, 6, self.n_rows)
+
+        df = pd.DataFrame(
+            {
+                "flags": np.array(FLAGS)[rng.integers(0, len(FLAGS), self.n_rows)],
+                "instruction": "I need help to "
+                + topics
+                + " for order {{Order Number}} #"
+                + numbers,
+                "category": categories,
+                "intent": intents,
+                "response": [
+                    f"I'm sorry for the trouble with your request to {topic}. " * repeat
+                    + "Please let me know if there is anything else I can help with."
+                    for topic, repeat in zip(topics, repeats)
+                ],
+            }
+        )
+        df[CATEGORICAL_COLUMNS] = df[CATEGORICAL_COLUMNS].astype("category")
+        return df
@@ -0,0 +1,145 @@
+from app.const import (
+    CONTEXT_TOKEN_BUDGET,
+    CONTEXT_KEEP_LAST_OBSERVATIONS,
+    CONTEXT_MAX_OBSERVATION_TOKENS,
+    CONTEXT_PREVIEW_CHARS,
+)
+from prompt import count_tokens, CHARS_PER_TOKEN
+from typing import Dict, List, Tuple
+import json
+
+
+class ConversationContext:
+    """
+    Holds the messages of a ReAct conversation and renders a compacted copy of them
+    for each LLM request.
+    The full messages are kept, and only the rendered copy is compacted. The most recent
+    tool outputs are sent in full. Older ones are replaced by a short preview and
+    oversized recent ones are truncated. Old tool-call rounds are dropped if the request
+    is still over budget.
+    """
+
+    def __init__(
+        self,
+        messages: List[dict],
+        token_budget: int = CONTEXT_TOKEN_BUDGET,
+        keep_last_observations: int = CONTEXT_KEEP_LAST_OBSERVATIONS,
+        max_observation_tokens: int = CONTEXT_MAX_OBSERVATION_TOKENS,
+        preview_chars: int = CONTEXT_PREVIEW_CHARS,
+    ):
+        self.token_budget = token_budget
+        self.keep_last_observations = keep_last_observations
+        self.max_observation_tokens = max_observation_tokens
+        self.preview_chars = preview_chars
+
+        self.messages: List[dict] = []
+        self._tokens: List[int] = []
+        self._elided: Dict[Tuple[int, int], Tuple[dict, int]] = {}
+
+        # Statistics of the last rendered request
+        self.full_tokens = 0
+        self.rendered_tokens = 0
+        self.elided_observations = 0
+        self.dropped_rounds = 0
+
+        for message in messages:
+            self.append(message)
+
+    def append(self, message: dict):
+        """
+        Add a message to the conversation.
+        Args:
+            message (dict): The message to add.
+        """
+        self.messages.append(message)
+        self._tokens.append(count_tokens(json.dumps(message)))
+
+    def _elide(self, position: int, keep_chars: int) -> Tuple[dict, int]:
+        """
+        Replace a tool output by its beginning, as a preview.
+        Args:
+            position (int): The position of the tool message in the conversation.
+            keep_chars (int): Number of characters of the output to keep.
+        Returns:
+            Tuple[dict, int]: The tool message with the elided content and its token count.
+        """
+        key = (position, keep_chars)
+        if key not in self._elided:
+            message = self.messages[position]
+            content = message["content"]
+            preview = content[:keep_chars]
+            elided = {
+                **message,
+                "content": (
+                    f"[Output elided to save context ({len(content)} characters). "
+                    f"Preview: {preview}"
+                    f"{'...' if len(content) > len(preview) else ''}]"
+                ),
+            }
+            self._elided[key] = (elided, count_tokens(json.dumps(elided)))
+        return self._elided[key]
+
+    def render(self) -> List[dict]:
+        """
+        Build the messages to send in the next LLM request, within the token budget.
+        Returns:
+            List[dict]: The compacted messages.
+        """
+        rendered = list(self.messages)
+        tokens = list(self._tokens)
+        tool_indices = [
+            i for i, message in enumerate(rendered) if message["role"] == "tool"
+        ]
+        recent = set(tool_indices[-self.keep_last_observations :])
+        rounds = [
+            i
+            for i, message in enumerate(rendered)
+            if message["role"] == "assistant" and message.get("tool_calls")
+        ]
+        latest_round_start = rounds[-1] if rounds else len(rendered)
+
+        def elide(i, keep_chars=self.preview_chars):
+            # Short outputs are cheaper to send as they are than as a preview
+            elided, elided_tokens = self._elide(i, keep_chars)
+            if elided_tokens < tokens[i]:
+                rendered[i], tokens[i] = elided, elided_tokens
+
+        # Elide old tool outputs and truncate oversized recent ones
+        for i in tool_indices:
+            if i not in recent:
+                elide(i)
+            elif tokens[i] > self.max_observation_tokens:
+                elide(i, self.max_observation_tokens * CHARS_PER_TOKEN)
+
+        # Still over budget: elide the recent tool outputs too, oldest first,
+        # except the ones the model has not reacted to yet
+        for i in tool_indices:
+            if sum(tokens) <= self.token_budget or i > latest_round_start:
+                break
+            elide(i)
+
+        # Still over budget: drop whole tool-call rounds (the assistant message and its
+        # tool outputs), oldest first, always keeping the latest round
+        dropped = set()
+        for start in rounds[:-1]:
+            if sum(tokens) <= self.token_budget:
+                break
+            end = start + 1
+            while end < len(rendered) and rendered[end]["role"] == "tool":
+                end += 1
+            for i in range(start, end):
+                dropped.add(i)
+                tokens[i] = 0
+
+        self.full_tokens = sum(self._tokens)
+        self.rendered_tokens = sum(tokens)
+        self.elided_observations = sum(
+            1
+            for i in tool_indices
+            if i not in dropped and rendered[i] is not self.messages[i]
+        )
+        self.dropped_rounds = sum(
+            1 for i in dropped if rendered[i]["role"] == "assistant"
+        )
+
+        return [message for i, message in enumerate(rendered) if i not in dropped]
@@ -1,30 +1,443 @@
-from app.const import DATASET_NAME, SPLIT
+from app.const import (
+    DATASET_NAME,
+    SPLIT,
+    CATEGORICAL_COLUMNS,
+    DATASET_SNAPSHOT_DIR,
+    DATASET_SNAPSHOT_FORMAT_VERSION,
+    DATASET_REVISION,
+    DATASET_REVISION_TIMEOUT,
+    SAMPLING_STRATIFY_COLUMNS,
+    SAMPLING_TEXT_COLUMN,
+    SEARCH_DEFAULT_TOP_K,
+    SHOW_EXAMPLES_SEED,
+)
 from datasets import load_dataset
+from huggingface_hub import HfApi
+from sampling import minhash_signatures, representative_sample
+from search import SearchIndex
+import numpy as np
 import pandas as pd
-from typing import List
+import pyarrow as pa
+import pyarrow.compute as pc
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import copy
+import hashlib
+import json
+import os
+import re
+import secrets
+import threading
+
+
+class CategoricalIndex:
+    """
+    Row-position index over the categorical columns of a DataFrame.
+    For every column it keeps the category codes of each row, the sorted row positions
+    holding each value and the value counts, so counts and filters do not need to scan
+    the DataFrame.
+    """
+
+    def __init__(self, df: pd.DataFrame, columns: List[str] = CATEGORICAL_COLUMNS):
+        self.categories: Dict[str, pd.Index] = {}
+        self.codes: Dict[str, np.ndarray] = {}
+        self.positions: Dict[str, Dict[str, np.ndarray]] = {}
+        self.counts: Dict[str, Dict[str, int]] = {}
+        self.distinct: Dict[str, List[str]] = {}
+
+        for column in columns:
+            categories = df[column].cat.categories
+            codes = df[column].cat.codes.to_numpy()
+
+            # Group row positions by code; the stable sort keeps positions ascending
+            order = np.argsort(codes, kind="stable")
+            bounds = np.searchsorted(codes[order], np.arange(len(categories) + 1))
+
+            self.categories[column] = categories
+            self.codes[column] = codes
+            self.positions[column] = {
+                value: order[bounds[i] : bounds[i + 1]]
+                for i, value in enumerate(categories)
+            }
+            self.counts[column] = {
+                value: int(bounds[i + 1] - bounds[i])
+                for i, value in enumerate(categories)
+                if bounds[i + 1] > bounds[i]
+            }
+            # Distinct values in order of first appearance, like Series.unique()
+            self.distinct[column] = sorted(
+                self.counts[column], key=lambda value: self.positions[column][value][0]
+            )
+
+    def select(self, column: str, values: List[str]) -> np.ndarray:
+        """
+        Get the sorted row positions where the column matches any of the values.
+        Args:
+            column (str): The categorical column.
+            values (List[str]): The values to match.
+        Returns:
+            np.ndarray: The sorted row positions.
+        """
+        positions = [
+            self.positions[column][value]
+            for value in set(values)
+            if value in self.positions[column]
+        ]
+        if not positions:
+            return np.array([], dtype=np.intp)
+        return np.sort(np.concatenate(positions))
+
+
+def _hub_revision(dataset_name: str, revision: Optional[str]) -> Optional[str]:
+    """
+    Resolve a revision of a Hub dataset to its commit.
+    Args:
+        dataset_name (str): The dataset.
+        revision (Optional[str]): A branch, tag or commit, or None for the main branch.
+    Returns:
+        Optional[str]: The commit, or None if the Hub cannot be reached in time.
+    """
+    # A full commit hash needs no lookup
+    if revision is not None and re.fullmatch(r"[0-9a-f]{40}", revision):
+        return revision
+    try:
+        info = HfApi().dataset_info(
+            dataset_name, revision=revision, timeout=DATASET_REVISION_TIMEOUT
+        )
+        return info.sha
+    except Exception:
+        return None
+
+
+class Snapshot:
+    """
+    A local Arrow IPC snapshot of a dataset split, with a JSON manifest next to it.
+    Categorical columns are stored dictionary-encoded and the file is uncompressed, so it
+    can be memory-mapped and turned into a DataFrame without copying the text columns.
+    The manifest records the source, its Hub revision and the size, modification time
+    and checksum of the file. A snapshot is stale when the file was modified, or when a
+    revision is pinned and the snapshot was loaded from another one; the checksum
+    identifies its contents (e.g. for the search index) without being recomputed on
+    every load.
+    """
+
+    def __init__(self, dataset_name: str, split: str, directory: str):
+        file_name = f"{dataset_name.replace('/', '__')}-{split}"
+        self.dataset_name = dataset_name
+        self.split = split
+        self.path = os.path.join(directory, f"{file_name}.arrow")
+        self.manifest_path = os.path.join(directory, f"{file_name}.json")
+
+    @staticmethod
+    def _checksum(path: str) -> str:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def is_valid(self, revision: Optional[str] = None) -> bool:
+        """
+        Check that the snapshot exists, matches this dataset and was not modified since
+        it was written.
+        Args:
+            revision (Optional[str]): The commit the snapshot must have been loaded
+                from, or None to accept any revision.
+        Returns:
+            bool: True if the snapshot can be used.
+        """
+        if not (os.path.exists(self.path) and os.path.exists(self.manifest_path)):
+            return False
+        with open(self.manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        stat = os.stat(self.path)
+        return (
+            manifest.get("dataset_name") == self.dataset_name
+            and manifest.get("split") == self.split
+            and manifest.get("format_version") == DATASET_SNAPSHOT_FORMAT_VERSION
+            and (revision is None or manifest.get("revision") == revision)
+            and manifest.get("size") == stat.st_size
+            and manifest.get("mtime_ns") == stat.st_mtime_ns
+        )
+
+    def fingerprint(self) -> Optional[str]:
+        """
+        Get the checksum recorded for the snapshot, without reading the snapshot itself.
+        Returns:
+            Optional[str]: The checksum, or None if there is no snapshot.
+        """
+        if not os.path.exists(self.manifest_path):
+            return None
+        with open(self.manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f).get("sha256")
+
+    def write(self, table: pa.Table, revision: Optional[str] = None):
+        """
+        Write a table to the snapshot, dictionary-encoding the categorical columns.
+        Args:
+            table (pa.Table): The dataset split as an Arrow table.
+            revision (Optional[str]): The Hub commit the table was loaded from.
+        """
+        for column in CATEGORICAL_COLUMNS:
+            index = table.schema.get_field_index(column)
+            table = table.set_column(
+                index, column, pc.dictionary_encode(table.column(column))
+            )
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # Write to temporary files first so readers never see a partial snapshot
+        tmp_path = f"{self.path}.tmp"
+        with pa.OSFile(tmp_path, "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        # Renaming keeps the modification time, so the stat of the temporary file holds
+        stat = os.stat(tmp_path)
+        manifest = {
+            "dataset_name": self.dataset_name,
+            "split": self.split,
+            "format_version": DATASET_SNAPSHOT_FORMAT_VERSION,
+            "revision": revision,
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "sha256": self._checksum(tmp_path),
+        }
+        with open(f"{self.manifest_path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self.path)
+        os.replace(f"{self.manifest_path}.tmp", self.manifest_path)
+
+    def read(self) -> pd.DataFrame:
+        """
+        Memory-map the snapshot into a DataFrame.
+        Text columns stay Arrow-backed and categorical columns become pandas categoricals.
+        Returns:
+            pd.DataFrame: The dataset split.
+        """
+        table = pa.ipc.open_file(pa.memory_map(self.path, "r")).read_all()
+        return table.to_pandas(
+            types_mapper={
+                pa.string(): pd.ArrowDtype(pa.string()),
+                pa.large_string(): pd.ArrowDtype(pa.large_string()),
+            }.get
+        )
+
+
+class DatasetView:
+    """
+    An immutable selection of rows of the base DataFrame: the sorted row positions and
+    the filter predicates that produced them. Filtering returns a new view, so views can
+    be shared freely and the base DataFrame is never copied or modified.
+    """
+
+    def __init__(
+        self,
+        positions: Optional[np.ndarray] = None,
+        predicates: Tuple[Tuple[str, Tuple[str, ...]], ...] = (),
+    ):
+        self.positions = positions  # None means all rows
+        self.predicates = predicates
+        # Per-view count and distinct tables, filled lazily
+        self.counts: Dict[str, Dict[str, int]] = {}
+        self.distinct: Dict[str, List[str]] = {}
+
+    def select(
+        self, index: CategoricalIndex, column: str, values: List[str]
+    ) -> "DatasetView":
+        """
+        Compose a filter onto this view.
+        Args:
+            index (CategoricalIndex): The index of the base DataFrame.
+            column (str): The categorical column to filter on.
+            values (List[str]): The values to keep.
+        Returns:
+            DatasetView: A new view with the rows matching the filter.
+        """
+        return self.restrict(
+            index.select(column, values), (column, tuple(sorted(set(values))))
+        )
+
+    def restrict(
+        self, positions: np.ndarray, predicate: Tuple[str, Tuple[str, ...]]
+    ) -> "DatasetView":
+        """
+        Compose a selection of rows onto this view.
+        Args:
+            positions (np.ndarray): The sorted row positions to keep.
+            predicate (Tuple[str, Tuple[str, ...]]): The filter that selected them.
+        Returns:
+            DatasetView: A new view with the rows in both this view and the selection.
+        """
+        if self.positions is not None:
+            positions = np.intersect1d(self.positions, positions, assume_unique=True)
+        return DatasetView(positions, self.predicates + (predicate,))
 
 
 class Dataset:
-    def __init__(self, dataset_name=DATASET_NAME, split=SPLIT):
+    def __init__(
+        self,
+        dataset_name=DATASET_NAME,
+        split=SPLIT,
+        snapshot_dir=DATASET_SNAPSHOT_DIR,
+        refresh_snapshot=False,
+        revision=DATASET_REVISION,
+    ):
         self.dataset_name = dataset_name
         self.split = split
-        self.dataset = self.load_dataset()
+        self.revision = revision
+        self.snapshot_dir = snapshot_dir
+        self.refresh_snapshot = refresh_snapshot
+
+        # The base DataFrame and its index are built once and never modified;
+        # filters only swap the view
+        self._base = self.load_dataset()
+        self._index = CategoricalIndex(self._base) if self._base is not None else None
+        self._view = DatasetView()
+        # Data derived from the base rows (e.g. MinHash signatures), built lazily
+        # and shared by all views, which may be used by concurrent sessions
+        self._derived: Dict[str, Any] = {}
+        self._derived_lock = threading.Lock()
+        # Identifies the base rows; shared by all views
+        self._base_id = secrets.token_hex(8)
 
     def load_dataset(self):
+        snapshot = (
+            Snapshot(self.dataset_name, self.split, self.snapshot_dir)
+            if self.snapshot_dir
+            else None
+        )
+
+        # Use a valid local snapshot without contacting the Hub, unless a revision is
+        # pinned: then the snapshot must have been loaded from it
+        hub_revision, resolved = None, False
+        if snapshot and not self.refresh_snapshot:
+            try:
+                if self.revision is not None:
+                    hub_revision = _hub_revision(self.dataset_name, self.revision)
+                    resolved = True
+                if snapshot.is_valid(hub_revision):
+                    return snapshot.read()
+            except Exception as e:
+                print(f"Error reading dataset snapshot, reloading: {e}")
+
+        # Resolve the commit to load, so the new snapshot records it
+        if snapshot and not resolved:
+            hub_revision = _hub_revision(self.dataset_name, self.revision)
         try:
-            dataset = load_dataset(self.dataset_name, split=self.split)
-            return dataset.to_pandas()
+            dataset = load_dataset(
+                self.dataset_name,
+                split=self.split,
+                revision=hub_revision or self.revision,
+            )
         except Exception as e:
             print(f"Error loading dataset: {e}")
+            # An outdated snapshot is better than no dataset
+            try:
+                if snapshot and snapshot.is_valid():
+                    print("Using the existing dataset snapshot.")
+                    return snapshot.read()
+            except Exception as e:
+                print(f"Error reading dataset snapshot: {e}")
             return None
 
+        if snapshot:
+            try:
+                snapshot.write(dataset.data.table, hub_revision)
+                return snapshot.read()
+            except Exception as e:
+                print(f"Error writing dataset snapshot: {e}")
+
+        df = dataset.to_pandas()
+        df[CATEGORICAL_COLUMNS] = df[CATEGORICAL_COLUMNS].astype("category")
+        return df
+
+    @property
+    def dataset(self) -> pd.DataFrame:
+        """
+        The rows of the current view as a DataFrame.
+        Always a copy, which callers may modify: the base DataFrame is shared by all
+        views and sessions and is never handed out. Prefer the Dataset methods, which
+        do not materialize the rows.
+        """
+        if self._view.positions is None:
+            return self._base.copy()
+        return self._base.iloc[self._view.positions]
+
+    def _with_view(self, view: DatasetView) -> "Dataset":
+        """
+        Create a Dataset sharing this one's base DataFrame and index, with another view.
+        Args:
+            view (DatasetView): The view of the new Dataset.
+        Returns:
+            Dataset: The new Dataset.
+        """
+        ds = copy.copy(self)
+        ds._view = view
+        return ds
+
+    def reset(self) -> "Dataset":
+        """
+        Get a Dataset over all rows, sharing this one's base DataFrame.
+        Returns:
+            Dataset: The unfiltered Dataset.
+        """
+        return self._with_view(DatasetView())
+
+    def fingerprint(self) -> str:
+        """
+        Identify the rows of this Dataset by its base rows and the filters applied to
+        them. Datasets with the same fingerprint have the same rows.
+        Returns:
+            str: The fingerprint.
+        """
+        return f"{self._base_id}:{json.dumps(self._view.predicates)}"
+
+    def _value_counts(self, column: str) -> Dict[str, int]:
+        """
+        Get the value counts of a categorical column for the current rows.
+        Computed once per view and then served from memory.
+        Args:
+            column (str): The categorical column.
+        Returns:
+            Dict[str, int]: The number of rows for each value present.
+        """
+        if self._view.positions is None:
+            return self._index.counts[column]
+        if column not in self._view.counts:
+            categories = self._index.categories[column]
+            counts = np.bincount(
+                self._index.codes[column][self._view.positions],
+                minlength=len(categories),
+            )
+            self._view.counts[column] = {
+                value: int(count)
+                for value, count in zip(categories, counts)
+                if count > 0
+            }
+        return self._view.counts[column]
+
+    def _distinct_values(self, column: str) -> List[str]:
+        """
+        Get the distinct values of a categorical column for the current rows,
+        in order of first appearance.
+        Args:
+            column (str): The categorical column.
+        Returns:
+            List[str]: The distinct values.
+        """
+        if self._view.positions is None:
+            return self._index.distinct[column]
+        if column not in self._view.distinct:
+            categories = self._index.categories[column]
+            codes = pd.unique(self._index.codes[column][self._view.positions])
+            self._view.distinct[column] = [categories[code] for code in codes]
+        return self._view.distinct[column]
+
     def get_possible_intents(self) -> List[str]:
         """
         Get a list of unique intents from the DataFrame.
         Returns:
             List[str]: A list of unique intent names.
         """
-        return self.dataset["intent"].unique().tolist()
+        return list(self._distinct_values("intent"))
 
     def get_possible_categories(self) -> List[str]:
         """
@@ -32,7 +445,7 @@ class Dataset:
         Returns:
             List[str]: A list of unique category names.
         """
-        return self.dataset["category"].unique().tolist()
+        return list(self._distinct_values("category"))
 
     def select_semantic_intent(self, intent_names: List[str]) -> "Dataset":
         """
@@ -40,10 +453,9 @@ class Dataset:
         Args:
             intent_names (List[str]): List of intent names to filter by.
         Returns:
-            self: The Dataset object with the filtered DataFrame.
+            Dataset: A new Dataset over the filtered rows. The original is left unchanged.
         """
-        self.dataset = self.dataset[self.dataset["intent"].isin(intent_names)]
-        return self
+        return self._with_view(self._view.select(self._index, "intent", intent_names))
 
     def select_semantic_category(self, category_names: List[str]) -> "Dataset":
         """
@@ -51,10 +463,11 @@ class Dataset:
         Args:
             category_names (List[str]): List of category names to filter by.
         Returns:
-            self: The Dataset object with the filtered DataFrame.
+            Dataset: A new Dataset over the filtered rows. The original is left unchanged.
         """
-        self.dataset = self.dataset[self.dataset["category"].isin(category_names)]
-        return self
+        return self._with_view(
+            self._view.select(self._index, "category", category_names)
+        )
 
     def count_rows(self) -> int:
         """
@@ -62,7 +475,9 @@ class Dataset:
         Returns:
             int: The number of rows in the DataFrame.
         """
-        return len(self.dataset)
+        if self._view.positions is None:
+            return len(self._base)
+        return len(self._view.positions)
 
     def count_category(self, category: str) -> int:
         """
@@ -72,7 +487,7 @@ class Dataset:
         Returns:
             int: The count of rows matching the specified category.
         """
-        return self.dataset[self.dataset["category"] == category].shape[0]
+        return self._value_counts("category").get(category, 0)
 
     def count_intent(self, intent: str) -> int:
         """
@@ -82,14 +497,203 @@ class Dataset:
         Returns:
             int: The count of rows matching the specified intent.
         """
-        return self.dataset[self.dataset["intent"] == intent].shape[0]
+        return self._value_counts("intent").get(intent, 0)
+
+    def get_distribution(
+        self, column: str, top_k: Optional[int] = None, by: Optional[str] = None
+    ) -> dict:
+        """
+        Get the distribution of a categorical column, optionally broken down by a second one.
+        Args:
+            column (str): The categorical column to count (e.g. 'category', 'intent', 'flags').
+            top_k (Optional[int]): Only return the top_k most frequent values. Defaults to all.
+            by (Optional[str]): A second categorical column to cross-tabulate against.
+        Returns:
+            dict: The counts sorted by frequency. With `by`, a mapping from each value of
+                `by` to the counts of `column` within it.
+        """
+        if column not in CATEGORICAL_COLUMNS or (
+            by is not None and by not in CATEGORICAL_COLUMNS
+        ):
+            raise ValueError(
+                f"Distributions are only available for the columns {CATEGORICAL_COLUMNS}."
+            )
+        if top_k is not None and top_k < 1:
+            raise ValueError(f"top_k must be at least 1, got {top_k}.")
+
+        if by is None:
+            counts = sorted(
+                self._value_counts(column).items(),
+                key=lambda item: item[1],
+                reverse=True,
+            )
+            return dict(counts[:top_k])
+
+        # Cross-tabulate the category codes of both columns in a single bincount
+        positions = (
+            self._view.positions if self._view.positions is not None else slice(None)
+        )
+        categories = self._index.categories[column]
+        by_categories = self._index.categories[by]
+        codes = self._index.codes[column][positions].astype(np.int64)
+        by_codes = self._index.codes[by][positions].astype(np.int64)
+        crosstab = np.bincount(
+            by_codes * len(categories) + codes,
+            minlength=len(by_categories) * len(categories),
+        ).reshape(len(by_categories), len(categories))
+
+        by_counts = self._value_counts(by)
+        distribution = {}
+        for by_value in sorted(by_counts, key=by_counts.get, reverse=True):
+            row = crosstab[by_categories.get_loc(by_value)]
+            order = np.argsort(-row, kind="stable")
+            order = order[row[order] > 0][:top_k]
+            distribution[by_value] = {
+                categories[code]: int(row[code]) for code in order
+            }
+        return distribution
+
+    def show_examples(
+        self,
+        n: int,
+        columns: Optional[List[str]] = None,
+        offset: int = 0,
+        seed: int = SHOW_EXAMPLES_SEED,
+    ) -> pd.DataFrame:
+        """
+        Show a page of n examples from a seeded shuffle of the DataFrame. The shuffle
+        only depends on the seed and the rows, so successive offsets page through the
+        rows without repeating any.
+        Args:
+            n (int): The number of examples to show; fewer are returned past the end.
+            columns (Optional[List[str]]): The columns to show, or None for all of them.
+            offset (int): The number of shuffled examples to skip.
+            seed (int): The seed of the shuffle.
+        Returns:
+            pd.DataFrame: A DataFrame containing up to n examples from the dataset.
+        """
+        positions = self._positions()
+        # Shuffle positions first so only the shown rows are materialized
+        order = np.random.default_rng(seed).permutation(len(positions))
+        shown = positions[order[max(offset, 0) : max(offset, 0) + max(n, 0)]]
+        examples = self._base.iloc[shown]
+        return examples if columns is None else examples[columns]
+
+    def _positions(self) -> np.ndarray:
+        """
+        Get the row positions of the current view in the base DataFrame.
+        Returns:
+            np.ndarray: The sorted row positions.
+        """
+        if self._view.positions is not None:
+            return self._view.positions
+        return np.arange(len(self._base))
+
+    def _derive(self, key: str, build: Callable[[], Any]) -> Any:
+        """
+        Get data derived from the base rows, building it on first use.
+        It is built once even when several threads ask for it at the same time.
+        Args:
+            key (str): The name of the data.
+            build (Callable[[], Any]): Builds the data.
+        Returns:
+            Any: The data.
+        """
+        if key not in self._derived:
+            with self._derived_lock:
+                if key not in self._derived:
+                    self._derived[key] = build()
+        return self._derived[key]
+
+    def sample_representative(
+        self,
+        n: int,
+        seed: int = 0,
+        stratify_columns: List[str] = SAMPLING_STRATIFY_COLUMNS,
+    ) -> pd.DataFrame:
+        """
+        Sample rows that represent the dataset well: strata (combinations of the
+        stratify columns) are covered in proportion to their sizes, and near-duplicate
+        instructions are represented by a single typical row. Each stratify column after
+        the first only refines the strata if the sample can still cover all of them.
+        Args:
+            n (int): The number of rows to sample.
+            seed (int): Seed of the sample; the same seed gives the same rows.
+            stratify_columns (List[str]): The categorical columns to stratify on,
+                coarsest first.
+        Returns:
+            pd.DataFrame: A DataFrame containing the sampled rows.
+        """
+        signatures = self._derive(
+            "signatures",
+            lambda: minhash_signatures(self._base[SAMPLING_TEXT_COLUMN].tolist()),
+        )
+        positions = self._positions()
+
+        # Combine the category codes of the stratify columns into one key per row. A
+        # small sample keeps the coarser strata, so that it still covers every intent
+        # rather than only the largest (intent, flags) combinations
+        strata = np.zeros(len(positions), dtype=np.int64)
+        for i, column in enumerate(stratify_columns):
+            codes = self._index.codes[column][positions].astype(np.int64)
+            refined = strata * (len(self._index.categories[column]) + 1) + codes + 1
+            if i > 0 and len(np.unique(refined)) > n:
+                break
+            strata = refined
+
+        sampled = representative_sample(strata, signatures[positions], n, seed=seed)
+        return self._base.iloc[positions[sampled]]
+
+    def _search_index(self) -> SearchIndex:
+        """
+        Get the full-text search index of the base rows.
+        Returns:
+            SearchIndex: The index.
+        """
+        return self._derive("search_index", self._load_search_index)
+
+    def _load_search_index(self) -> SearchIndex:
+        """
+        Load the full-text search index from next to the dataset snapshot when it is
+        up to date, or build it (and save it there).
+        Returns:
+            SearchIndex: The index.
+        """
+        snapshot = (
+            Snapshot(self.dataset_name, self.split, self.snapshot_dir)
+            if self.snapshot_dir
+            else None
+        )
+        fingerprint = snapshot.fingerprint() if snapshot else None
+        directory = snapshot.path[: -len(".arrow")] + "-search" if snapshot else None
+
+        index = None
+        if fingerprint:
+            try:
+                index = SearchIndex.load(directory, fingerprint)
+            except Exception as e:
+                print(f"Error reading search index, rebuilding: {e}")
+        if index is None:
+            index = SearchIndex.build(self._base)
+            if fingerprint:
+                try:
+                    index.save(directory, fingerprint)
+                except Exception as e:
+                    print(f"Error writing search index: {e}")
+        return index
 
-    def show_examples(self, n: int) -> pd.DataFrame:
+    def search(self, query: str, top_k: int = SEARCH_DEFAULT_TOP_K) -> "Dataset":
         """
-        Show a sample of n examples from the DataFrame.
+        Keep the rows whose instruction and response best match a free-text query.
         Args:
-            n (int): The number of examples to show.
+            query (str): The free-text query.
+            top_k (int): Maximum number of rows to keep.
         Returns:
-            pd.DataFrame: A DataFrame containing n random samples from the dataset.
+            Dataset: A new Dataset with the best matching rows of this one.
         """
-        return self.dataset.sample(n)
+        positions = self._search_index().search(
+            query, max(1, top_k), self._view.positions
+        )
+        return self._with_view(
+            self._view.restrict(np.sort(positions), ("search", (query, str(top_k))))
+        )
@@ -1,28 +1,575 @@
-from llm import LLM
+from llm import LLM, StreamedCompletion, models, tools_response_error
 from data import Dataset
+from context import ConversationContext
 import tools
 from app.const import (
     STSTEM_PROMPT_FILE_PATH,
     MAX_CALL_DEPTH,
     DEFAULT_PARALLEL_TOOL_CALLS,
     DEFAULT_TOOL_CHOICE,
+    PARALLEL_TOOL_CALLS_MAX_WORKERS,
+    PARALLEL_TOOL_CALLS_PROMPT_FILE_PATH,
+    ROUTER_ENABLED,
+    DEFAULT_PLAN_MODE,
+    PLAN_MODE_PROMPT_FILE_PATH,
 )
+from concurrent.futures import ThreadPoolExecutor
 import json
-from typing import Callable
+from typing import Dict, Iterator, List, Optional
 from prompt import read_prompt_file
+from tracing import in_current_context, tracer
+import logs
+import planner
+import router
 
 
-def process_user_query(
+def _render_context(
+    context: ConversationContext, log_function: logs.LogFunction
+) -> list:
+    """
+    Render the conversation for the next LLM request, logging any compaction.
+    Args:
+        context (ConversationContext): The conversation context.
+        log_function (logs.LogFunction): Function to log messages and records.
+    Returns:
+        list: The messages to send to the LLM.
+    """
+    messages = context.render()
+    if context.rendered_tokens < context.full_tokens:
+        log_function(
+            logs.info(
+                f"Context compacted from {context.full_tokens} to {context.rendered_tokens} tokens "
+                f"({context.elided_observations} tool outputs elided, {context.dropped_rounds} rounds dropped)."
+            )
+        )
+    return messages
+
+
+class _FinalAnswerExtractor:
+    """
+    Incrementally decodes the `final_answer` string out of the streamed JSON arguments
+    of a `finish` tool call, so the answer can be shown while it is being generated.
+    """
+
+    _KEY = '"final_answer"'
+
+    def __init__(self):
+        self._start = None  # Position of the first character of the string value
+        self._position = None  # Position of the next character to decode
+        self._done = False
+
+    def update(self, arguments: str) -> str:
+        """
+        Decode the part of the answer that arrived since the last update.
+        Args:
+            arguments (str): The arguments streamed so far.
+        Returns:
+            str: The newly decoded text of the answer.
+        """
+        if self._done:
+            return ""
+
+        if self._start is None:
+            key = arguments.find(self._KEY)
+            if key < 0:
+                return ""
+            position = key + len(self._KEY)
+            while position < len(arguments) and arguments[position] in " \t\r\n:":
+                position += 1
+            if position >= len(arguments) or arguments[position] != '"':
+                return ""
+            self._start = self._position = position + 1
+
+        text = []
+        position = self._position
+        while position < len(arguments):
+            char = arguments[position]
+            if char == '"':
+                self._done = True
+                break
+            if char != "\\":
+                text.append(char)
+                position += 1
+                continue
+            # Decode an escape sequence once it has fully arrived
+            if arguments[position + 1 : position + 2] != "u":
+                length = 2
+            else:
+                length = 6
+                code = arguments[position + 2 : position + 6]
+                if len(code) == 4 and 0xD800 <= int(code, 16) <= 0xDBFF:
+                    length = 12  # Surrogate pair
+            if position + length > len(arguments):
+                break
+            text.append(json.loads(f'"{arguments[position : position + length]}"'))
+            position += length
+        self._position = position
+        return "".join(text)
+
+
+def _validate_step(response):
+    """
+    Validate the tool calls of a step, so that an invalid step can be escalated.
+    Args:
+        response (ChatCompletion): The step.
+    Raises:
+        ValueError: If the arguments of a tool call are not valid.
+    """
+    for tool_call in response.choices[0].message.tool_calls or []:
+        tools.FunctionInput(function_call=json.loads(tool_call.function.arguments))
+
+
+def _request_step(
+    context: ConversationContext,
+    log_function: logs.LogFunction,
+    stream: bool,
+    **request_kwargs,
+):
+    """
+    Request the next step from the LLM.
+    When streaming, yields token events for the final answer: the answer given through
+    the first finish tool call as it arrives, and an answer given as content once the
+    step ends without tool calls (content of a step that calls tools is not part of the
+    answer). The tokens are streamed before the step is validated, so they are only a
+    preview of the answer the caller ends up with.
+    Args:
+        context (ConversationContext): The conversation context.
+        log_function (logs.LogFunction): Function to log messages and records.
+        stream (bool): Whether to stream the response.
+        **request_kwargs: Additional arguments for the LLM request.
+    Returns:
+        ChatCompletion: The complete response (as the generator's return value).
+    """
+    messages = _render_context(context, log_function)
+    if not stream:
+        return LLM.perform_tools_request(
+            messages, validate=_validate_step, **request_kwargs
+        )
+
+    completion = StreamedCompletion()
+    final_answers = {}
+    for chunk in LLM.stream_tools_request(
+        messages, validate=_validate_step, **request_kwargs
+    ):
+        completion.add(chunk)
+        for choice in chunk.choices:
+            # A final answer through the finish tool
+            for tool_call in choice.delta.tool_calls or []:
+                accumulated = completion.tool_calls[tool_call.index]
+                # Only the first finish call can give the answer
+                if accumulated["name"] != "finish" or (
+                    final_answers and tool_call.index not in final_answers
+                ):
+                    continue
+                extractor = final_answers.setdefault(
+                    tool_call.index, _FinalAnswerExtractor()
+                )
+                text = extractor.update(accumulated["arguments"])
+                if text:
+                    yield {"type": "token", "text": text}
+    response = completion.to_completion()
+
+    # A streamed step cannot be escalated once its chunks were yielded, so an invalid
+    # one is requested again from the escalation model
+    if models.can_escalate("react_step"):
+        rejected = tools_response_error(response, _validate_step)
+        if rejected is not None:
+            log_function(logs.warning(f"Escalating an invalid step: {rejected}"))
+            response = LLM.perform_tools_request(
+                messages, escalated=True, validate=_validate_step, **request_kwargs
+            )
+
+    # A direct answer through content, only known to be one once the step has ended
+    message = response.choices[0].message
+    if message.content and not message.tool_calls:
+        yield {"type": "token", "text": message.content}
+    return response
+
+
+def _execute_tool_call(tool_call, ds: Dataset) -> dict:
+    """
+    Validate and execute a single tool call requested by the LLM.
+    Args:
+        tool_call: The tool call from the assistant's message.
+        ds (Dataset): The dataset to operate on.
+    Returns:
+        dict: The function output ("response") and its JSON serialization ("content"),
+            the resulting dataset ("dataset") and an error message if the call failed
+            ("error").
+    """
+    with tracer.span(
+        f"tool.{tool_call.function.name}",
+        arguments_chars=len(tool_call.function.arguments),
+    ) as span:
+        try:
+            # Extract and validate the function call details
+            with tracer.span("tool.validate"):
+                arguments = json.loads(tool_call.function.arguments)
+                function_input = tools.FunctionInput(function_call=arguments)
+
+            # Execute the function call with the provided arguments
+            output = tools.execute_function(function_input.function_call, ds)
+            content = json.dumps(output["response"])
+            span.set_attributes(response_chars=len(content))
+            return {
+                "response": output["response"],
+                "content": content,
+                "dataset": output["dataset"],
+                "error": None,
+            }
+
+        except Exception as e:
+            span.status = "error"
+            span.set_attributes(error=f"{type(e).__name__}: {e}")
+            return {
+                "response": None,
+                "content": None,
+                "dataset": ds,
+                "error": f"Error processing function call: {str(e)}",
+            }
+
+
+def _function_type(tool_call) -> Optional[str]:
+    """
+    Get the function a tool call executes, from its validated arguments: the call is
+    dispatched on them, not on the tool name.
+    Args:
+        tool_call: The tool call from the assistant's message.
+    Returns:
+        Optional[str]: The function type, or None if the arguments are not valid.
+    """
+    try:
+        arguments = json.loads(tool_call.function.arguments)
+        return tools.FunctionInput(function_call=arguments).function_call.function_type
+    except Exception:
+        return None
+
+
+def _group_tool_calls(tool_calls: list, parallel: bool) -> List[list]:
+    """
+    Split tool calls into groups that are executed together, keeping their order.
+    In parallel mode consecutive read-only calls share a group; any other call
+    (e.g. one that filters the dataset) forms a group of its own.
+    Args:
+        tool_calls (list): The tool calls from the assistant's message.
+        parallel (bool): Whether read-only calls may run concurrently.
+    Returns:
+        List[list]: The groups of tool calls.
+    """
+    groups = []
+    previous_read_only = False
+    for tool_call in tool_calls:
+        read_only = parallel and _function_type(tool_call) in tools.READ_ONLY_TOOLS
+        if read_only and previous_read_only:
+            groups[-1].append(tool_call)
+        else:
+            groups.append([tool_call])
+        previous_read_only = read_only
+    return groups
+
+
+def _stream_routed_query(
+    routed_query: router.RoutedQuery,
+    ds: Dataset,
+    log_function: logs.LogFunction,
+):
+    """
+    Answer a routed query by executing its tool calls, without the LLM.
+    Args:
+        routed_query (router.RoutedQuery): The routed query.
+        ds (Dataset): The dataset to operate on.
+        log_function (logs.LogFunction): Function to log messages and records.
+    Returns:
+        Optional[dict]: The final event (as the generator's return value), or None if a
+            tool call failed and the query should go to the LLM instead.
+    """
+    log_function(logs.info(f"Query routed to the {routed_query.name} template."))
+    responses = []
+    for function_call in routed_query.function_calls:
+        arguments = function_call.model_dump_json()
+        yield {
+            "type": "tool_started",
+            "name": function_call.function_type,
+            "arguments": arguments,
+        }
+        try:
+            with tracer.span(
+                f"tool.{function_call.function_type}", arguments_chars=len(arguments)
+            ):
+                output = tools.execute_function(function_call, ds)
+        except Exception as e:
+            error_msg = f"Error processing function call: {str(e)}"
+            yield {
+                "type": "tool_finished",
+                "name": function_call.function_type,
+                "error": error_msg,
+            }
+            log_function(logs.warning(error_msg))
+            return None
+        yield {
+            "type": "tool_finished",
+            "name": function_call.function_type,
+            "error": None,
+        }
+        responses.append(output["response"])
+        ds = output["dataset"]
+
+    return {
+        "type": "final",
+        "response": routed_query.answer(responses),
+        "dataset": ds,
+    }
+
+
+def _execute_plan_step(
+    step: planner.PlanStep, ds: Dataset, responses: Dict[str, dict]
+) -> dict:
+    """
+    Execute a step of a plan.
+    Args:
+        step (planner.PlanStep): The step.
+        ds (Dataset): The dataset the step operates on.
+        responses (Dict[str, dict]): The responses of the steps executed so far, by id.
+    Returns:
+        dict: As for _execute_tool_call, plus the arguments of the call once the
+            references to earlier steps are filled in ("arguments").
+    """
+    function_type = step.function_call.function_type
+    arguments = step.function_call.model_dump_json()
+    with tracer.span(f"tool.{function_type}", plan_step=step.id) as span:
+        try:
+            function_call = planner.resolve_function_call(step, responses)
+            arguments = function_call.model_dump_json()
+            output = tools.execute_function(function_call, ds)
+            content = json.dumps(output["response"])
+            span.set_attributes(response_chars=len(content))
+            return {
+                "arguments": arguments,
+                "response": output["response"],
+                "content": content,
+                "dataset": output["dataset"],
+                "error": None,
+            }
+
+        except Exception as e:
+            span.status = "error"
+            span.set_attributes(error=f"{type(e).__name__}: {e}")
+            return {
+                "arguments": arguments,
+                "response": None,
+                "content": None,
+                "dataset": ds,
+                "error": f"Error processing function call: {str(e)}",
+            }
+
+
+def _stream_planned_query(
+    messages: list,
+    ds: Dataset,
+    log_function: logs.LogFunction,
+    stream: bool,
+):
+    """
+    Answer a query in plan mode: request a plan of all tool calls at once, execute it
+    locally with independent steps in parallel, then request the final answer.
+    Args:
+        messages (list): The system and user messages of the query.
+        ds (Dataset): The dataset to operate on.
+        log_function (logs.LogFunction): Function to log messages and records.
+        stream (bool): Whether to stream the final answer.
+    Returns:
+        Optional[dict]: The final event (as the generator's return value), or None if
+            the plan is invalid or a step failed, and the ReAct loop should answer instead.
+            A failed step is followed by a plan_discarded event, since the tool events
+            of the plan were already yielded.
+    """
+    with tracer.span("agent.plan") as span:
+        # Request the plan, with the tool descriptions in the system prompt
+        tool_descriptions = "\n".join(
+            f"- `{tool['function']['name']}`: {tool['function']['description']}"
+            for tool in tools.tools
+        )
+        plan_messages = [
+            {
+                "role": "system",
+                "content": messages[0]["content"]
+                + read_prompt_file(PLAN_MODE_PROMPT_FILE_PATH)
+                + tool_descriptions,
+            },
+            *messages[1:],
+        ]
+        try:
+            response = LLM.perform_structured_outputs_request(
+                plan_messages,
+                planner.QueryPlan,
+                role="plan",
+                validate=lambda response: planner.validate_plan(
+                    response.choices[0].message.parsed
+                ),
+            )
+            plan = response.choices[0].message.parsed
+            if plan is None:
+                raise ValueError("The model did not return a plan.")
+            planner.validate_plan(plan)
+        except Exception as e:
+            span.status = "error"
+            span.set_attributes(error=f"{type(e).__name__}: {e}")
+            log_function(logs.warning(f"Invalid plan, falling back to ReAct: {e}"))
+            return None
+
+        log_function(logs.debug("Plan", plan.model_dump))
+        waves = planner.plan_waves(plan)
+        span.set_attributes(steps=len(plan.steps), waves=len(waves))
+
+        # Execute the plan wave by wave; each step starts from the dataset of the step
+        # it names, so filters in one branch do not affect the others
+        responses, datasets, results = {}, {}, {}
+        for wave in waves:
+            for step in wave:
+                yield {
+                    "type": "tool_started",
+                    "name": step.function_call.function_type,
+                    "arguments": step.function_call.model_dump_json(),
+                }
+
+            inputs = [
+                (step, datasets[step.dataset_from] if step.dataset_from else ds)
+                for step in wave
+            ]
+            if len(wave) > 1:
+                with ThreadPoolExecutor(
+                    max_workers=min(len(wave), PARALLEL_TOOL_CALLS_MAX_WORKERS)
+                ) as executor:
+                    futures = [
+                        executor.submit(
+                            in_current_context(_execute_plan_step),
+                            step,
+                            step_ds,
+                            responses,
+                        )
+                        for step, step_ds in inputs
+                    ]
+                    wave_results = [future.result() for future in futures]
+            else:
+                wave_results = [_execute_plan_step(*inputs[0], responses)]
+
+            for step, result in zip(wave, wave_results):
+                yield {
+                    "type": "tool_finished",
+                    "name": step.function_call.function_type,
+                    "error": result["error"],
+                }
+                if result["error"] is not None:
+                    span.status = "error"
+                    span.set_attributes(error=result["error"])
+                    log_function(
+                        logs.warning(
+                            f"Plan step {step.id} failed, falling back to ReAct: "
+                            f"{result['error']}"
+                        )
+                    )
+                    # The results of the plan are dropped and ReAct starts over
+                    yield {
+                        "type": "plan_discarded",
+                        "reason": f"Plan step {step.id} failed: {result['error']}",
+                    }
+                    return None
+                responses[step.id] = result["response"]
+                datasets[step.id] = result["dataset"]
+                results[step.id] = result
+
+    # The executed plan is added to the conversation as tool calls and their outputs
+    context = ConversationContext(messages)
+    if plan.steps:
+        context.append(
+            {
+                "role": "assistant",
+                "content": None,
+                "tool_calls": [
+                    {
+                        "id": f"plan_{step.id}",
+                        "type": "function",
+                        "function": {
+                            "name": step.function_call.function_type,
+                            "arguments": results[step.id]["arguments"],
+                        },
+                    }
+                    for step in plan.steps
+                ],
+            }
+        )
+        for step in plan.steps:
+            context.append(
+                {
+                    "role": "tool",
+                    "tool_call_id": f"plan_{step.id}",
+                    "content": results[step.id]["content"],
+                }
+            )
+
+    # Request the final answer through the finish tool
+    response = yield from _request_step(
+        context,
+        log_function,
+        stream,
+        tools=[tool for tool in tools.tools if tool["function"]["name"] == "finish"],
+        tool_choice={"type": "function", "function": {"name": "finish"}},
+        parallel_tool_calls=False,
+    )
+    log_function(logs.debug("Response from LLM", response.model_dump))
+    assistant_message = response.choices[0].message
+    final_answer = assistant_message.content
+    for tool_call in assistant_message.tool_calls or []:
+        try:
+            final_answer = json.loads(tool_call.function.arguments)["final_answer"]
+        except (ValueError, KeyError) as e:
+            log_function(logs.warning(f"Invalid final answer: {e}"))
+
+    # The answer is about the dataset of the last filter in the plan, if any
+    filter_steps = [
+        step
+        for step in plan.steps
+        if step.function_call.function_type in tools.FILTER_TOOLS
+    ]
+    return {
+        "type": "final",
+        "response": final_answer,
+        "dataset": datasets[filter_steps[-1].id] if filter_steps else ds,
+    }
+
+
+def _stream_user_query(
     user_query: str,
     ds: Dataset,
-    log_function: Callable[[str], None] = print,
+    log_function: logs.LogFunction = logs.console,
     llm_tools=tools.tools,
     llm_tool_choice=DEFAULT_TOOL_CHOICE,
     llm_parallel_tool_calls=DEFAULT_PARALLEL_TOOL_CALLS,
-):
+    stream: bool = True,
+    use_router: bool = ROUTER_ENABLED,
+    plan_mode: bool = DEFAULT_PLAN_MODE,
+) -> Iterator[dict]:
+    """
+    The ReAct loop of stream_user_query, run within its trace span.
+    """
+
+    # Answer known structured questions directly from the dataset
+    if use_router:
+        with tracer.span("router") as span:
+            routed_query = router.route(user_query, ds)
+            span.set_attributes(route=routed_query and routed_query.name)
+        if routed_query is not None:
+            final_event = yield from _stream_routed_query(
+                routed_query, ds, log_function
+            )
+            if final_event is not None:
+                yield final_event
+                return
 
     # Load the system prompt from the file
     system_prompt = read_prompt_file(STSTEM_PROMPT_FILE_PATH)
+    if llm_parallel_tool_calls:
+        system_prompt += read_prompt_file(PARALLEL_TOOL_CALLS_PROMPT_FILE_PATH)
     # with open(STSTEM_PROMPT_FILE_PATH, "r", encoding="utf-8") as f:
     #     system_prompt = f.read()
 
@@ -36,18 +583,31 @@ def process_user_query(
     ]
 
     # Log the initial messages
-    log_function(f"Initial messages: {json.dumps(messages, indent=2)}")
+    log_function(logs.debug("Initial messages", messages))
+
+    # In plan mode, answer with a single plan when it is valid and runs
+    if plan_mode:
+        final_event = yield from _stream_planned_query(
+            messages, ds, log_function, stream
+        )
+        if final_event is not None:
+            yield final_event
+            return
+
+    # Keep the full conversation out-of-band and send a compacted copy on each request
+    context = ConversationContext(messages)
+
+    request_kwargs = {
+        "tools": llm_tools,
+        "tool_choice": llm_tool_choice,
+        "parallel_tool_calls": llm_parallel_tool_calls,
+    }
 
     # Perform the initial request to the LLM
-    response = LLM.perform_tools_request(
-        messages,
-        tools=llm_tools,
-        tool_choice=llm_tool_choice,
-        parallel_tool_calls=llm_parallel_tool_calls,
-    )
+    response = yield from _request_step(context, log_function, stream, **request_kwargs)
 
     # Log the response from the LLM
-    log_function(f"Response from LLM: {json.dumps(response.model_dump(), indent=2)}")
+    log_function(logs.debug("Response from LLM", response.model_dump))
 
     # Extract the assistant's message from the response
     assistant_message = response.choices[0].message
@@ -59,11 +619,13 @@ def process_user_query(
 
         depth += 1
         if depth > MAX_CALL_DEPTH:
-            log_function("Maximum tool call depth exceeded. Exiting.")
-            return {
+            log_function(logs.warning("Maximum tool call depth exceeded. Exiting."))
+            yield {
+                "type": "final",
                 "response": "Sorry, the request caused too many internal steps and could not be completed.",
                 "dataset": ds,
             }
+            return
 
         # Add the tool calls to the messages
         tool_calls_messages = {
@@ -81,83 +643,226 @@ def process_user_query(
                 for tc in assistant_message.tool_calls
             ],
         }
-        messages.append(tool_calls_messages)
+        context.append(tool_calls_messages)
 
         # Log the number of tool calls
-        log_function(f"Total tool calls: {len(assistant_message.tool_calls)}")
-
-        # Log the tool calls messages added to the conversation
         log_function(
-            f"Tools calls messages added: {json.dumps(tool_calls_messages, indent=2)}"
+            logs.info(f"Total tool calls: {len(assistant_message.tool_calls)}")
         )
 
-        # Process each function call in the assistant's message
-        for function in assistant_message.tool_calls:
-
-            # Extract the function call details
-            arguments = json.loads(function.function.arguments)
+        # Log the tool calls messages added to the conversation
+        log_function(logs.debug("Tools calls messages added", tool_calls_messages))
 
-            try:
-                # Execute the function call with the provided arguments
-                function_input = tools.FunctionInput(function_call=arguments)
-                output = tools.execute_function(function_input.function_call, ds)
+        # Process the function calls in the assistant's message. Consecutive read-only
+        # calls run concurrently in parallel mode; any other call is an ordering barrier.
+        for group in _group_tool_calls(
+            assistant_message.tool_calls, llm_parallel_tool_calls
+        ):
+            for function in group:
+                yield {
+                    "type": "tool_started",
+                    "name": function.function.name,
+                    "arguments": function.function.arguments,
+                }
 
-                # Extract the function output and dataset from the output
-                function_output = output["response"]
-                ds = output["dataset"]
+            if len(group) > 1:
+                log_function(
+                    logs.info(
+                        f"Executing {len(group)} read-only tool calls in parallel."
+                    )
+                )
+                with ThreadPoolExecutor(
+                    max_workers=min(len(group), PARALLEL_TOOL_CALLS_MAX_WORKERS)
+                ) as executor:
+                    futures = [
+                        executor.submit(
+                            in_current_context(_execute_tool_call), function, ds
+                        )
+                        for function in group
+                    ]
+                    results = [future.result() for future in futures]
+            else:
+                results = [_execute_tool_call(group[0], ds)]
 
-                if function_output.get("final_answer"):
-                    # If the function output contains a final answer, return it
-                    return {
-                        "response": function_output["final_answer"],
-                        "dataset": ds,
-                    }
+            for function, result in zip(group, results):
 
-                # Set the function output to be added to the messages
-                function_message = {
-                    "role": "tool",
-                    "tool_call_id": function.id,
-                    "content": json.dumps(function_output),
+                yield {
+                    "type": "tool_finished",
+                    "name": function.function.name,
+                    "error": result["error"],
                 }
 
-            except Exception as e:
-                # Handle any exceptions that occur during function execution
-                error_msg = f"Error processing function call: {str(e)}"
-                log_function(error_msg)
+                if result["error"] is None:
+                    # Extract the function output and dataset from the result
+                    function_output = result["response"]
+                    ds = result["dataset"]
 
-                # Set the function output to be added to the messages
-                function_message = {
-                    "role": "tool",
-                    "tool_call_id": function.id,
-                    "content": f"Tool call failed: {error_msg}",
-                }
+                    if function_output.get("final_answer"):
+                        # If the function output contains a final answer, return it
+                        yield {
+                            "type": "final",
+                            "response": function_output["final_answer"],
+                            "dataset": ds,
+                        }
+                        return
 
-            # Add the function call message to the messages
-            messages.append(function_message)
+                    # Set the function output to be added to the messages
+                    function_message = {
+                        "role": "tool",
+                        "tool_call_id": function.id,
+                        "content": result["content"],
+                    }
 
-            # Log the function call message added to the conversation
-            log_function(
-                f"Tool call output message added: {json.dumps(function_message, indent=2)}"
-            )
+                else:
+                    # Handle any exceptions that occurred during function execution
+                    error_msg = result["error"]
+                    log_function(logs.warning(error_msg))
+
+                    # Set the function output to be added to the messages
+                    function_message = {
+                        "role": "tool",
+                        "tool_call_id": function.id,
+                        "content": f"Tool call failed: {error_msg}",
+                    }
+
+                # Add the function call message to the messages
+                context.append(function_message)
+
+                # Log the function call message added to the conversation
+                log_function(
+                    logs.debug("Tool call output message added", function_message)
+                )
 
         # Perform the next request to the LLM with the updated messages
-        response = LLM.perform_tools_request(
-            messages,
-            tools=llm_tools,
-            tool_choice=llm_tool_choice,
-            parallel_tool_calls=llm_parallel_tool_calls,
+        response = yield from _request_step(
+            context, log_function, stream, **request_kwargs
         )
 
         # Log the response from the LLM
-        log_function(
-            f"Response from LLM: {json.dumps(response.model_dump(), indent=2)}"
-        )
+        log_function(logs.debug("Response from LLM", response.model_dump))
 
         # Extract the assistant's message from the response
         assistant_message = response.choices[0].message
 
     # Return the final response and updated dataset
-    return {
+    yield {
+        "type": "final",
         "response": assistant_message.content,
         "dataset": ds,
     }
+
+
+def stream_user_query(
+    user_query: str,
+    ds: Dataset,
+    log_function: logs.LogFunction = logs.console,
+    llm_tools=tools.tools,
+    llm_tool_choice=DEFAULT_TOOL_CHOICE,
+    llm_parallel_tool_calls=DEFAULT_PARALLEL_TOOL_CALLS,
+    stream: bool = True,
+    use_router: bool = ROUTER_ENABLED,
+    plan_mode: bool = DEFAULT_PLAN_MODE,
+) -> Iterator[dict]:
+    """
+    Answer a user query, yielding the steps of the agent as events:
+    - {"type": "tool_started", "name", "arguments"} before a tool is executed
+    - {"type": "tool_finished", "name", "error"} after a tool is executed
+    - {"type": "token", "text"} for each part of the final answer, as it is generated.
+      The tokens are a preview: a streamed step may still be rejected or escalated, and
+      the "response" of the final event is the answer
+    - {"type": "plan_discarded", "reason"} in plan mode, when a step of the plan failed
+      after its tool events were yielded, and the ReAct loop starts over
+    - {"type": "final", "response", "dataset", "trace_id"} once, as the last event
+    The run is traced as an "agent.query" span; "trace_id" identifies its spans.
+    Args:
+        user_query (str): The user query.
+        ds (Dataset): The dataset to operate on.
+        log_function (logs.LogFunction): Function to log messages and records.
+        llm_tools: The tools offered to the LLM.
+        llm_tool_choice: The tool choice of the LLM requests.
+        llm_parallel_tool_calls: Whether the LLM may call several tools in one turn.
+        stream (bool): Whether to stream the LLM responses. Without streaming no
+            token events are yielded.
+        use_router (bool): Whether known structured questions are answered directly
+            from the dataset, without the LLM. Such answers yield no token events.
+        plan_mode (bool): Whether the LLM plans all tool calls at once instead of one
+            step at a time. Falls back to the ReAct loop if the plan fails.
+    Yields:
+        dict: The events.
+    """
+
+    with tracer.span(
+        "agent.query",
+        query_chars=len(user_query),
+        stream=stream,
+        parallel_tool_calls=bool(llm_parallel_tool_calls),
+        plan_mode=plan_mode,
+        tool_calls=0,
+    ) as span:
+        for event in _stream_user_query(
+            user_query,
+            ds,
+            log_function,
+            llm_tools=llm_tools,
+            llm_tool_choice=llm_tool_choice,
+            llm_parallel_tool_calls=llm_parallel_tool_calls,
+            stream=stream,
+            use_router=use_router,
+            plan_mode=plan_mode,
+        ):
+            if event["type"] == "tool_started":
+                span.attributes["tool_calls"] += 1
+            elif event["type"] == "final":
+                event["trace_id"] = span.trace_id
+            yield event
+
+
+def process_user_query(
+    user_query: str,
+    ds: Dataset,
+    log_function: logs.LogFunction = logs.console,
+    llm_tools=tools.tools,
+    llm_tool_choice=DEFAULT_TOOL_CHOICE,
+    llm_parallel_tool_calls=DEFAULT_PARALLEL_TOOL_CALLS,
+    use_router: bool = ROUTER_ENABLED,
+    plan_mode: bool = DEFAULT_PLAN_MODE,
+):
+    """
+    Answer a user query without streaming.
+    Args:
+        user_query (str): The user query.
+        ds (Dataset): The dataset to operate on.
+        log_function (logs.LogFunction): Function to log messages and records.
+        llm_tools: The tools offered to the LLM.
+        llm_tool_choice: The tool choice of the LLM requests.
+        llm_parallel_tool_calls: Whether the LLM may call several tools in one turn.
+        use_router (bool): Whether known structured questions are answered directly
+            from the dataset, without the LLM.
+        plan_mode (bool): Whether the LLM plans all tool calls at once instead of one
+            step at a time.
+    Returns:
+        dict: The final response ("response"), the resulting dataset ("dataset"), the
+            executed tool calls ("steps", each with "name" and "error") and the id of
+            the trace of the run ("trace_id").
+    """
+    steps = []
+    for event in stream_user_query(
+        user_query,
+        ds,
+        log_function,
+        llm_tools=llm_tools,
+        llm_tool_choice=llm_tool_choice,
+        llm_parallel_tool_calls=llm_parallel_tool_calls,
+        stream=False,
+        use_router=use_router,
+        plan_mode=plan_mode,
+    ):
+        if event["type"] == "tool_finished":
+            steps.append({"name": event["name"], "error": event["error"]})
+        elif event["type"] == "final":
+            return {
+                "response": event["response"],
+                "dataset": event["dataset"],
+                "steps": steps,
+                "trace_id": event["trace_id"],
+            }
@@ -6,71 +6,1115 @@ from app.const import (
     DEFAULT_TOOL_CHOICE,
     DEFAULT_PARALLEL_TOOL_CALLS,
     API_KEY_ENV_VAR,
+    LLM_MAX_CONNECTIONS,
+    LLM_MAX_KEEPALIVE_CONNECTIONS,
+    LLM_KEEPALIVE_EXPIRY,
+    LLM_CONNECT_TIMEOUT,
+    LLM_REQUEST_TIMEOUT,
+    LLM_CACHE_ENABLED,
+    LLM_CACHE_FILE_PATH,
+    LLM_CACHE_TTL,
+    LLM_CACHE_MAX_ENTRIES,
+    LLM_REQUESTS_PER_MINUTE,
+    LLM_TOKENS_PER_MINUTE,
+    LLM_MAX_RETRIES,
+    LLM_RETRY_BASE_DELAY,
+    LLM_RETRY_MAX_DELAY,
+    LLM_CALL_DEADLINE,
+    LLM_ROLE_MODELS,
+    LLM_ESCALATION_MODEL,
+    LLM_ESCALATION_BASE_URL,
+)
+from openai import (
+    OpenAI,
+    APIConnectionError,
+    APIStatusError,
+    ContentFilterFinishReasonError,
+    LengthFinishReasonError,
+)
+from openai.types.chat import (
+    ChatCompletion,
+    ChatCompletionChunk,
+    ParsedChatCompletion,
 )
-from openai import OpenAI
 from dotenv import load_dotenv
+from email.utils import parsedate_to_datetime
+from prompt import CHARS_PER_TOKEN
+import hashlib
+import httpx
+import json
 import os
-from typing import List
-from pydantic import BaseModel
+import random
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from pydantic import BaseModel, ValidationError
+from tracing import Span, tracer
 
 load_dotenv()  # Load environment variables from .env file
 
 
+class ClientRegistry:
+    """
+    Process-wide registry of long-lived OpenAI clients, keyed by (base_url, api_key).
+    Each client keeps its own HTTP connection pool with keep-alive, so repeated requests
+    to the same endpoint reuse open connections instead of paying for a new TLS
+    handshake every time. All pools share the same limits and timeouts.
+    The registry is thread-safe and can be shared across Streamlit sessions.
+    """
+
+    def __init__(
+        self,
+        max_connections: int = LLM_MAX_CONNECTIONS,
+        max_keepalive_connections: int = LLM_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry: float = LLM_KEEPALIVE_EXPIRY,
+        connect_timeout: float = LLM_CONNECT_TIMEOUT,
+        request_timeout: float = LLM_REQUEST_TIMEOUT,
+    ):
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.timeout = httpx.Timeout(request_timeout, connect=connect_timeout)
+        self._lock = threading.Lock()
+        self._clients: Dict[Tuple[Optional[str], Optional[str]], OpenAI] = {}
+
+    def get_client(
+        self, base_url: Optional[str] = BASE_URL, api_key: Optional[str] = None
+    ) -> OpenAI:
+        """
+        Get the shared client for a base URL and API key, creating it on first use.
+        Args:
+            base_url (Optional[str]): The base URL of the OpenAI-compatible API.
+            api_key (Optional[str]): The API key. Defaults to the key in the environment.
+        Returns:
+            OpenAI: The shared client.
+        """
+        key = (base_url, api_key if api_key is not None else os.getenv(API_KEY_ENV_VAR))
+        client = self._clients.get(key)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(key)
+                if client is None:
+                    client = OpenAI(
+                        base_url=key[0],
+                        api_key=key[1],
+                        max_retries=0,  # Retried by _call_with_retries
+                        http_client=httpx.Client(
+                            limits=self.limits, timeout=self.timeout
+                        ),
+                    )
+                    self._clients[key] = client
+        return client
+
+    def close(self):
+        """
+        Close all synchronous clients and their connection pools.
+        """
+        with self._lock:
+            for client in self._clients.values():
+                client.close()
+            self._clients.clear()
+
+
+clients = ClientRegistry()
+
+
+class RateLimiter:
+    """
+    Process-wide limiter of the LLM request and token rates, as two token buckets that
+    refill continuously up to one minute's worth. A request waits until both buckets
+    hold enough for it. Token counts are estimated before a request and corrected
+    with the actual usage afterwards. A rate limited response pauses all requests.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: int = LLM_REQUESTS_PER_MINUTE,
+        tokens_per_minute: int = LLM_TOKENS_PER_MINUTE,
+    ):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._requests = float(requests_per_minute)
+        self._tokens = float(tokens_per_minute)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        elapsed = now - self._updated
+        self._updated = now
+        self._requests = min(
+            self.requests_per_minute,
+            self._requests + elapsed * self.requests_per_minute / 60,
+        )
+        self._tokens = min(
+            self.tokens_per_minute,
+            self._tokens + elapsed * self.tokens_per_minute / 60,
+        )
+
+    def acquire(self, tokens: int, deadline: Optional[float] = None) -> float:
+        """
+        Wait until a request may be sent, and take its share of the buckets.
+        Args:
+            tokens (int): The estimated tokens of the request.
+            deadline (Optional[float]): time.monotonic() by which the request must be sent.
+        Returns:
+            float: The seconds waited.
+        Raises:
+            TimeoutError: If the request could not be sent before the deadline.
+        """
+        # A request larger than a minute's worth of tokens only waits for a full bucket
+        tokens = min(tokens, self.tokens_per_minute)
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self._paused_until - now
+                if self.requests_per_minute > 0 and self._requests < 1:
+                    wait = max(
+                        wait, (1 - self._requests) * 60 / self.requests_per_minute
+                    )
+                if self.tokens_per_minute > 0 and self._tokens < tokens:
+                    wait = max(
+                        wait, (tokens - self._tokens) * 60 / self.tokens_per_minute
+                    )
+                if wait <= 0:
+                    if self.requests_per_minute > 0:
+                        self._requests -= 1
+                    if self.tokens_per_minute > 0:
+                        self._tokens -= tokens
+                    return waited
+            if deadline is not None and now + wait > deadline:
+                raise TimeoutError("LLM rate limit wait exceeds the call deadline.")
+            time.sleep(wait)
+            waited += wait
+
+    def settle(self, estimated_tokens: int, actual_tokens: Optional[int]):
+        """
+        Correct the token bucket once the actual usage of a request is known.
+        Args:
+            estimated_tokens (int): The tokens taken by acquire.
+            actual_tokens (Optional[int]): The tokens actually used, if reported.
+        """
+        if actual_tokens is None or self.tokens_per_minute <= 0:
+            return
+        with self._lock:
+            estimated_tokens = min(estimated_tokens, self.tokens_per_minute)
+            self._tokens += estimated_tokens - actual_tokens
+
+    def pause(self, seconds: float):
+        """
+        Hold all requests for a while, e.g. after a rate limited response.
+        Args:
+            seconds (float): The seconds to wait from now.
+        """
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+limiter = RateLimiter()
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    """
+    Get the delay a server asked for before retrying, from the Retry-After headers.
+    Args:
+        error (Exception): The error of the request.
+    Returns:
+        Optional[float]: The delay in seconds, if the server gave one.
+    """
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        if "retry-after" in headers:
+            value = headers["retry-after"]
+            try:
+                return float(value)
+            except ValueError:
+                return parsedate_to_datetime(value).timestamp() - time.time()
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+def _is_retryable(error: Exception) -> bool:
+    """
+    Whether a failed request may succeed when sent again: connection errors, timeouts,
+    rate limits and server errors.
+    """
+    if isinstance(error, (APIConnectionError, TimeoutError)):
+        return True
+    if isinstance(error, APIStatusError):
+        return error.status_code in (408, 409, 429) or error.status_code >= 500
+    return False
+
+
+def _call_with_retries(
+    request: Callable[[Optional[float]], object],
+    span: Span,
+    estimated_tokens: int,
+    timeout: Optional[float],
+):
+    """
+    Send a request through the rate limiter, retrying transient failures with jittered
+    exponential backoff (or the delay the server asked for) within a deadline.
+    Args:
+        request (Callable[[Optional[float]], object]): Sends the request, given the
+            seconds left before the deadline (its HTTP timeout).
+        span (Span): The span of the request, for the retry and throttling attributes.
+        estimated_tokens (int): The estimated tokens of the request.
+        timeout (Optional[float]): Seconds the call may take in total. Defaults to
+            LLM_CALL_DEADLINE.
+    Returns:
+        The response of the request.
+    """
+    deadline = time.monotonic() + (
+        timeout if timeout is not None else LLM_CALL_DEADLINE
+    )
+    throttled = 0.0
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        throttled += limiter.acquire(estimated_tokens, deadline)
+        span.set_attributes(throttled_ms=throttled * 1000 if throttled else None)
+        try:
+            return request(max(deadline - time.monotonic(), 0.001))
+        except Exception as e:
+            if attempt == LLM_MAX_RETRIES or not _is_retryable(e):
+                raise
+            retry_after = _retry_after(e)
+            if retry_after is not None:
+                delay = max(retry_after, 0.0) + random.uniform(0, LLM_RETRY_BASE_DELAY)
+            else:
+                # Full jitter, so that concurrent requests do not retry in lockstep
+                delay = random.uniform(
+                    0, min(LLM_RETRY_MAX_DELAY, LLM_RETRY_BASE_DELAY * 2**attempt)
+                )
+            if time.monotonic() + delay > deadline:
+                raise
+            if getattr(e, "status_code", None) == 429:
+                limiter.pause(delay)
+            span.set_attributes(retries=attempt + 1, last_error=type(e).__name__)
+            time.sleep(delay)
+
+
+class ResponseCache:
+    """
+    Persistent, content-addressed cache of LLM responses stored in SQLite.
+    Entries are keyed by a stable hash of the request payload, expire after a TTL
+    and are evicted in least-recently-used order once the cache grows too large.
+    """
+
+    def __init__(
+        self,
+        path: str = LLM_CACHE_FILE_PATH,
+        ttl: float = LLM_CACHE_TTL,
+        max_entries: int = LLM_CACHE_MAX_ENTRIES,
+        enabled: bool = LLM_CACHE_ENABLED,
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._connection = None
+
+    def _connect(self) -> sqlite3.Connection:
+        # Open the database lazily, so importing this module never touches the disk
+        if self._connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS responses_accessed_at "
+                "ON responses (accessed_at)"
+            )
+            self._connection.commit()
+        return self._connection
+
+    @staticmethod
+    def make_key(payload: dict) -> str:
+        """
+        Compute a stable hash of a request payload.
+        Args:
+            payload (dict): The request payload.
+        Returns:
+            str: The hex digest identifying the payload.
+        """
+        serialized = json.dumps(
+            payload, sort_keys=True, separators=(",", ":"), default=str
+        )
+        return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Look up a cached response.
+        Args:
+            key (str): The payload key.
+        Returns:
+            Optional[str]: The serialized response, or None on a miss.
+        """
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            row = connection.execute(
+                "SELECT value, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                if row is not None:
+                    connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    connection.commit()
+                self.misses += 1
+                return None
+            connection.execute(
+                "UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+            connection.commit()
+            self.hits += 1
+            return row[0]
+
+    def set(self, key: str, value: str):
+        """
+        Store a response and evict the least recently used entries beyond the size bound.
+        Args:
+            key (str): The payload key.
+            value (str): The serialized response.
+        """
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            connection.execute(
+                "INSERT OR REPLACE INTO responses (key, value, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?)",
+                (key, value, now, now),
+            )
+            cursor = connection.execute(
+                "DELETE FROM responses WHERE key IN ("
+                "SELECT key FROM responses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self.evictions += max(cursor.rowcount, 0)
+            connection.commit()
+
+    def clear(self):
+        """
+        Remove all cached responses.
+        """
+        with self._lock:
+            connection = self._connect()
+            connection.execute("DELETE FROM responses")
+            connection.commit()
+
+    def stats(self) -> dict:
+        """
+        Get the hit/miss statistics of the cache.
+        Returns:
+            dict: Hits, misses, hit rate, evictions and current number of entries.
+        """
+        with self._lock:
+            entries = (
+                self._connect().execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            )
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": entries,
+        }
+
+
+cache = ResponseCache()
+
+
+class StreamedCompletion:
+    """
+    Accumulates the chunks of a streamed chat completion into a ChatCompletion.
+    """
+
+    def __init__(self):
+        self.id = None
+        self.model = None
+        self.created = None
+        self.content: List[str] = []
+        self.tool_calls: Dict[int, dict] = {}
+        self.finish_reason = None
+        self.usage = None
+
+    def add(self, chunk: ChatCompletionChunk):
+        """
+        Add a chunk to the completion.
+        Args:
+            chunk (ChatCompletionChunk): The streamed chunk.
+        """
+        self.id = self.id or chunk.id
+        self.model = self.model or chunk.model
+        self.created = self.created or chunk.created
+        if chunk.usage is not None:
+            self.usage = chunk.usage.model_dump()
+        for choice in chunk.choices:
+            if choice.delta.content:
+                self.content.append(choice.delta.content)
+            for tool_call in choice.delta.tool_calls or []:
+                accumulated = self.tool_calls.setdefault(
+                    tool_call.index,
+                    {"id": None, "type": "function", "name": "", "arguments": ""},
+                )
+                accumulated["id"] = tool_call.id or accumulated["id"]
+                if tool_call.function is not None:
+                    accumulated["name"] += tool_call.function.name or ""
+                    accumulated["arguments"] += tool_call.function.arguments or ""
+            if choice.finish_reason is not None:
+                self.finish_reason = choice.finish_reason
+
+    def to_completion(self) -> ChatCompletion:
+        """
+        Build the ChatCompletion equivalent to the chunks received so far.
+        Returns:
+            ChatCompletion: The accumulated completion.
+        """
+        message = {
+            "role": "assistant",
+            "content": "".join(self.content) if self.content else None,
+        }
+        if self.tool_calls:
+            message["tool_calls"] = [
+                {
+                    "id": tool_call["id"],
+                    "type": tool_call["type"],
+                    "function": {
+                        "name": tool_call["name"],
+                        "arguments": tool_call["arguments"],
+                    },
+                }
+                for _, tool_call in sorted(self.tool_calls.items())
+            ]
+        return ChatCompletion.model_validate(
+            {
+                "id": self.id or "",
+                "object": "chat.completion",
+                "created": self.created or 0,
+                "model": self.model or "",
+                "choices": [
+                    {
+                        "index": 0,
+                        "finish_reason": self.finish_reason or "stop",
+                        "message": message,
+                    }
+                ],
+                "usage": self.usage,
+            }
+        )
+
+    @staticmethod
+    def to_chunk(completion: ChatCompletion) -> ChatCompletionChunk:
+        """
+        Convert a complete ChatCompletion into a single equivalent chunk.
+        Args:
+            completion (ChatCompletion): The completion.
+        Returns:
+            ChatCompletionChunk: A chunk holding the whole completion.
+        """
+        message = completion.choices[0].message
+        delta = {"role": "assistant", "content": message.content}
+        if message.tool_calls:
+            delta["tool_calls"] = [
+                {
+                    "index": index,
+                    "id": tool_call.id,
+                    "type": tool_call.type,
+                    "function": {
+                        "name": tool_call.function.name,
+                        "arguments": tool_call.function.arguments,
+                    },
+                }
+                for index, tool_call in enumerate(message.tool_calls)
+            ]
+        return ChatCompletionChunk.model_validate(
+            {
+                "id": completion.id,
+                "object": "chat.completion.chunk",
+                "created": completion.created,
+                "model": completion.model,
+                "choices": [
+                    {
+                        "index": 0,
+                        "delta": delta,
+                        "finish_reason": completion.choices[0].finish_reason,
+                    }
+                ],
+                "usage": (
+                    completion.usage.model_dump()
+                    if completion.usage is not None
+                    else None
+                ),
+            }
+        )
+
+
+def _tools_request_cache_key(
+    messages,
+    tools,
+    base_url,
+    model,
+    temperature,
+    top_p,
+    tool_choice,
+    parallel_tool_calls,
+) -> str:
+    # Streamed and non-streamed requests share cache entries
+    return ResponseCache.make_key(
+        {
+            "request": "tools",
+            "base_url": base_url,
+            "model": model,
+            "messages": messages,
+            "tools": tools,
+            "tool_choice": tool_choice,
+            "parallel_tool_calls": parallel_tool_calls,
+            "temperature": temperature,
+            "top_p": top_p,
+        }
+    )
+
+
+def _payload_chars(messages: List[dict]) -> int:
+    """
+    Size of the messages of a request, counted without serializing them.
+    Args:
+        messages (List[dict]): The messages.
+    Returns:
+        int: The number of characters of the contents and tool call arguments.
+    """
+    chars = 0
+    for message in messages:
+        chars += len(message.get("content") or "")
+        for tool_call in message.get("tool_calls") or []:
+            chars += len(tool_call["function"]["arguments"])
+    return chars
+
+
+def _total_tokens(response) -> Optional[int]:
+    return response.usage.total_tokens if response.usage is not None else None
+
+
+def _record_usage(span: Span, response):
+    """
+    Add the token usage and finish reason of a response to its span.
+    Args:
+        span (Span): The span of the request.
+        response: The chat completion.
+    """
+    if response.usage is not None:
+        span.set_attributes(
+            prompt_tokens=response.usage.prompt_tokens,
+            completion_tokens=response.usage.completion_tokens,
+            total_tokens=response.usage.total_tokens,
+        )
+    if response.choices:
+        span.set_attributes(finish_reason=response.choices[0].finish_reason)
+
+
+class ModelRouter:
+    """
+    Process-wide assignment of models to the roles of LLM calls (ReAct steps, plans,
+    summarize batches and reductions), with per-role usage statistics. A call whose
+    output on its role's model fails validation or looks unreliable is sent again to
+    the escalation model, if one is configured.
+    """
+
+    def __init__(
+        self,
+        role_models: Dict[str, Tuple[str, Optional[str]]] = LLM_ROLE_MODELS,
+        escalation_model: Optional[str] = LLM_ESCALATION_MODEL,
+        escalation_base_url: Optional[str] = LLM_ESCALATION_BASE_URL,
+    ):
+        self.role_models = dict(role_models)
+        self.escalation_model = escalation_model
+        self.escalation_base_url = escalation_base_url
+        self._stats: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def endpoints(
+        self,
+        role: str,
+        escalated: bool = False,
+        model: Optional[str] = None,
+        base_url: Optional[str] = None,
+    ) -> List[Tuple[str, Optional[str]]]:
+        """
+        Get the models a call is tried on, in order.
+        Args:
+            role (str): The role of the call.
+            escalated (bool): Whether to start from the escalation model.
+            model (Optional[str]): A model overriding the role's, which disables escalation.
+            base_url (Optional[str]): A base URL overriding the role's.
+        Returns:
+            List[Tuple[str, Optional[str]]]: The models and their base URLs.
+        """
+        role_model, role_base_url = self.role_models.get(role, (MODEL_NAME, BASE_URL))
+        if model is not None or base_url is not None:
+            return [(model or role_model, base_url or role_base_url)]
+        escalation = (self.escalation_model, self.escalation_base_url)
+        if self.escalation_model is None or escalation == (role_model, role_base_url):
+            return [(role_model, role_base_url)]
+        return [escalation] if escalated else [(role_model, role_base_url), escalation]
+
+    def can_escalate(self, role: str) -> bool:
+        """
+        Whether rejected outputs of a role can be sent to a stronger model.
+        Args:
+            role (str): The role of the call.
+        Returns:
+            bool: True if the role has an escalation model.
+        """
+        return len(self.endpoints(role)) > 1
+
+    def record(
+        self,
+        role: str,
+        model: str,
+        response,
+        latency: float,
+        escalated: bool,
+    ):
+        """
+        Add a request to the statistics of its role.
+        Args:
+            role (str): The role of the call.
+            model (str): The model the request was sent to.
+            response: The chat completion, or None if the output was rejected.
+            latency (float): The seconds the request took.
+            escalated (bool): Whether the request went to the escalation model.
+        """
+        usage = getattr(response, "usage", None)
+        with self._lock:
+            role_stats = self._stats.setdefault(
+                role, {"requests": 0, "escalations": 0, "models": {}}
+            )
+            role_stats["requests"] += 1
+            role_stats["escalations"] += escalated
+            model_stats = role_stats["models"].setdefault(
+                model,
+                {
+                    "requests": 0,
+                    "prompt_tokens": 0,
+                    "completion_tokens": 0,
+                    "latency_s": 0.0,
+                },
+            )
+            model_stats["requests"] += 1
+            model_stats["latency_s"] += latency
+            if usage is not None:
+                model_stats["prompt_tokens"] += usage.prompt_tokens
+                model_stats["completion_tokens"] += usage.completion_tokens
+
+    def stats(self) -> dict:
+        """
+        Get the usage statistics of each role.
+        Returns:
+            dict: Per role, the requests, escalations and, per model, the requests,
+                tokens and total latency.
+        """
+        with self._lock:
+            return {
+                role: {
+                    **role_stats,
+                    "models": {
+                        model: dict(model_stats)
+                        for model, model_stats in role_stats["models"].items()
+                    },
+                }
+                for role, role_stats in self._stats.items()
+            }
+
+    def reset_stats(self):
+        """
+        Clear the usage statistics.
+        """
+        with self._lock:
+            self._stats.clear()
+
+
+models = ModelRouter()
+
+# Errors of outputs that could not be parsed, which a stronger model may avoid
+_REJECTED_OUTPUT_ERRORS = (
+    LengthFinishReasonError,
+    ContentFilterFinishReasonError,
+    ValidationError,
+)
+
+
+def tools_response_error(
+    response: ChatCompletion, validate: Optional[Callable[[Any], None]]
+) -> Optional[str]:
+    """
+    Check the output of a tools request.
+    Args:
+        response (ChatCompletion): The response.
+        validate (Optional[Callable[[Any], None]]): Raises if the response is invalid.
+    Returns:
+        Optional[str]: Why the output is rejected, or None if it is accepted.
+    """
+    choice = response.choices[0]
+    if choice.finish_reason == "length":
+        return "truncated"
+    if not choice.message.content and not choice.message.tool_calls:
+        return "empty"
+    if validate is not None:
+        try:
+            validate(response)
+        except Exception as e:
+            return f"{type(e).__name__}: {e}"
+    return None
+
+
+def _structured_response_error(
+    response: ParsedChatCompletion, validate: Optional[Callable[[Any], None]]
+) -> Optional[str]:
+    """
+    Check the output of a structured outputs request.
+    Args:
+        response (ParsedChatCompletion): The response.
+        validate (Optional[Callable[[Any], None]]): Raises if the response is invalid.
+    Returns:
+        Optional[str]: Why the output is rejected, or None if it is accepted.
+    """
+    message = response.choices[0].message
+    if message.refusal:
+        return "refused"
+    if message.parsed is None:
+        return "empty"
+    if validate is not None:
+        try:
+            validate(response)
+        except Exception as e:
+            return f"{type(e).__name__}: {e}"
+    return None
+
+
+def _cascade(
+    span_name: str,
+    role: str,
+    model: Optional[str],
+    base_url: Optional[str],
+    escalated: bool,
+    request: Callable[[str, Optional[str], Span], Tuple[Any, Optional[str]]],
+    check: Callable[[Any], Optional[str]],
+    **attributes,
+):
+    """
+    Send a call to its role's model and, if the output is rejected, to the escalation
+    model. Each request gets its own span. Only accepted responses are cached, so a
+    rejected output is never replayed.
+    Args:
+        span_name (str): The name of the spans.
+        role (str): The role of the call.
+        model (Optional[str]): A model overriding the role's.
+        base_url (Optional[str]): A base URL overriding the role's.
+        escalated (bool): Whether to start from the escalation model.
+        request (Callable[[str, Optional[str], Span], Tuple[Any, Optional[str]]]):
+            Sends the request, given the model, the base URL and the span. Returns the
+            response and the cache key to store it under, or None not to cache it.
+        check (Callable[[Any], Optional[str]]): Why a response is rejected, or None.
+        **attributes: Attributes of the spans.
+    Returns:
+        The response of the last model tried, even if it was rejected.
+    """
+    endpoints = models.endpoints(role, escalated, model, base_url)
+    for attempt, (model, base_url) in enumerate(endpoints):
+        escalation = escalated or attempt > 0
+        last = attempt == len(endpoints) - 1
+        try:
+            with tracer.span(span_name, role=role, model=model, **attributes) as span:
+                span.set_attributes(escalated=escalation or None)
+                response, cache_key = request(model, base_url, span)
+                rejected = check(response)
+                span.set_attributes(rejected=rejected)
+                if rejected is None and cache_key is not None:
+                    cache.set(cache_key, response.model_dump_json())
+        except _REJECTED_OUTPUT_ERRORS as e:
+            if last:
+                raise
+            response, rejected = None, f"{type(e).__name__}: {e}"
+        models.record(role, model, response, span.duration, escalation)
+        if rejected is None or last:
+            return response
+
+
 class LLM:
 
     @staticmethod
     def perform_tools_request(
         messages: List[dict],
         tools: List[dict],
-        base_url: str = BASE_URL,
-        model: str = MODEL_NAME,
+        base_url: Optional[str] = None,
+        model: Optional[str] = None,
         temperature: float = TEMPERATURE,
         top_p: float = TOP_P,
         tool_choice: str = DEFAULT_TOOL_CHOICE,
         parallel_tool_calls: bool = DEFAULT_PARALLEL_TOOL_CALLS,
+        use_cache: bool = True,
+        timeout: Optional[float] = None,
+        role: str = "react_step",
+        escalated: bool = False,
+        validate: Optional[Callable[[ChatCompletion], None]] = None,
     ):
+        """
+        Perform a tools request on the model of its role, escalating a rejected output.
+        The model and base URL default to the role's; setting either disables escalation.
+        validate raises if a response is invalid, e.g. if its tool calls do not validate.
+        """
+
+        def request(model: str, base_url: Optional[str], span: Span):
+            # Only deterministic requests can be served from the cache
+            cacheable = use_cache and cache.enabled and temperature == 0.0
+            if cacheable:
+                cache_key = _tools_request_cache_key(
+                    messages,
+                    tools,
+                    base_url,
+                    model,
+                    temperature,
+                    top_p,
+                    tool_choice,
+                    parallel_tool_calls,
+                )
+                cached = cache.get(cache_key)
+                if cached is not None:
+                    span.set_attributes(cache_hit=True)
+                    return ChatCompletion.model_validate_json(cached), None
+
+            # Get the shared OpenAI client
+            client = clients.get_client(base_url)
+
+            estimated_tokens = _payload_chars(messages) // CHARS_PER_TOKEN
+            response = _call_with_retries(
+                lambda attempt_timeout: client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    tools=tools,
+                    tool_choice=tool_choice,
+                    parallel_tool_calls=parallel_tool_calls,
+                    temperature=temperature,
+                    top_p=top_p,
+                    timeout=attempt_timeout,
+                ),
+                span,
+                estimated_tokens,
+                timeout,
+            )
 
-        # Initialize OpenAI client
-        client = OpenAI(
-            base_url=base_url,
-            api_key=os.getenv(API_KEY_ENV_VAR),
+            _record_usage(span, response)
+            limiter.settle(estimated_tokens, _total_tokens(response))
+
+            return response, cache_key if cacheable else None
+
+        return _cascade(
+            "llm.tools_request",
+            role,
+            model,
+            base_url,
+            escalated,
+            request,
+            lambda response: tools_response_error(response, validate),
+            messages=len(messages),
+            request_chars=_payload_chars(messages),
+            cache_hit=False,
         )
 
-        response = client.chat.completions.create(
+    @staticmethod
+    def stream_tools_request(
+        messages: List[dict],
+        tools: List[dict],
+        base_url: Optional[str] = None,
+        model: Optional[str] = None,
+        temperature: float = TEMPERATURE,
+        top_p: float = TOP_P,
+        tool_choice: str = DEFAULT_TOOL_CHOICE,
+        parallel_tool_calls: bool = DEFAULT_PARALLEL_TOOL_CALLS,
+        use_cache: bool = True,
+        timeout: Optional[float] = None,
+        role: str = "react_step",
+        validate: Optional[Callable[[ChatCompletion], None]] = None,
+    ) -> Iterator[ChatCompletionChunk]:
+        """
+        Stream a tools request, yielding the completion chunks as they arrive.
+        A cached response is replayed as a single chunk.
+        Use StreamedCompletion to assemble the chunks into a ChatCompletion.
+        Streamed outputs are not escalated, as their chunks were already yielded; an
+        invalid one can be requested again with perform_tools_request(escalated=True).
+        validate raises if a response is invalid; invalid responses are not cached.
+        """
+        model, base_url = models.endpoints(role, model=model, base_url=base_url)[0]
+
+        with tracer.span(
+            "llm.stream_tools_request",
+            role=role,
             model=model,
-            messages=messages,
-            tools=tools,
-            tool_choice=tool_choice,
-            parallel_tool_calls=parallel_tool_calls,
-            temperature=temperature,
-            top_p=top_p,
-        )
+            messages=len(messages),
+            request_chars=_payload_chars(messages),
+            cache_hit=False,
+        ) as span:
+            # Only deterministic requests can be served from the cache
+            use_cache = use_cache and cache.enabled and temperature == 0.0
+            if use_cache:
+                cache_key = _tools_request_cache_key(
+                    messages,
+                    tools,
+                    base_url,
+                    model,
+                    temperature,
+                    top_p,
+                    tool_choice,
+                    parallel_tool_calls,
+                )
+                cached = cache.get(cache_key)
+                if cached is not None:
+                    span.set_attributes(cache_hit=True)
+                    response = ChatCompletion.model_validate_json(cached)
+                    models.record(role, model, response, span.duration, False)
+                    yield StreamedCompletion.to_chunk(response)
+                    return
+
+            # Get the shared OpenAI client
+            client = clients.get_client(base_url)
+
+            # Failures are retried until the stream starts; a stream that breaks
+            # off later is not retried, as its chunks were already yielded
+            estimated_tokens = _payload_chars(messages) // CHARS_PER_TOKEN
+            stream = _call_with_retries(
+                lambda attempt_timeout: client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    tools=tools,
+                    tool_choice=tool_choice,
+                    parallel_tool_calls=parallel_tool_calls,
+                    temperature=temperature,
+                    top_p=top_p,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                    timeout=attempt_timeout,
+                ),
+                span,
+                estimated_tokens,
+                timeout,
+            )
 
-        return response
+            completion = StreamedCompletion()
+            for chunk in stream:
+                if "first_chunk_ms" not in span.attributes:
+                    span.set_attributes(first_chunk_ms=span.duration * 1000)
+                completion.add(chunk)
+                yield chunk
+
+            response = completion.to_completion()
+            _record_usage(span, response)
+            models.record(role, model, response, span.duration, False)
+            limiter.settle(estimated_tokens, _total_tokens(response))
+
+            # Only cache an accepted output, so a rejected one is not replayed
+            rejected = tools_response_error(response, validate)
+            span.set_attributes(rejected=rejected)
+            if use_cache and rejected is None:
+                cache.set(cache_key, response.model_dump_json())
 
     @staticmethod
     def perform_structured_outputs_request(
         messages: List[dict],
         response_format: BaseModel,
-        base_url: str = BASE_URL,
-        model: str = MODEL_NAME,
+        base_url: Optional[str] = None,
+        model: Optional[str] = None,
         temperature: float = TEMPERATURE,
         top_p: float = TOP_P,
+        timeout: Optional[float] = None,
+        use_cache: bool = True,
+        role: str = "react_step",
+        escalated: bool = False,
+        validate: Optional[Callable[[ParsedChatCompletion], None]] = None,
     ):
+        """
+        Perform a structured outputs request on the model of its role, escalating an
+        output that is refused, cut short, does not parse or fails validate.
+        The model and base URL default to the role's; setting either disables escalation.
+        """
 
-        # Initialize OpenAI client
-        # Initialize OpenAI client
-        client = OpenAI(
-            base_url=base_url,
-            api_key=os.getenv(API_KEY_ENV_VAR),
-        )
+        def request(model: str, base_url: Optional[str], span: Span):
+            # Only deterministic requests can be served from the cache
+            cacheable = use_cache and cache.enabled and temperature == 0.0
+            if cacheable:
+                cache_key = ResponseCache.make_key(
+                    {
+                        "request": "structured_outputs",
+                        "base_url": base_url,
+                        "model": model,
+                        "messages": messages,
+                        "response_format": response_format.model_json_schema(),
+                        "temperature": temperature,
+                        "top_p": top_p,
+                    }
+                )
+                cached = cache.get(cache_key)
+                if cached is not None:
+                    span.set_attributes(cache_hit=True)
+                    return (
+                        ParsedChatCompletion[response_format].model_validate_json(
+                            cached
+                        ),
+                        None,
+                    )
 
-        response = client.beta.chat.completions.parse(
-            model=model,
-            messages=messages,
-            response_format=response_format,
-            temperature=temperature,
-            top_p=top_p,
-        )
+            # Get the shared OpenAI client
+            client = clients.get_client(base_url)
+
+            estimated_tokens = _payload_chars(messages) // CHARS_PER_TOKEN
+            response = _call_with_retries(
+                lambda attempt_timeout: client.beta.chat.completions.parse(
+                    model=model,
+                    messages=messages,
+                    response_format=response_format,
+                    temperature=temperature,
+                    top_p=top_p,
+                    timeout=attempt_timeout,
+                ),
+                span,
+                estimated_tokens,
+                timeout,
+            )
 
-        return response
+            _record_usage(span, response)
+            limiter.settle(estimated_tokens, _total_tokens(response))
+
+            return response, cache_key if cacheable else None
+
+        return _cascade(
+            "llm.structured_outputs_request",
+            role,
+            model,
+            base_url,
+            escalated,
+            request,
+            lambda response: _structured_response_error(response, validate),
+            response_format=response_format.__name__,
+            messages=len(messages),
+            request_chars=_payload_chars(messages),
+            cache_hit=False,
+        )
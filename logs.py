@@ -0,0 +1,126 @@
+from app.const import LOG_LEVEL, LOG_DEBUG_SAMPLE_RATE
+from typing import Any, Callable, Union
+import json
+import logging
+import random
+
+DEBUG = logging.DEBUG
+INFO = logging.INFO
+WARNING = logging.WARNING
+ERROR = logging.ERROR
+
+
+class LogRecord:
+    """
+    A log message with an optional JSON payload that is only serialized when the
+    record is rendered with str(), so log functions that drop the record never pay
+    for the serialization.
+    The payload may be a callable (e.g. `response.model_dump`) to also defer building it.
+    A record is rendered from the payload as it is at that time; log functions that
+    keep records around should render them right away.
+    """
+
+    def __init__(self, message: str, payload: Any = None, level: int = INFO):
+        self.message = message
+        self.payload = payload
+        self.level = level
+
+    def __str__(self) -> str:
+        if self.payload is None:
+            return self.message
+        payload = self.payload() if callable(self.payload) else self.payload
+        return f"{self.message}: {json.dumps(payload, indent=2)}"
+
+    def __format__(self, format_spec: str) -> str:
+        return format(str(self), format_spec)
+
+
+# Log functions of the agent receive plain messages or LogRecords; both render with str()
+LogFunction = Callable[[Union[str, LogRecord]], None]
+
+
+def debug(message: str, payload: Any = None) -> LogRecord:
+    """
+    Create a DEBUG log record.
+    """
+    return LogRecord(message, payload, DEBUG)
+
+
+def info(message: str, payload: Any = None) -> LogRecord:
+    """
+    Create an INFO log record.
+    """
+    return LogRecord(message, payload, INFO)
+
+
+def warning(message: str, payload: Any = None) -> LogRecord:
+    """
+    Create a WARNING log record.
+    """
+    return LogRecord(message, payload, WARNING)
+
+
+def error(message: str, payload: Any = None) -> LogRecord:
+    """
+    Create an ERROR log record.
+    """
+    return LogRecord(message, payload, ERROR)
+
+
+def _level_number(level: Union[int, str]) -> int:
+    """
+    Get the number of a log level given by number or (case-insensitive) name.
+    Args:
+        level (Union[int, str]): The level, e.g. 20 or "info".
+    Returns:
+        int: The level number.
+    Raises:
+        ValueError: If the name is not a known level.
+    """
+    if isinstance(level, int):
+        return level
+    number = logging.getLevelName(level.strip().upper())
+    if not isinstance(number, int):
+        raise ValueError(f"Unknown log level: {level!r}.")
+    return number
+
+
+class LogSink:
+    """
+    A log function that forwards to another one only the records at or above a level,
+    and a random sample of the DEBUG records. Plain string messages count as INFO.
+    Forwarded records are rendered to strings, so the wrapped function only receives
+    strings and only forwarded records pay for serializing their payload.
+    """
+
+    def __init__(
+        self,
+        log_function: Callable[[str], None],
+        level: Union[int, str] = LOG_LEVEL,
+        debug_sample_rate: float = LOG_DEBUG_SAMPLE_RATE,
+    ):
+        self.log_function = log_function
+        self.level = _level_number(level)
+        self.debug_sample_rate = debug_sample_rate
+
+    def enabled(self, level: int) -> bool:
+        """
+        Whether records of a level are forwarded at all.
+        Args:
+            level (int): The level.
+        Returns:
+            bool: True if records of the level may be forwarded.
+        """
+        return level >= self.level and (level > DEBUG or self.debug_sample_rate > 0)
+
+    def __call__(self, message):
+        level = getattr(message, "level", INFO)
+        if not self.enabled(level):
+            return
+        if level <= DEBUG and random.random() >= self.debug_sample_rate:
+            return
+        self.log_function(str(message))
+
+
+# Default log function of the agent: prints the records at the configured level
+console = LogSink(print)
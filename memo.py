@@ -0,0 +1,83 @@
+from app.const import TOOL_CACHE_ENABLED, TOOL_CACHE_MAX_ENTRIES
+from collections import OrderedDict
+from typing import Any, Optional
+import threading
+
+
+class ToolResultCache:
+    """
+    Process-wide, in-memory cache of deterministic tool results, shared by all
+    sessions. Entries are keyed by the tool, its arguments and the fingerprint of the
+    dataset view it ran on, so a filter that changes the view never reads the results
+    of another view. The least recently used entries are evicted once the cache is full.
+    Cached results are shared and must not be modified.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = TOOL_CACHE_MAX_ENTRIES,
+        enabled: bool = TOOL_CACHE_ENABLED,
+    ):
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[tuple, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple) -> Optional[Any]:
+        """
+        Get a cached result.
+        Args:
+            key (tuple): The key of the result.
+        Returns:
+            Optional[Any]: The result, or None if it is not cached.
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: tuple, value: Any):
+        """
+        Cache a result, evicting the least recently used ones beyond max_entries.
+        Args:
+            key (tuple): The key of the result.
+            value (Any): The result.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """
+        Remove all entries.
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """
+        Get the usage statistics of the cache.
+        Returns:
+            dict: The number of entries, hits, misses and evictions.
+        """
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
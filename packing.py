@@ -0,0 +1,119 @@
+from prompt import count_tokens, CHARS_PER_TOKEN
+from typing import Dict, List
+import pandas as pd
+
+_TRUNCATION_MARK = " [...]"
+
+
+def _escape(value) -> str:
+    """
+    Write a value as a single table cell.
+    Args:
+        value: The value.
+    Returns:
+        str: The value without tabs and with line breaks written as \\n.
+    """
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\r\n", "\\n")
+        .replace("\n", "\\n")
+        .replace("\t", " ")
+    )
+
+
+class PromptTable:
+    """
+    Compact tabular encoding of DataFrame rows for prompts.
+    Columns with the same value on every row are written once as shared values instead
+    of on every row; the other columns form a tab-separated table, one line per row.
+    The tokens of each row are counted locally, so rows can be packed into batches
+    that fit a token budget.
+    """
+
+    def __init__(self, df: pd.DataFrame, max_row_tokens: int):
+        """
+        Args:
+            df (pd.DataFrame): The rows.
+            max_row_tokens (int): Rows longer than this are truncated to fit.
+        """
+        self.shared: Dict[str, str] = {}
+        self.columns: List[str] = []
+        for column in df.columns:
+            values = df[column]
+            if len(df) > 1 and values.nunique(dropna=False) == 1:
+                self.shared[column] = _escape(values.iloc[0])
+            else:
+                self.columns.append(column)
+
+        self.lines: List[str] = []
+        self.tokens: List[int] = []
+        for row in df[self.columns].itertuples(index=False, name=None):
+            cells = [_escape(value) for value in row]
+            line = "\t".join(cells)
+            tokens = count_tokens(line)
+            if tokens > max_row_tokens:
+                line, tokens = self._truncate(cells, max_row_tokens)
+            self.lines.append(line)
+            self.tokens.append(tokens)
+
+    @staticmethod
+    def _truncate(cells: List[str], max_tokens: int):
+        """
+        Shorten the longest cells of a row until it fits the token limit.
+        Args:
+            cells (List[str]): The cells of the row.
+            max_tokens (int): The token limit.
+        Returns:
+            tuple: The truncated line and its token count.
+        """
+        cells = list(cells)
+        while True:
+            line = "\t".join(cells)
+            tokens = count_tokens(line)
+            if tokens <= max_tokens:
+                return line, tokens
+            longest = max(range(len(cells)), key=lambda i: len(cells[i]))
+            excess_chars = (tokens - max_tokens) * CHARS_PER_TOKEN
+            keep = max(0, len(cells[longest]) - len(_TRUNCATION_MARK) - excess_chars)
+            if keep == 0 and len(cells[longest]) <= len(_TRUNCATION_MARK):
+                return line, tokens  # Nothing left to cut
+            cells[longest] = cells[longest][:keep] + _TRUNCATION_MARK
+
+    def pack(self, token_budget: int) -> List[List[int]]:
+        """
+        Pack the rows into as few batches as possible with at most token_budget tokens
+        of rows each (first fit, keeping the order of the rows).
+        Args:
+            token_budget (int): The maximum number of tokens of rows per batch.
+        Returns:
+            List[List[int]]: The row numbers of each batch.
+        """
+        batches: List[List[int]] = []
+        free: List[int] = []
+        for row, tokens in enumerate(self.tokens):
+            for i, space in enumerate(free):
+                if tokens <= space:
+                    batches[i].append(row)
+                    free[i] -= tokens
+                    break
+            else:
+                batches.append([row])
+                free.append(token_budget - tokens)
+        return batches
+
+    def render(self, rows: List[int]) -> str:
+        """
+        Write some of the rows as a table.
+        Args:
+            rows (List[int]): The row numbers.
+        Returns:
+            str: The table, preceded by the values shared by all rows.
+        """
+        lines = []
+        if self.shared:
+            shared = ", ".join(f"{key}={value}" for key, value in self.shared.items())
+            lines.append(f"Shared by all rows: {shared}")
+        lines.append("\t".join(self.columns))
+        lines.extend(self.lines[row] for row in rows)
+        return "\n".join(lines)
@@ -0,0 +1,141 @@
+from pydantic import BaseModel, Field
+from typing import Dict, List, Optional
+import json
+import tools
+
+
+class PlanReference(BaseModel):
+    argument: str = Field(
+        ..., description="Name of the argument of this step to set, e.g. 'a'."
+    )
+    step: str = Field(..., description="Id of an earlier step.")
+    key: str = Field(
+        ..., description="Key of the earlier step's output to use, e.g. 'count'."
+    )
+
+
+class PlanStep(BaseModel):
+    id: str = Field(..., description="Unique id of the step, e.g. 's1'.")
+    dataset_from: Optional[str] = Field(
+        ...,
+        description=(
+            "Id of an earlier step whose resulting dataset this step operates on "
+            "(e.g. a select_semantic_* step), or null for the current dataset."
+        ),
+    )
+    references: List[PlanReference] = Field(
+        ...,
+        description=(
+            "Arguments taken from the outputs of earlier steps. Give these arguments "
+            "any placeholder value in function_call."
+        ),
+    )
+    function_call: tools.FunctionType
+
+
+class QueryPlan(BaseModel):
+    reasoning: str = Field(..., description="How the plan answers the user query.")
+    steps: List[PlanStep] = Field(
+        ...,
+        description=(
+            "The tool calls, in order. Steps that do not depend on each other run "
+            "concurrently. Leave empty for out-of-scope questions."
+        ),
+    )
+
+
+def _dependencies(step: PlanStep) -> List[str]:
+    """
+    Get the ids of the steps a step depends on.
+    Args:
+        step (PlanStep): The step.
+    Returns:
+        List[str]: The ids.
+    """
+    dependencies = [reference.step for reference in step.references]
+    if step.dataset_from is not None:
+        dependencies.append(step.dataset_from)
+    return dependencies
+
+
+def validate_plan(plan: QueryPlan):
+    """
+    Check that a plan can be executed: step ids are unique, steps only depend on
+    earlier steps (so the plan is acyclic) and the final answer is left to the phrasing.
+    Args:
+        plan (QueryPlan): The plan.
+    Raises:
+        ValueError: If the plan is invalid.
+    """
+    seen = set()
+    for step in plan.steps:
+        if step.id in seen:
+            raise ValueError(f"Duplicate step id '{step.id}'.")
+        if step.function_call.function_type == "finish":
+            raise ValueError("Plans must not call finish.")
+        for dependency in _dependencies(step):
+            if dependency not in seen:
+                raise ValueError(
+                    f"Step '{step.id}' depends on '{dependency}', which is not an earlier step."
+                )
+        argument_names = type(step.function_call).model_fields
+        for reference in step.references:
+            if reference.argument not in argument_names:
+                raise ValueError(
+                    f"Step '{step.id}' has no argument '{reference.argument}'."
+                )
+        seen.add(step.id)
+
+
+def plan_waves(plan: QueryPlan) -> List[List[PlanStep]]:
+    """
+    Group the steps of a valid plan into waves: each step runs in the first wave after
+    all the steps it depends on, so the steps of a wave can run concurrently.
+    Args:
+        plan (QueryPlan): The plan.
+    Returns:
+        List[List[PlanStep]]: The waves, in execution order.
+    """
+    wave_of: Dict[str, int] = {}
+    waves: List[List[PlanStep]] = []
+    for step in plan.steps:
+        wave = 1 + max((wave_of[d] for d in _dependencies(step)), default=-1)
+        wave_of[step.id] = wave
+        if wave == len(waves):
+            waves.append([])
+        waves[wave].append(step)
+    return waves
+
+
+def resolve_function_call(
+    step: PlanStep, responses: Dict[str, dict]
+) -> tools.FunctionType:
+    """
+    Fill in the arguments of a step that reference the outputs of earlier steps.
+    Args:
+        step (PlanStep): The step.
+        responses (Dict[str, dict]): The responses of the executed steps, by id.
+    Returns:
+        tools.FunctionType: The validated function call of the step.
+    Raises:
+        ValueError: If a referenced output does not exist.
+    """
+    if not step.references:
+        return step.function_call
+
+    arguments = step.function_call.model_dump()
+    for reference in step.references:
+        response = responses[reference.step]
+        if reference.key not in response:
+            raise ValueError(
+                f"Step '{reference.step}' has no output '{reference.key}' "
+                f"(outputs: {', '.join(response)})."
+            )
+        value = response[reference.key]
+        # Arguments such as sort_dict_by_values' d take structured outputs as JSON
+        if isinstance(arguments[reference.argument], str) and not isinstance(
+            value, str
+        ):
+            value = json.dumps(value)
+        arguments[reference.argument] = value
+    return type(step.function_call).model_validate(arguments)
@@ -1,3 +1,9 @@
+from functools import lru_cache
+
+# Rough number of characters per token, used when tiktoken is not installed
+CHARS_PER_TOKEN = 4
+
+
 def read_prompt_file(prompt_file_path: str) -> str:
     """
     Reads a prompt from a specified file.
@@ -9,3 +15,29 @@ def read_prompt_file(prompt_file_path: str) -> str:
     with open(prompt_file_path, "r", encoding="utf-8") as f:
         prompt = f.read()
     return prompt
+
+
+@lru_cache(maxsize=1)
+def _get_encoding():
+    # tiktoken is optional; without it token counts are estimated from the text length
+    try:
+        import tiktoken
+
+        return tiktoken.get_encoding("o200k_base")
+    except Exception:
+        return None
+
+
+def count_tokens(text: str) -> int:
+    """
+    Count the tokens in a text locally.
+    Uses tiktoken when it is installed and a characters-per-token estimate otherwise.
+    Args:
+        text (str): The text to count.
+    Returns:
+        int: The number of tokens.
+    """
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return -(-len(text) // CHARS_PER_TOKEN)
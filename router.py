@@ -0,0 +1,284 @@
+from data import Dataset
+import tools
+from typing import Callable, Dict, List, Optional
+import re
+
+_DEFAULT_TOP_K = 5
+_DEFAULT_TOP_K_BY = 3
+_DEFAULT_EXAMPLES = 3
+_MAX_EXAMPLES = 10
+
+_COLUMNS = {
+    "category": "category",
+    "categories": "category",
+    "intent": "intent",
+    "intents": "intent",
+}
+_LABELS = {"category": "categories", "intent": "intents"}
+_ROWS = r"(?:rows|requests|examples|records|entries|samples|conversations|queries)"
+
+
+class RoutedQuery:
+    """
+    A user query matched to a known template: the tool calls that answer it and how
+    to phrase the answer from their responses.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        function_calls: List[tools.FunctionType],
+        answer: Callable[[List[dict]], str],
+    ):
+        self.name = name
+        self.function_calls = function_calls
+        self.answer = answer
+
+
+def _normalize(query: str) -> str:
+    """
+    Lowercase a query and strip the punctuation and whitespace around its words.
+    Args:
+        query (str): The query.
+    Returns:
+        str: The normalized query.
+    """
+    query = re.sub(r"\s+", " ", query.strip().lower())
+    return query.strip(" ?!.")
+
+
+def _resolve(name: str, values: List[str]) -> Optional[str]:
+    """
+    Find the value of a categorical column a query refers to.
+    Args:
+        name (str): The name used in the query, e.g. "refund" or "get refund".
+        values (List[str]): The values of the column.
+    Returns:
+        Optional[str]: The value, or None unless exactly one value matches.
+    """
+    key = re.sub(r"[\s-]+", "_", name.strip(" '\"")).upper()
+    matches = [value for value in values if value.upper() == key]
+    return matches[0] if len(matches) == 1 else None
+
+
+def _possible_values(ds: Dataset, column: str) -> List[str]:
+    if column == "category":
+        return ds.get_possible_categories()
+    return ds.get_possible_intents()
+
+
+def _function_call(**arguments) -> tools.FunctionType:
+    return tools.FunctionInput(
+        function_call={"reasoning": "Routed structured question.", **arguments}
+    ).function_call
+
+
+def _bullets(items) -> str:
+    return "\n".join(f"- {item}" for item in items)
+
+
+def _list_values(groups: Dict[str, str], ds: Dataset) -> Optional[RoutedQuery]:
+    column = _COLUMNS[groups["column"]]
+    function_type = f"get_possible_{_LABELS[column]}"
+
+    def answer(responses: List[dict]) -> str:
+        values = responses[0][f"possible_{_LABELS[column]}"]
+        return (
+            f"The dataset contains {len(values)} {_LABELS[column]}:\n\n"
+            f"{_bullets(values)}"
+        )
+
+    return RoutedQuery(
+        f"list_{_LABELS[column]}", [_function_call(function_type=function_type)], answer
+    )
+
+
+def _most_frequent(groups: Dict[str, str], ds: Dataset) -> Optional[RoutedQuery]:
+    column = _COLUMNS[groups["column"]]
+    top_k = int(groups.get("top_k") or _DEFAULT_TOP_K)
+
+    def answer(responses: List[dict]) -> str:
+        distribution = responses[0]["distribution"]
+        return f"The most frequent {_LABELS[column]} are:\n\n" + _bullets(
+            f"{value}: {count} rows" for value, count in distribution.items()
+        )
+
+    return RoutedQuery(
+        f"most_frequent_{_LABELS[column]}",
+        [_function_call(function_type="get_distribution", column=column, top_k=top_k)],
+        answer,
+    )
+
+
+def _distribution(groups: Dict[str, str], ds: Dataset) -> Optional[RoutedQuery]:
+    column = _COLUMNS[groups["column"]]
+
+    def answer(responses: List[dict]) -> str:
+        distribution = responses[0]["distribution"]
+        total = sum(distribution.values())
+        return (
+            f"Distribution of the {len(distribution)} {_LABELS[column]} "
+            f"over {total} rows:\n\n"
+            + _bullets(
+                f"{value}: {count} rows ({count / total:.1%})"
+                for value, count in distribution.items()
+            )
+        )
+
+    return RoutedQuery(
+        f"{column}_distribution",
+        [_function_call(function_type="get_distribution", column=column)],
+        answer,
+    )
+
+
+def _distribution_by(groups: Dict[str, str], ds: Dataset) -> Optional[RoutedQuery]:
+    column = _COLUMNS[groups["column"]]
+    by = _COLUMNS[groups["by"]]
+    if column == by:
+        return None
+    top_k = int(groups.get("top_k") or _DEFAULT_TOP_K_BY)
+
+    def answer(responses: List[dict]) -> str:
+        distribution = responses[0]["distribution"]
+        lines = [f"The most frequent {_LABELS[column]} per {by}:"]
+        for by_value, counts in distribution.items():
+            lines.append(f"\n**{by_value}**\n")
+            lines.append(
+                _bullets(f"{value}: {count} rows" for value, count in counts.items())
+            )
+        return "\n".join(lines)
+
+    return RoutedQuery(
+        f"{column}_distribution_by_{by}",
+        [
+            _function_call(
+                function_type="get_distribution", column=column, top_k=top_k, by=by
+            )
+        ],
+        answer,
+    )
+
+
+def _count_rows(groups: Dict[str, str], ds: Dataset) -> Optional[RoutedQuery]:
+    def answer(responses: List[dict]) -> str:
+        return f"There are {responses[0]['number_of_rows']} rows."
+
+    return RoutedQuery(
+        "count_rows", [_function_call(function_type="count_rows")], answer
+    )
+
+
+def _count_value(groups: Dict[str, str], ds: Dataset) -> Optional[RoutedQuery]:
+    column = _COLUMNS[groups["column"]]
+    value = _resolve(groups["value"], _possible_values(ds, column))
+    if value is None:
+        return None
+
+    def answer(responses: List[dict]) -> str:
+        return f"There are {responses[0]['count']} rows with {column} {value}."
+
+    return RoutedQuery(
+        f"count_{column}",
+        [_function_call(function_type=f"count_{column}", **{column: value})],
+        answer,
+    )
+
+
+def _examples(groups: Dict[str, str], ds: Dataset) -> Optional[RoutedQuery]:
+    column = _COLUMNS[groups["column"]]
+    value = _resolve(groups["value"], _possible_values(ds, column))
+    if value is None:
+        return None
+    n = min(int(groups.get("n") or _DEFAULT_EXAMPLES), _MAX_EXAMPLES)
+
+    def answer(responses: List[dict]) -> str:
+        examples = responses[1]["examples"]
+        lines = [f"Here are {len(examples)} examples of {column} {value}:"]
+        for i, example in enumerate(examples, start=1):
+            lines.append(
+                f"\n**Example {i}**\n\n"
+                f"- Instruction: {example.get('instruction')}\n"
+                f"- Response: {example.get('response')}"
+            )
+        return "\n".join(lines)
+
+    return RoutedQuery(
+        f"{column}_examples",
+        [
+            _function_call(
+                function_type=f"select_semantic_{column}",
+                **{f"{column}_names": [value]},
+            ),
+            _function_call(function_type="show_examples", n=n),
+        ],
+        answer,
+    )
+
+
+# Question templates, tried in order. A template matches the whole normalized query;
+# its handler returns None when the query refers to unknown values, so that the
+# query goes to the LLM instead.
+ROUTES = [
+    (
+        r"(?:what|which) (?P<column>categories|intents) (?:exist|are there|are available)"
+        r"(?: in the dataset)?|(?:list|show|show me|get) (?:all )?(?:the )?"
+        r"(?:possible |available |existing )?(?P<column2>categories|intents)",
+        _list_values,
+    ),
+    (
+        r"(?:what|which) are the (?:top (?P<top_k>\d+) )?(?:most (?:frequent|common) )"
+        r"(?P<column>categories|intents)|(?:show |list )?(?:the )?(?:top (?P<top_k2>\d+) "
+        r"|most (?:frequent|common) )(?P<column2>categories|intents)",
+        _most_frequent,
+    ),
+    (
+        r"(?:show|what is|what are|get) (?:me )?(?:the )?(?P<column>category|intent) "
+        r"distributions?|(?:show|what is|get) (?:me )?(?:the )?distribution of "
+        r"(?:the )?(?P<column2>categories|intents)",
+        _distribution,
+    ),
+    (
+        r"(?:which|what) (?:are the )?(?:top (?P<top_k>\d+) )?(?P<column>categories|intents) "
+        r"(?:are )?(?:the )?most (?:frequent|common) (?:in|per|for|by) (?:each )?"
+        r"(?P<by>category|intent)",
+        _distribution_by,
+    ),
+    (rf"how many {_ROWS} (?:are there|does the dataset (?:have|contain))", _count_rows),
+    (
+        rf"how many {_ROWS} (?:are (?:there )?)?(?:in|for|of|with) (?:the )?"
+        r"(?P<column>category|intent) (?P<value>[\w' -]+?)(?: are there)?",
+        _count_value,
+    ),
+    (
+        r"(?:show|give|list) (?:me )?(?P<n>\d+ )?examples? (?:of|from|for) (?:the )?"
+        r"(?P<column>category|intent) (?P<value>[\w' -]+)",
+        _examples,
+    ),
+]
+ROUTES = [(re.compile(pattern), handler) for pattern, handler in ROUTES]
+
+
+def route(user_query: str, ds: Dataset) -> Optional[RoutedQuery]:
+    """
+    Match a user query to a known structured question that can be answered from the
+    dataset without the LLM.
+    Args:
+        user_query (str): The user query.
+        ds (Dataset): The dataset the query is about.
+    Returns:
+        Optional[RoutedQuery]: The routed query, or None if the query needs the LLM.
+    """
+    query = _normalize(user_query)
+    for pattern, handler in ROUTES:
+        match = pattern.fullmatch(query)
+        if match is None:
+            continue
+        # Alternatives of a pattern name their groups column2, top_k2...
+        groups = {
+            name.rstrip("2"): value.strip()
+            for name, value in match.groupdict().items()
+            if value is not None
+        }
+        return handler(groups, ds)
+    return None
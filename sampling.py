@@ -0,0 +1,219 @@
+from app.const import (
+    SAMPLING_NUM_PERM,
+    SAMPLING_BANDS,
+    SAMPLING_SHINGLE_SIZE,
+    SAMPLING_MEDOID_CANDIDATES,
+)
+from typing import List, Sequence
+import numpy as np
+import re
+import zlib
+
+# Prime modulus of the MinHash permutations, just above 2**32
+_MERSENNE_PRIME = np.uint64(4294967311)
+_WORD_PATTERN = re.compile(r"\w+")
+
+
+def _shingle_hashes(texts: Sequence[str], shingle_size: int):
+    """
+    Hash the word shingles of each text with a stable hash.
+    Args:
+        texts (Sequence[str]): The texts.
+        shingle_size (int): Number of consecutive words per shingle.
+    Returns:
+        tuple: The hashes of all shingles, concatenated, and the offset of the first
+            shingle of each text. Every text has at least one shingle.
+    """
+    hashes: List[int] = []
+    offsets = np.empty(len(texts), dtype=np.int64)
+    for i, text in enumerate(texts):
+        offsets[i] = len(hashes)
+        words = _WORD_PATTERN.findall(str(text).lower())
+        shingles = [
+            " ".join(words[j : j + shingle_size])
+            for j in range(max(1, len(words) - shingle_size + 1))
+        ]
+        hashes.extend(zlib.crc32(shingle.encode("utf-8")) for shingle in shingles)
+    return np.array(hashes, dtype=np.uint64), offsets
+
+
+def minhash_signatures(
+    texts: Sequence[str],
+    num_perm: int = SAMPLING_NUM_PERM,
+    shingle_size: int = SAMPLING_SHINGLE_SIZE,
+    seed: int = 0,
+) -> np.ndarray:
+    """
+    Compute the MinHash signatures of texts over their word shingles. The share of
+    equal signature entries of two texts estimates the Jaccard similarity of their shingles.
+    Args:
+        texts (Sequence[str]): The texts.
+        num_perm (int): Number of hash permutations (signature length).
+        shingle_size (int): Number of consecutive words per shingle.
+        seed (int): Seed of the hash permutations.
+    Returns:
+        np.ndarray: The signatures, one row of num_perm entries per text.
+    """
+    signatures = np.empty((len(texts), num_perm), dtype=np.uint64)
+    if len(texts) == 0:
+        return signatures
+
+    hashes, offsets = _shingle_hashes(texts, shingle_size)
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, 2**31, size=num_perm, dtype=np.uint64)
+    b = rng.integers(0, 2**31, size=num_perm, dtype=np.uint64)
+
+    # One permutation at a time over all shingles, keeping the minimum per text
+    for k in range(num_perm):
+        permuted = (a[k] * hashes + b[k]) % _MERSENNE_PRIME
+        signatures[:, k] = np.minimum.reduceat(permuted, offsets)
+    return signatures
+
+
+def near_duplicate_clusters(
+    signatures: np.ndarray, bands: int = SAMPLING_BANDS
+) -> np.ndarray:
+    """
+    Cluster near-duplicate texts with MinHash locality-sensitive hashing: texts whose
+    signatures agree on all entries of at least one band are linked, and linked texts
+    share a cluster.
+    Args:
+        signatures (np.ndarray): The MinHash signatures.
+        bands (int): Number of bands the signatures are split into. More bands link
+            less similar texts.
+    Returns:
+        np.ndarray: The cluster label of each text (the smallest position in its cluster).
+    """
+    n, num_perm = signatures.shape
+    labels = np.arange(n)
+    if n == 0:
+        return labels
+    rows = num_perm // bands
+
+    # Group the texts by the value of each band
+    groups = []
+    for band in range(bands):
+        keys = np.ascontiguousarray(signatures[:, band * rows : (band + 1) * rows])
+        _, inverse = np.unique(
+            keys.view(np.dtype((np.void, keys.dtype.itemsize * rows))).ravel(),
+            return_inverse=True,
+        )
+        groups.append(inverse.ravel())
+
+    # Propagate the smallest label through the groups until it is stable
+    while True:
+        previous = labels
+        for inverse in groups:
+            smallest = np.full(inverse.max() + 1, n, dtype=labels.dtype)
+            np.minimum.at(smallest, inverse, labels)
+            labels = smallest[inverse]
+        labels = labels[labels]
+        if np.array_equal(labels, previous):
+            return labels
+
+
+def _allocate(counts: np.ndarray, n: int, rng: np.random.Generator) -> np.ndarray:
+    """
+    Split a sample size over strata in proportion to their sizes, giving every stratum
+    at least one row when the sample is large enough to cover them all.
+    Args:
+        counts (np.ndarray): The number of rows of each stratum.
+        n (int): The sample size, at most the total number of rows.
+        rng (np.random.Generator): Breaks ties between strata.
+    Returns:
+        np.ndarray: The number of rows to sample from each stratum.
+    """
+    # Strata by decreasing size, ties in random order
+    order = np.lexsort((rng.random(len(counts)), -counts))
+    quotas = np.zeros(len(counts), dtype=np.int64)
+    if n < len(counts):
+        quotas[order[:n]] = 1
+        return quotas
+
+    quotas[:] = 1
+    remaining = n - len(counts)
+    while remaining > 0:
+        # Largest remainder method over the rows not allocated yet
+        capacity = counts - quotas
+        shares = remaining * capacity / capacity.sum()
+        extra = np.minimum(np.floor(shares).astype(np.int64), capacity)
+        if extra.sum() == 0:
+            remainders = np.where(capacity > 0, shares, -1.0)
+            top = np.lexsort((rng.random(len(counts)), -remainders))[:remaining]
+            extra[top[capacity[top] > 0]] = 1
+        quotas += extra
+        remaining -= int(extra.sum())
+    return quotas
+
+
+def _medoid(members: np.ndarray, signatures: np.ndarray, rng) -> int:
+    """
+    Pick the member of a cluster that is the most similar to the others.
+    Args:
+        members (np.ndarray): The positions of the cluster members.
+        signatures (np.ndarray): The MinHash signatures.
+        rng (np.random.Generator): Subsamples large clusters.
+    Returns:
+        int: The position of the medoid.
+    """
+    if len(members) > SAMPLING_MEDOID_CANDIDATES:
+        members = rng.choice(members, size=SAMPLING_MEDOID_CANDIDATES, replace=False)
+    member_signatures = signatures[members]
+    similarity = (member_signatures[:, None, :] == member_signatures[None, :, :]).sum(
+        axis=(1, 2)
+    )
+    return int(members[np.argmax(similarity)])
+
+
+def representative_sample(
+    strata: np.ndarray,
+    signatures: np.ndarray,
+    n: int,
+    seed: int = 0,
+) -> np.ndarray:
+    """
+    Pick a sample of rows that covers the strata in proportion to their sizes and, within
+    each stratum, represents the largest groups of near-duplicate rows by one typical row
+    each instead of sampling the same group several times.
+    Args:
+        strata (np.ndarray): The stratum key of each row.
+        signatures (np.ndarray): The MinHash signatures of each row.
+        n (int): The sample size.
+        seed (int): Seed of the sample, for reproducibility.
+    Returns:
+        np.ndarray: The positions of the sampled rows, in random order.
+    """
+    rng = np.random.default_rng(seed)
+    n = min(n, len(strata))
+    if n <= 0:
+        return np.array([], dtype=np.intp)
+
+    _, stratum_of, counts = np.unique(strata, return_inverse=True, return_counts=True)
+    quotas = _allocate(counts, n, rng)
+    clusters = near_duplicate_clusters(signatures)
+
+    sampled = []
+    for stratum in np.flatnonzero(quotas):
+        members = np.flatnonzero(stratum_of == stratum)
+        quota = quotas[stratum]
+
+        # Clusters of the stratum by decreasing size, ties in random order
+        labels, cluster_of, sizes = np.unique(
+            clusters[members], return_inverse=True, return_counts=True
+        )
+        order = np.lexsort((rng.random(len(labels)), -sizes))
+
+        # One typical row for each of the largest clusters
+        picked = [
+            _medoid(members[cluster_of == cluster], signatures, rng)
+            for cluster in order[:quota]
+        ]
+
+        # More rows requested than there are clusters: fill up at random
+        if quota > len(picked):
+            rest = np.setdiff1d(members, picked)
+            picked.extend(rng.choice(rest, size=quota - len(picked), replace=False))
+        sampled.extend(picked)
+
+    # Shuffle, so that consecutive rows (e.g. a summarize batch) mix the strata
+    return rng.permutation(np.array(sampled, dtype=np.intp))
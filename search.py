@@ -0,0 +1,224 @@
+from app.const import (
+    SEARCH_FIELD_WEIGHTS,
+    SEARCH_BM25_K1,
+    SEARCH_BM25_B,
+    SEARCH_INDEX_FORMAT_VERSION,
+)
+from typing import Dict, List, Optional
+import numpy as np
+import pandas as pd
+import json
+import os
+import re
+
+_WORD_PATTERN = re.compile(r"[a-z0-9]+")
+_STOP_WORDS = frozenset(
+    "a an and are as at be but by can do for from have how i if in is it me my no not "
+    "of on or our please so that the their there this to was we what when where which "
+    "will with you your".split()
+)
+_SUFFIXES = ("ing", "ed", "es", "s")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Split a text into lowercase search terms, without stop words and with common
+    suffixes stripped (e.g. "delays" and "delayed" both become "delay").
+    Args:
+        text (str): The text.
+    Returns:
+        List[str]: The terms.
+    """
+    terms = []
+    for word in _WORD_PATTERN.findall(text.lower()):
+        if word in _STOP_WORDS:
+            continue
+        for suffix in _SUFFIXES:
+            if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+                word = word[: -len(suffix)]
+                break
+        terms.append(word)
+    return terms
+
+
+class SearchIndex:
+    """
+    BM25 inverted index over text columns of a DataFrame.
+    The postings of each term (the rows containing it and their precomputed BM25
+    weights) are stored contiguously, so a query only touches the rows of its terms.
+    The arrays are saved as .npy files and memory-mapped when loaded.
+    """
+
+    _ARRAYS = ("indptr", "doc_ids", "weights")
+
+    def __init__(
+        self,
+        vocabulary: Dict[str, int],
+        indptr: np.ndarray,
+        doc_ids: np.ndarray,
+        weights: np.ndarray,
+        n_docs: int,
+    ):
+        self.vocabulary = vocabulary
+        self.indptr = indptr  # Postings of term t are at indptr[t]:indptr[t + 1]
+        self.doc_ids = doc_ids
+        self.weights = weights
+        self.n_docs = n_docs
+
+    @classmethod
+    def build(
+        cls,
+        df: pd.DataFrame,
+        field_weights: Dict[str, float] = SEARCH_FIELD_WEIGHTS,
+        k1: float = SEARCH_BM25_K1,
+        b: float = SEARCH_BM25_B,
+    ) -> "SearchIndex":
+        """
+        Index the text columns of a DataFrame.
+        Args:
+            df (pd.DataFrame): The rows to index.
+            field_weights (Dict[str, float]): The columns to index and how much a term
+                occurrence in each of them counts.
+            k1 (float): BM25 term frequency saturation.
+            b (float): BM25 document length normalization.
+        Returns:
+            SearchIndex: The index.
+        """
+        n_docs = len(df)
+        vocabulary: Dict[str, int] = {}
+        term_ids, doc_ids, occurrence_weights = [], [], []
+        for column, weight in field_weights.items():
+            for doc, text in enumerate(df[column].tolist()):
+                terms = [
+                    vocabulary.setdefault(term, len(vocabulary))
+                    for term in tokenize(str(text))
+                ]
+                term_ids.extend(terms)
+                doc_ids.extend([doc] * len(terms))
+                occurrence_weights.extend([weight] * len(terms))
+        term_ids = np.array(term_ids, dtype=np.int64)
+        doc_ids = np.array(doc_ids, dtype=np.int64)
+        occurrence_weights = np.array(occurrence_weights, dtype=np.float64)
+
+        # Weighted term frequencies of each (term, row) pair, sorted by term then row
+        stride = max(n_docs, 1)
+        pairs, inverse = np.unique(term_ids * stride + doc_ids, return_inverse=True)
+        tf = np.bincount(inverse.ravel(), weights=occurrence_weights)
+        pair_terms = pairs // stride
+        pair_docs = pairs % stride
+
+        # BM25 weight of each posting
+        doc_lengths = np.bincount(doc_ids, weights=occurrence_weights, minlength=n_docs)
+        average_length = max(doc_lengths.mean(), 1e-9) if n_docs else 1.0
+        df_counts = np.bincount(pair_terms, minlength=len(vocabulary))
+        idf = np.log(1 + (n_docs - df_counts + 0.5) / (df_counts + 0.5))
+        weights = (
+            idf[pair_terms]
+            * tf
+            * (k1 + 1)
+            / (tf + k1 * (1 - b + b * doc_lengths[pair_docs] / average_length))
+        )
+
+        indptr = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        np.cumsum(df_counts, out=indptr[1:])
+        return cls(
+            vocabulary,
+            indptr,
+            pair_docs.astype(np.int32),
+            weights.astype(np.float32),
+            n_docs,
+        )
+
+    def save(self, directory: str, fingerprint: str):
+        """
+        Save the index to a directory.
+        Args:
+            directory (str): The directory.
+            fingerprint (str): Identifies the indexed data, checked when loading.
+        """
+        os.makedirs(directory, exist_ok=True)
+        # Write to temporary files first; the manifest is written last, so a partial
+        # index is never loaded
+        for name in self._ARRAYS:
+            path = os.path.join(directory, f"{name}.npy")
+            with open(f"{path}.tmp", "wb") as f:
+                np.save(f, getattr(self, name))
+            os.replace(f"{path}.tmp", path)
+        path = os.path.join(directory, "vocabulary.json")
+        with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(self.vocabulary, f)
+        os.replace(f"{path}.tmp", path)
+
+        path = os.path.join(directory, "manifest.json")
+        with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(self._manifest(fingerprint), f)
+        os.replace(f"{path}.tmp", path)
+
+    def _manifest(self, fingerprint: str) -> dict:
+        return {
+            "fingerprint": fingerprint,
+            "n_docs": self.n_docs,
+            "format_version": SEARCH_INDEX_FORMAT_VERSION,
+            "field_weights": SEARCH_FIELD_WEIGHTS,
+            "k1": SEARCH_BM25_K1,
+            "b": SEARCH_BM25_B,
+        }
+
+    @classmethod
+    def load(cls, directory: str, fingerprint: str) -> Optional["SearchIndex"]:
+        """
+        Load a saved index, memory-mapping its arrays.
+        Args:
+            directory (str): The directory.
+            fingerprint (str): Identifies the data the index must have been built from.
+        Returns:
+            Optional[SearchIndex]: The index, or None if there is no index for this data.
+        """
+        manifest_path = os.path.join(directory, "manifest.json")
+        if not os.path.exists(manifest_path):
+            return None
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("fingerprint") != fingerprint:
+            return None
+
+        with open(
+            os.path.join(directory, "vocabulary.json"), "r", encoding="utf-8"
+        ) as f:
+            vocabulary = json.load(f)
+        arrays = {
+            name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+            for name in cls._ARRAYS
+        }
+        index = cls(vocabulary, n_docs=manifest["n_docs"], **arrays)
+        if manifest != index._manifest(fingerprint):
+            return None
+        return index
+
+    def search(
+        self, query: str, top_k: int, positions: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        """
+        Find the rows that best match a query.
+        Args:
+            query (str): The free-text query.
+            top_k (int): Maximum number of rows to return.
+            positions (Optional[np.ndarray]): Only consider these rows. Defaults to all.
+        Returns:
+            np.ndarray: The positions of the matching rows, best match first.
+        """
+        scores = np.zeros(self.n_docs, dtype=np.float32)
+        for term in set(tokenize(query)):
+            term_id = self.vocabulary.get(term)
+            if term_id is None:
+                continue
+            start, end = self.indptr[term_id], self.indptr[term_id + 1]
+            # Each row appears at most once in the postings of a term
+            scores[self.doc_ids[start:end]] += self.weights[start:end]
+
+        candidates = np.arange(self.n_docs) if positions is None else positions
+        candidates = candidates[scores[candidates] > 0]
+        if len(candidates) > top_k:
+            top = np.argpartition(-scores[candidates], top_k - 1)[:top_k]
+            candidates = candidates[top]
+        return candidates[np.argsort(-scores[candidates], kind="stable")]
@@ -1,17 +1,32 @@
 from pydantic import BaseModel, Field
-from typing import List, Literal, Callable
+from typing import List, Literal, Optional
 from typing import Union
 from data import Dataset
 from app.const import (
-    SUMMARIZE_DEFAULT_BATCH_SIZE,
-    SUMMARIZE_DEFAULT_N_BATCHES,
     SUMMARIZE_BATCH_PROMPT_FILE_PATH,
     SUMMARIZE_ALL_BATCHES_PROMPT_FILE_PATH,
+    SUMMARIZE_MAX_CONCURRENCY,
+    SUMMARIZE_BATCH_TIMEOUT,
+    SUMMARIZE_SAMPLING_SEED,
+    SUMMARIZE_MAX_ROWS,
+    SUMMARIZE_BATCH_TOKEN_BUDGET,
+    SUMMARIZE_REDUCE_FAN_IN,
+    SUMMARIZE_NOVELTY_THRESHOLD,
+    SHOW_EXAMPLES_COLUMNS,
+    SHOW_EXAMPLES_MAX_FIELD_CHARS,
+    SHOW_EXAMPLES_MAX_CHARS,
 )
 from prompt import read_prompt_file
+from packing import PromptTable
+from memo import ToolResultCache
 from llm import LLM
+from tracing import in_current_context, tracer
+import logs
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import builtins
 import json
-import math
+import re
+import time
 
 
 class SummaryResponse(BaseModel):
@@ -25,42 +40,26 @@ class SummaryResponse(BaseModel):
     )
 
 
-def summarize(
+def _summarize_batch(
     user_request: str,
-    ds: Dataset,
-    n_batches: int = SUMMARIZE_DEFAULT_N_BATCHES,
-    batch_size: int = SUMMARIZE_DEFAULT_BATCH_SIZE,
-    log_function: Callable[[str], None] = print,
-) -> str:
+    data: str,
+    n_rows: int,
+    summarize_batch_prompt: str,
+    timeout: float,
+):
     """
-    Summarize a user request using the dataset.
+    Summarize a single batch of rows in its own conversation.
     Args:
         user_request (str): The user request to summarize.
-        ds (Dataset): The dataset to use for summarization.
-        n_batches (int): Number of batches to process.
-        batch_size (int): Size of each batch.
-        log_function (Callable[[str], None]): Function to log messages.
+        data (str): The rows of the batch, encoded as a table.
+        n_rows (int): The number of rows of the batch.
+        summarize_batch_prompt (str): The batch prompt template.
+        timeout (float): Timeout in seconds for the LLM request.
     Returns:
-        str: A summary of the user request.
+        tuple: The batch messages, the LLM response and the request latency in seconds.
     """
 
-    # Sample rows from the dataset to use for summarization
-    n_rows_to_sample = min(ds.count_rows(), n_batches * batch_size)
-    sampled_df = ds.show_examples(n_rows_to_sample)
-
-    # Read the prompt files for summarization
-    summarize_batch_prompt = read_prompt_file(SUMMARIZE_BATCH_PROMPT_FILE_PATH)
-    summarize_all_batches_prompt = read_prompt_file(
-        SUMMARIZE_ALL_BATCHES_PROMPT_FILE_PATH
-    )
-
-    # Initialize a list to hold batch summaries
-    batch_summaries = []
-
-    # Iterate over the sampled DataFrame in batches
-    for i in range(0, n_rows_to_sample, batch_size):
-        batch_df = sampled_df.iloc[i : i + batch_size]
-
+    with tracer.span("summarize.batch", rows=n_rows) as span:
         # Each batch prompt is in independent conversation in order to avoid biasing the LLM
         messages = [
             {
@@ -71,59 +70,404 @@ def summarize(
                 "role": "user",
                 "content": summarize_batch_prompt.format(
                     user_request=user_request,
-                    data=batch_df.to_dict(orient="records"),
+                    data=data,
                 ),
             },
         ]
+        span.set_attributes(prompt_chars=len(messages[1]["content"]))
 
-        log_function(
-            f"Processing batch {i // batch_size + 1} of {math.ceil(n_rows_to_sample / batch_size)} with {len(batch_df)} rows."
+        start_time = time.perf_counter()
+        response = LLM.perform_structured_outputs_request(
+            messages,
+            response_format=SummaryResponse,
+            timeout=timeout,
+            role="summarize_map",
         )
-        log_function(f"Batch messages: {json.dumps(messages, indent=2)}")
+        latency = time.perf_counter() - start_time
+
+    return messages, response, latency
+
+
+def _reduce_summaries(
+    user_request: str,
+    summaries: List[str],
+    n_rows: int,
+    summarize_all_batches_prompt: str,
+    level: int,
+):
+    """
+    Combine several summaries into one.
+    Args:
+        user_request (str): The user request to summarize.
+        summaries (List[str]): The summaries to combine.
+        n_rows (int): The number of rows the summaries cover together.
+        summarize_all_batches_prompt (str): The reduce prompt template.
+        level (int): The level of the reduce in the summarization tree (1 for batch
+            summaries).
+    Returns:
+        tuple: The reduce messages and the LLM response.
+    """
+
+    with tracer.span("summarize.reduce", level=level, summaries=len(summaries)):
+        messages = [
+            {
+                "role": "system",
+                "content": "You are a helpful assistant that summarizes customer support data based on multiple batch summaries, using a structured JSON format.",
+            },
+            {
+                "role": "user",
+                "content": summarize_all_batches_prompt.format(
+                    user_request=user_request,
+                    summaries=summaries,
+                    num_summaries=str(len(summaries)),
+                    # Summaries cover unequal numbers of rows, so this is an average
+                    rows_per_summary=str(round(n_rows / len(summaries))),
+                    n_rows=str(int(n_rows)),
+                ),
+            },
+        ]
 
-        # Perform the initial request to the LLM
         response = LLM.perform_structured_outputs_request(
             messages,
             response_format=SummaryResponse,
+            role="summarize_reduce",
         )
 
-        log_function(f"Batch response: {json.dumps(response.model_dump(), indent=2)}")
+    return messages, response
 
-        # Extract the assistant's message from the response
-        batch_summaries.append(response.choices[0].message.parsed.summary)
 
-    # Combine all batch summaries into a final summary
-    final_messages = [
-        {
-            "role": "system",
-            "content": "You are a helpful assistant that summarizes customer support data based on multiple batch summaries, using a structured JSON format.",
-        },
-        {
-            "role": "user",
-            "content": summarize_all_batches_prompt.format(
-                user_request=user_request,
-                summaries=batch_summaries,
-                num_batches=str(int(math.ceil(n_rows_to_sample / batch_size))),
-                rows_per_batch=str(int(batch_size)),
-                n_rows=str(int(n_rows_to_sample)),
-            ),
-        },
-    ]
+def _parsed_summary(response) -> str:
+    """
+    Get the summary of a structured summarize response.
+    Args:
+        response: The LLM response.
+    Returns:
+        str: The summary.
+    Raises:
+        ValueError: If the model refused or its output could not be parsed.
+    """
+    message = response.choices[0].message
+    if message.parsed is None:
+        if getattr(message, "refusal", None):
+            raise ValueError(f"The model refused: {message.refusal}")
+        raise ValueError("The model did not return a summary.")
+    return message.parsed.summary
 
-    log_function(f"Final messages: {json.dumps(final_messages, indent=2)}")
 
-    # Perform the final request to the LLM
-    final_response = LLM.perform_structured_outputs_request(
-        final_messages,
-        response_format=SummaryResponse,
-    )
+def _novelty(summary: str, previous: List[str]) -> float:
+    """
+    Share of the words of a summary that do not appear in previous summaries.
+    Args:
+        summary (str): The new summary.
+        previous (List[str]): The previous summaries.
+    Returns:
+        float: The novelty, from 0 (nothing new) to 1 (all new).
+    """
+    words = set(re.findall(r"\w{4,}", summary.lower()))
+    if not words:
+        return 0.0
+    seen = set(re.findall(r"\w{4,}", " ".join(previous).lower()))
+    return len(words - seen) / len(words)
+
+
+def summarize(
+    user_request: str,
+    ds: Dataset,
+    n_batches: Optional[int] = None,
+    batch_size: Optional[int] = None,
+    log_function: logs.LogFunction = logs.console,
+    max_concurrency: int = SUMMARIZE_MAX_CONCURRENCY,
+    batch_timeout: float = SUMMARIZE_BATCH_TIMEOUT,
+    seed: int = SUMMARIZE_SAMPLING_SEED,
+    max_rows: int = SUMMARIZE_MAX_ROWS,
+    batch_token_budget: int = SUMMARIZE_BATCH_TOKEN_BUDGET,
+    fan_in: int = SUMMARIZE_REDUCE_FAN_IN,
+    novelty_threshold: float = SUMMARIZE_NOVELTY_THRESHOLD,
+) -> str:
+    """
+    Summarize a user request using the dataset, as a tree: batches of rows are
+    summarized, every fan_in batch summaries are combined into one, and so on level by
+    level until a single summary remains.
+    Batches are processed in waves of fan_in batches. The batches of a wave are
+    summarized concurrently; batches that fail or time out are skipped. Once the batch
+    summaries of a wave add almost nothing new to the previous ones, the remaining
+    batches are skipped.
+    Args:
+        user_request (str): The user request to summarize.
+        ds (Dataset): The dataset to use for summarization.
+        n_batches (Optional[int]): Number of batches to process. Defaults to as many
+            as needed to cover max_rows rows.
+        batch_size (Optional[int]): Size of each batch. Defaults to packing as many
+            rows as fit in batch_token_budget tokens.
+        log_function (logs.LogFunction): Function to log messages and records.
+        max_concurrency (int): Maximum number of batches summarized at the same time.
+        batch_timeout (float): Timeout in seconds for each batch request.
+        seed (int): Seed of the sampled rows, so the same request gives the same summary.
+        max_rows (int): Maximum number of rows to summarize.
+        batch_token_budget (int): Maximum number of tokens of rows per batch.
+        fan_in (int): Number of summaries combined into one at each level.
+        novelty_threshold (float): Average share of new words in the batch summaries
+            of a wave below which the remaining batches are skipped.
+    Returns:
+        str: A summary of the user request.
+    """
+
+    with tracer.span("summarize") as summarize_span:
+        # An empty view (e.g. a search without matches) has nothing to summarize
+        if ds.count_rows() == 0:
+            log_function(logs.warning("No rows to summarize."))
+            summarize_span.set_attributes(batches=0)
+            return "There are no rows to summarize in the current dataset."
+
+        # Sample representative rows from the dataset to use for summarization,
+        # covering all intents and skipping near-duplicate instructions
+        n_rows_to_sample = min(ds.count_rows(), max_rows)
+        if n_batches is not None and batch_size is not None:
+            n_rows_to_sample = min(n_rows_to_sample, n_batches * batch_size)
+        sampled_df = ds.sample_representative(n_rows_to_sample, seed=seed)
+
+        # Encode the rows compactly and pack them into batches that fit the token
+        # budget; a fixed batch_size makes batches of that many rows instead
+        table = PromptTable(sampled_df, max_row_tokens=batch_token_budget)
+        if batch_size is None:
+            batches = table.pack(batch_token_budget)
+        else:
+            batches = [
+                list(range(i, min(i + batch_size, len(sampled_df))))
+                for i in range(0, len(sampled_df), batch_size)
+            ]
+        if n_batches is not None:
+            batches = batches[:n_batches]
+
+        # Read the prompt files for summarization
+        summarize_batch_prompt = read_prompt_file(SUMMARIZE_BATCH_PROMPT_FILE_PATH)
+        summarize_all_batches_prompt = read_prompt_file(
+            SUMMARIZE_ALL_BATCHES_PROMPT_FILE_PATH
+        )
+
+        n_batch_rows = builtins.sum(len(batch) for batch in batches)
+        log_function(
+            logs.info(
+                f"Summarizing up to {n_batch_rows} rows in {len(batches)} batches."
+            )
+        )
 
-    log_function(f"Final response: {json.dumps(final_response.model_dump(), indent=2)}")
+        # Level 1 summaries, one per wave: (summary, number of rows covered)
+        nodes = []
+        seen_summaries = []
+        processed_batches = failed_batches = failed_reduces = 0
+
+        # Summarize the batches concurrently. Logging stays on the calling thread,
+        # since the log function may not be thread-safe (e.g. Streamlit session state).
+        with ThreadPoolExecutor(
+            max_workers=max(1, min(max_concurrency, len(batches)))
+        ) as executor:
+            for wave_start in range(0, len(batches), fan_in):
+                wave = batches[wave_start : wave_start + fan_in]
+                futures = {}
+                for batch_index, batch in enumerate(wave, start=wave_start):
+                    log_function(
+                        logs.info(
+                            f"Processing batch {batch_index + 1} of {len(batches)} with {len(batch)} rows."
+                        )
+                    )
+                    future = executor.submit(
+                        in_current_context(_summarize_batch),
+                        user_request,
+                        table.render(batch),
+                        len(batch),
+                        summarize_batch_prompt,
+                        batch_timeout,
+                    )
+                    futures[future] = batch_index
+
+                # Batch summaries of the wave, in batch order
+                batch_summaries = {}
+                for future in as_completed(futures):
+                    batch_index = futures[future]
+                    try:
+                        messages, response, latency = future.result()
+                    except Exception as e:
+                        log_function(
+                            logs.warning(f"Batch {batch_index + 1} failed: {str(e)}")
+                        )
+                        continue
+
+                    log_function(logs.debug("Batch messages", messages))
+                    log_function(
+                        logs.debug(
+                            f"Batch {batch_index + 1} response ({latency:.2f}s)",
+                            response.model_dump,
+                        )
+                    )
+
+                    # Extract the assistant's message from the response
+                    try:
+                        batch_summaries[batch_index] = _parsed_summary(response)
+                    except ValueError as e:
+                        log_function(
+                            logs.warning(f"Batch {batch_index + 1} failed: {str(e)}")
+                        )
+
+                processed_batches += len(wave)
+                failed_batches += len(wave) - len(batch_summaries)
+                if not batch_summaries:
+                    continue
+
+                # Measure how much each batch summary adds to the ones before it
+                novelties = []
+                for i in sorted(batch_summaries):
+                    if seen_summaries:
+                        novelties.append(_novelty(batch_summaries[i], seen_summaries))
+                    seen_summaries.append(batch_summaries[i])
+
+                # Combine the batch summaries of the wave
+                n_wave_rows = builtins.sum(len(batches[i]) for i in batch_summaries)
+                try:
+                    messages, response = _reduce_summaries(
+                        user_request,
+                        [batch_summaries[i] for i in sorted(batch_summaries)],
+                        n_wave_rows,
+                        summarize_all_batches_prompt,
+                        level=1,
+                    )
+                    log_function(logs.debug("Level 1 reduce messages", messages))
+                    log_function(
+                        logs.debug("Level 1 reduce response", response.model_dump)
+                    )
+                    nodes.append((_parsed_summary(response), n_wave_rows))
+                except Exception as e:
+                    # Keep the batch summaries, for the next level to combine
+                    log_function(logs.warning(f"Level 1 reduce failed: {str(e)}"))
+                    failed_reduces += 1
+                    nodes.extend(
+                        (batch_summaries[i], len(batches[i]))
+                        for i in sorted(batch_summaries)
+                    )
+
+                # Stop early once new batches stop changing the summaries
+                if not novelties or processed_batches == len(batches):
+                    continue
+                novelty = builtins.sum(novelties) / len(novelties)
+                if novelty < novelty_threshold:
+                    log_function(
+                        logs.info(
+                            f"Stopping after {processed_batches} of {len(batches)} batches: "
+                            f"the last ones added {novelty:.0%} new content."
+                        )
+                    )
+                    break
+
+            if not nodes:
+                raise RuntimeError("No batch summaries were produced.")
+            if failed_batches:
+                log_function(
+                    logs.warning(
+                        f"Continuing with {processed_batches - failed_batches} of {processed_batches} batch summaries."
+                    )
+                )
+
+            # Combine the summaries level by level, the groups of a level concurrently
+            level = 1
+            while len(nodes) > 1:
+                level += 1
+                groups = [nodes[i : i + fan_in] for i in range(0, len(nodes), fan_in)]
+                futures = []
+                for group in groups:
+                    n_group_rows = builtins.sum(n for _, n in group)
+                    future = executor.submit(
+                        in_current_context(_reduce_summaries),
+                        user_request,
+                        [summary for summary, _ in group],
+                        n_group_rows,
+                        summarize_all_batches_prompt,
+                        level,
+                    )
+                    futures.append((future, n_group_rows))
+
+                nodes = []
+                for future, n_group_rows in futures:
+                    try:
+                        messages, response = future.result()
+                        log_function(
+                            logs.debug(f"Level {level} reduce messages", messages)
+                        )
+                        log_function(
+                            logs.debug(
+                                f"Level {level} reduce response", response.model_dump
+                            )
+                        )
+                        nodes.append((_parsed_summary(response), n_group_rows))
+                    except Exception as e:
+                        log_function(
+                            logs.warning(
+                                f"Level {level} reduce failed, skipping "
+                                f"{n_group_rows} rows: {str(e)}"
+                            )
+                        )
+                        failed_reduces += 1
+                if not nodes:
+                    raise RuntimeError(f"All level {level} reduces failed.")
+
+        summarize_span.set_attributes(
+            batches=processed_batches,
+            planned_batches=len(batches),
+            failed_batches=failed_batches,
+            failed_reduces=failed_reduces,
+            levels=level,
+        )
 
-    # Extract the final summary from the response
-    final_answer = final_response.choices[0].message.parsed.summary
+        return nodes[0][0]
 
-    return final_answer
+
+def show_examples(
+    ds: Dataset,
+    n: int,
+    columns: List[str] = SHOW_EXAMPLES_COLUMNS,
+    offset: int = 0,
+    max_field_chars: int = SHOW_EXAMPLES_MAX_FIELD_CHARS,
+    max_chars: int = SHOW_EXAMPLES_MAX_CHARS,
+) -> dict:
+    """
+    Show a page of examples, bounded in size: long text fields are truncated and the
+    page stops before its serialized examples exceed max_chars (keeping at least one).
+    Args:
+        ds (Dataset): The dataset to show examples from.
+        n (int): The number of examples to show.
+        columns (List[str]): The columns to show.
+        offset (int): The number of examples to skip.
+        max_field_chars (int): The length text fields are truncated to.
+        max_chars (int): The maximum length of the serialized examples.
+    Returns:
+        dict: The examples, the offset of the next page (None after the last one or
+            if no examples were returned), the number of rows and whether the
+            examples were truncated.
+    """
+    offset = max(offset, 0)
+    examples, size, truncated = [], 0, False
+    for record in ds.show_examples(n, columns, offset).to_dict(orient="records"):
+        for column, value in record.items():
+            if isinstance(value, str) and len(value) > max_field_chars:
+                record[column] = value[:max_field_chars] + "…"
+                truncated = True
+        size += len(json.dumps(record))
+        if examples and size > max_chars:
+            truncated = True
+            break
+        examples.append(record)
+
+    number_of_rows = ds.count_rows()
+    next_offset = offset + len(examples)
+    response = {
+        "examples": examples,
+        "next_offset": (
+            next_offset if examples and next_offset < number_of_rows else None
+        ),
+        "number_of_rows": number_of_rows,
+    }
+    if truncated:
+        response["truncated"] = True
+    return response
 
 
 def sort_dict_by_values(d: dict, ascending: bool = False) -> dict:
@@ -187,6 +531,18 @@ class SelectSemanticCategoryInput(BaseModel):
     )
 
 
+class SearchRowsInput(BaseModel):
+    reasoning: str = Field(..., description="Reasoning for the function call.")
+    function_type: Literal["search_rows"]
+    query: str = Field(
+        ...,
+        description="Free-text description of the rows to find, e.g. 'complaints about shipping delays'.",
+    )
+    top_k: Optional[int] = Field(
+        None, ge=1, description="Maximum number of rows to keep. Omit for the default."
+    )
+
+
 class SumInput(BaseModel):
     reasoning: str = Field(..., description="Reasoning for the function call.")
     function_type: Literal["sum"]
@@ -209,7 +565,20 @@ class CountIntentInput(BaseModel):
 class ShowExamplesInput(BaseModel):
     reasoning: str = Field(..., description="Reasoning for the function call.")
     function_type: Literal["show_examples"]
-    n: int = Field(..., description="Number of examples to show from the DataFrame.")
+    n: int = Field(
+        ..., ge=1, description="Number of examples to show from the DataFrame."
+    )
+    columns: Optional[
+        List[Literal["instruction", "response", "category", "intent", "flags"]]
+    ] = Field(
+        None,
+        description="Columns to show. Omit for instruction, category, intent and response.",
+    )
+    offset: Optional[int] = Field(
+        None,
+        ge=0,
+        description="Number of examples to skip, e.g. the next_offset of a previous call to see more. Omit to start from the first.",
+    )
 
 
 class SummarizeInput(BaseModel):
@@ -229,6 +598,23 @@ class CountRowsInput(BaseModel):
     function_type: Literal["count_rows"]
 
 
+class GetDistributionInput(BaseModel):
+    reasoning: str = Field(..., description="Reasoning for the function call.")
+    function_type: Literal["get_distribution"]
+    column: Literal["category", "intent", "flags"] = Field(
+        ..., description="Column to compute the distribution of."
+    )
+    top_k: Optional[int] = Field(
+        None,
+        ge=1,
+        description="Only return the top_k most frequent values. Omit to return all values.",
+    )
+    by: Optional[Literal["category", "intent", "flags"]] = Field(
+        None,
+        description="Optional second column to break the distribution down by (e.g. intents per category).",
+    )
+
+
 class SortDictByValuesInput(BaseModel):
     reasoning: str = Field(..., description="Reasoning for the function call.")
     function_type: Literal["sort_dict_by_values"]
@@ -246,10 +632,12 @@ FunctionType = Union[
     GetPossibleCategoriesInput,
     SelectSemanticIntentInput,
     SelectSemanticCategoryInput,
+    SearchRowsInput,
     SumInput,
     SortDictByValuesInput,
     CountCategoryInput,
     CountIntentInput,
+    GetDistributionInput,
     ShowExamplesInput,
     SummarizeInput,
     FinishInput,
@@ -257,11 +645,99 @@ FunctionType = Union[
 ]
 
 
+# Tools that only read the dataset, so several of them can run concurrently.
+# Any other tool (filters, summarize, finish) acts as an ordering barrier.
+READ_ONLY_TOOLS = {
+    "get_possible_intents",
+    "get_possible_categories",
+    "count_rows",
+    "count_category",
+    "count_intent",
+    "get_distribution",
+    "show_examples",
+    "sum",
+    "sort_dict_by_values",
+}
+
+
+# Tools that return a filtered view of the dataset.
+FILTER_TOOLS = {
+    "select_semantic_intent",
+    "select_semantic_category",
+    "search_rows",
+}
+
+
+# Tools whose result only depends on their arguments and the dataset view, so it can
+# be cached. Filters are included: they return the same view for the same input view.
+MEMOIZED_TOOLS = READ_ONLY_TOOLS | FILTER_TOOLS
+
+tool_cache = ToolResultCache()
+
+
 class FunctionInput(BaseModel):
     function_call: FunctionType = Field(discriminator="function_type")
 
 
+def _cache_key(function_type: str, arguments: dict, ds: Dataset) -> tuple:
+    return (function_type, json.dumps(arguments, sort_keys=True), ds.fingerprint())
+
+
 def execute_function(function_call: FunctionType, ds: Dataset):
+    """
+    Execute the function call on the dataset, or serve it from the tool result cache.
+    Args:
+        function_call (FunctionType): The function call to execute.
+        ds (Dataset): The dataset to operate on.
+    Returns:
+        dict: A dictionary containing the dataset and the response from the function call.
+    """
+    function_type = function_call.function_type
+    if function_type not in MEMOIZED_TOOLS or not tool_cache.enabled:
+        return _execute_function(function_call, ds)
+
+    # The reasoning does not change the result
+    key = _cache_key(function_type, function_call.model_dump(exclude={"reasoning"}), ds)
+    cached = tool_cache.get(key)
+    span = tracer.current_span
+    if span is not None:
+        span.set_attributes(tool_cache_hit=cached is not None)
+    if cached is not None:
+        return {"dataset": cached["dataset"] or ds, "response": cached["response"]}
+
+    output = _execute_function(function_call, ds)
+    changed = output["dataset"] is not ds
+    tool_cache.set(
+        key,
+        {
+            "dataset": output["dataset"] if changed else None,
+            "response": output["response"],
+        },
+    )
+
+    # A filter's response already holds the values and row count of the new view
+    if changed:
+        response = output["response"]
+        primed = {"count_rows": {"number_of_rows": response["number_of_rows"]}}
+        if "selected_intents" in response:
+            primed["get_possible_intents"] = {
+                "possible_intents": response["selected_intents"]
+            }
+        if "selected_categories" in response:
+            primed["get_possible_categories"] = {
+                "possible_categories": response["selected_categories"]
+            }
+        for primed_type, primed_response in primed.items():
+            tool_cache.set(
+                _cache_key(
+                    primed_type, {"function_type": primed_type}, output["dataset"]
+                ),
+                {"dataset": None, "response": primed_response},
+            )
+    return output
+
+
+def _execute_function(function_call: FunctionType, ds: Dataset):
     """
     Execute the function call on the dataset.
     Args:
@@ -295,6 +771,17 @@ def execute_function(function_call: FunctionType, ds: Dataset):
             "number_of_rows": ds.count_rows(),
         }
         return output
+    elif isinstance(function_call, SearchRowsInput):
+        if function_call.top_k is None:
+            ds = ds.search(function_call.query)
+        else:
+            ds = ds.search(function_call.query, top_k=function_call.top_k)
+        output["dataset"] = ds
+        output["response"] = {
+            "number_of_rows": ds.count_rows(),
+            "top_intents": ds.get_distribution("intent", top_k=5),
+        }
+        return output
     elif isinstance(function_call, CountRowsInput):
         output["response"] = {"number_of_rows": ds.count_rows()}
         return output
@@ -316,9 +803,19 @@ def execute_function(function_call: FunctionType, ds: Dataset):
         count = ds.count_intent(function_call.intent)
         output["response"] = {"count": count}
         return output
+    elif isinstance(function_call, GetDistributionInput):
+        distribution = ds.get_distribution(
+            function_call.column, top_k=function_call.top_k, by=function_call.by
+        )
+        output["response"] = {"distribution": distribution}
+        return output
     elif isinstance(function_call, ShowExamplesInput):
-        examples = ds.show_examples(function_call.n)
-        output["response"] = {"examples": examples.to_dict(orient="records")}
+        output["response"] = show_examples(
+            ds,
+            function_call.n,
+            function_call.columns or SHOW_EXAMPLES_COLUMNS,
+            function_call.offset or 0,
+        )
         return output
     elif isinstance(function_call, SummarizeInput):
         summary = summarize(function_call.user_request, ds)
@@ -365,6 +862,17 @@ tools = [
             "parameters": CountCategoryInput.model_json_schema(),
         },
     },
+    {
+        "type": "function",
+        "function": {
+            "name": "get_distribution",
+            "description": (
+                "Get the counts of every value of a column (category, intent or flags), "
+                "sorted by frequency, optionally limited to the top_k values or broken down by a second column"
+            ),
+            "parameters": GetDistributionInput.model_json_schema(),
+        },
+    },
     {
         "type": "function",
         "function": {
@@ -377,7 +885,10 @@ tools = [
         "type": "function",
         "function": {
             "name": "show_examples",
-            "description": "Show a number of examples from the dataset",
+            "description": (
+                "Show a number of examples from the dataset. The same call returns the "
+                "same examples; pass the returned next_offset as offset to see more."
+            ),
             "parameters": ShowExamplesInput.model_json_schema(),
         },
     },
@@ -408,6 +919,17 @@ tools = [
             "parameters": SelectSemanticCategoryInput.model_json_schema(),
         },
     },
+    {
+        "type": "function",
+        "function": {
+            "name": "search_rows",
+            "description": (
+                "Filter rows from the dataset to the ones whose instruction or response best match a free-text query. "
+                "Use it for topics that are not an intent or category name"
+            ),
+            "parameters": SearchRowsInput.model_json_schema(),
+        },
+    },
     {
         "type": "function",
         "function": {
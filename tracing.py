@@ -0,0 +1,244 @@
+from app.const import TRACE_BUFFER_SIZE, TRACE_JSONL_FILE_PATH, TRACE_SERVICE_NAME
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Iterator, List, Optional
+import contextvars
+import functools
+import json
+import os
+import secrets
+import threading
+import time
+
+
+class Span:
+    """
+    A timed operation of the agent (an LLM call, a tool execution, a summarize batch...),
+    with attributes such as token usage and payload sizes.
+    Spans nest: a span started while another one is active becomes its child.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        trace_id: str,
+        parent_id: Optional[str] = None,
+        attributes: Optional[dict] = None,
+    ):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.attributes = dict(attributes or {})
+        self.start_time_ns = time.time_ns()
+        self.end_time_ns: Optional[int] = None
+        self.status = "ok"
+
+    @property
+    def duration(self) -> float:
+        """
+        The duration of the span in seconds, up to now if it has not ended.
+        """
+        end_time_ns = self.end_time_ns or time.time_ns()
+        return (end_time_ns - self.start_time_ns) / 1e9
+
+    def set_attributes(self, **attributes):
+        """
+        Set attributes of the span. Attributes set to None are ignored.
+        """
+        self.attributes.update(
+            {key: value for key, value in attributes.items() if value is not None}
+        )
+
+    def to_dict(self) -> dict:
+        """
+        Convert the span to a flat dictionary, e.g. for JSONL export.
+        Returns:
+            dict: The span.
+        """
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_time_ns": self.start_time_ns,
+            "end_time_ns": self.end_time_ns,
+            "duration_ms": self.duration * 1000,
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+    def to_otlp(self) -> dict:
+        """
+        Convert the span to the OpenTelemetry OTLP/JSON span format.
+        Returns:
+            dict: The span.
+        """
+
+        def otlp_value(value):
+            if isinstance(value, bool):
+                return {"boolValue": value}
+            if isinstance(value, int):
+                return {"intValue": str(value)}
+            if isinstance(value, float):
+                return {"doubleValue": value}
+            return {"stringValue": str(value)}
+
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id or "",
+            "name": self.name,
+            "kind": 1,  # SPAN_KIND_INTERNAL
+            "startTimeUnixNano": str(self.start_time_ns),
+            "endTimeUnixNano": str(self.end_time_ns or time.time_ns()),
+            "attributes": [
+                {"key": key, "value": otlp_value(value)}
+                for key, value in self.attributes.items()
+            ],
+            "status": {"code": 1 if self.status == "ok" else 2},
+        }
+
+
+class Tracer:
+    """
+    Records finished spans in a bounded in-memory ring buffer and hands them to the
+    registered exporters. The active span is tracked per context, so concurrent
+    sessions and threads get separate traces.
+    """
+
+    def __init__(self, max_spans: int = TRACE_BUFFER_SIZE):
+        self.spans = deque(maxlen=max_spans)
+        self.exporters: List[Callable[[Span], None]] = []
+        self._lock = threading.Lock()
+        self._current = contextvars.ContextVar("current_span", default=None)
+
+    @property
+    def current_span(self) -> Optional[Span]:
+        """
+        The active span in the current context, if any.
+        """
+        return self._current.get()
+
+    @contextmanager
+    def span(self, name: str, **attributes) -> Iterator[Span]:
+        """
+        Time an operation as a span, nested under the active span.
+        Args:
+            name (str): The name of the operation.
+            **attributes: Attributes of the span.
+        Yields:
+            Span: The span, to add attributes to while the operation runs.
+        """
+        parent = self._current.get()
+        span = Span(
+            name,
+            trace_id=parent.trace_id if parent else secrets.token_hex(16),
+            parent_id=parent.span_id if parent else None,
+            attributes=attributes,
+        )
+        token = self._current.set(span)
+        try:
+            yield span
+        except Exception as e:
+            span.status = "error"
+            span.set_attributes(error=f"{type(e).__name__}: {e}")
+            raise
+        finally:
+            span.end_time_ns = time.time_ns()
+            try:
+                self._current.reset(token)
+            except ValueError:
+                # A span held open by a generator may be closed from another context
+                self._current.set(parent)
+            self._record(span)
+
+    def _record(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+        for exporter in self.exporters:
+            try:
+                exporter(span)
+            except Exception as e:
+                print(f"Error exporting span: {e}")
+
+    def recent(self, trace_id: Optional[str] = None) -> List[Span]:
+        """
+        Get the spans in the ring buffer, oldest first.
+        Args:
+            trace_id (Optional[str]): Only return the spans of this trace.
+        Returns:
+            List[Span]: The spans.
+        """
+        with self._lock:
+            spans = list(self.spans)
+        if trace_id is not None:
+            spans = [span for span in spans if span.trace_id == trace_id]
+        return spans
+
+    def to_otlp(self, spans: Optional[List[Span]] = None) -> dict:
+        """
+        Build an OTLP/JSON export request, e.g. to POST to a collector's /v1/traces.
+        Args:
+            spans (Optional[List[Span]]): The spans to export. Defaults to the ring buffer.
+        Returns:
+            dict: The export request.
+        """
+        spans = self.recent() if spans is None else spans
+        return {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": [
+                            {
+                                "key": "service.name",
+                                "value": {"stringValue": TRACE_SERVICE_NAME},
+                            }
+                        ]
+                    },
+                    "scopeSpans": [
+                        {
+                            "scope": {"name": "tracing"},
+                            "spans": [span.to_otlp() for span in spans],
+                        }
+                    ],
+                }
+            ]
+        }
+
+
+class JsonlExporter:
+    """
+    Appends each finished span as a line of JSON to a file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def __call__(self, span: Span):
+        line = json.dumps(span.to_dict(), default=str)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+
+def in_current_context(function: Callable) -> Callable:
+    """
+    Bind a function to a copy of the current context, so that the spans it starts in
+    a worker thread nest under the active span. Bind once per call: a context cannot
+    be entered by two threads at the same time.
+    Args:
+        function (Callable): The function to bind.
+    Returns:
+        Callable: The bound function.
+    """
+    return functools.partial(contextvars.copy_context().run, function)
+
+
+tracer = Tracer()
+if TRACE_JSONL_FILE_PATH:
+    tracer.exporters.append(JsonlExporter(TRACE_JSONL_FILE_PATH))